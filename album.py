@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+앨범(미디어 그룹) 수집기
+- 앨범은 grouped_id가 같은 여러 개의 NewMessage 이벤트로 나뉘어 도착함
+- 같은 (chat_id, grouped_id)의 메시지를 마지막 조각 도착 후 window초 동안 모아 한 번에 처리 함수로 넘김
+- 앨범 최대 크기(10개)에 도달하면 기다리지 않고 바로 넘김
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_ALBUM_PARTS = 10
+
+
+class AlbumCollector:
+    def __init__(self, process, window=1.0):
+        self.process = process  # async def process(messages): 메시지 ID 순으로 정렬된 앨범 조각 목록
+        self.window = window
+        self._albums = {}  # (chat_id, grouped_id) -> (메시지 목록, 타이머 핸들)
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, message):
+        key = (message.chat_id, message.grouped_id)
+        parts, handle = self._albums.get(key, ([], None))
+        if any(m.id == message.id for m in parts):
+            return
+        if handle is not None:
+            handle.cancel()
+        self._albums.pop(key, None)
+        parts.append(message)
+        if len(parts) >= MAX_ALBUM_PARTS:
+            self._dispatch(parts)
+            return
+        handle = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        self._albums[key] = (parts, handle)
+
+    def _flush(self, key):
+        entry = self._albums.pop(key, None)
+        if entry is not None:
+            self._dispatch(entry[0])
+
+    def _dispatch(self, parts):
+        parts.sort(key=lambda m: m.id)
+        task = asyncio.create_task(self.process(parts))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"앨범 처리 중 오류 발생: {task.exception()}")
+
+    async def flush_all(self):
+        """기다리는 앨범을 모두 즉시 넘기고 처리가 끝날 때까지 기다립니다."""
+        for key in list(self._albums):
+            parts, handle = self._albums.pop(key)
+            handle.cancel()
+            self._dispatch(parts)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def wait_idle(self, poll=0.01):
+        """기다리는 앨범이 창이 끝나 넘겨지고 처리가 모두 끝날 때까지 기다립니다. (앨범을 앞당겨 넘기지 않음)"""
+        while self._albums or self._tasks:
+            if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+            else: await asyncio.sleep(poll)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+모니터링 핫 패스 성능 측정 스크립트
+- 텔레그램 계정 없이 실행 가능한 마이크로 벤치마크 모음
+- near_dup: 저장된 SimHash 지문 수에 따른 유사 중복 조회 지연 시간
+- rules: 규칙 수에 따른 규칙 엔진 매칭 시간 (개별 정규식 순차 검사와 비교)
+- logging: 출력이 느릴 때 동기 로깅과 큐 기반 로깅의 이벤트 루프 지연 비교
+- pipeline: 가짜 사용자/봇 클라이언트로 monitor.py의 전체 처리 경로(handler, 중복 검사, DB 기록, 전달)를
+  돌려 처리량, 종단 간 지연, 메모리 증가량, 전달 1건당 디스크 쓰기 측정 (replay.py)
+
+사용 예:
+    python benchmark.py near_dup --count 100000
+    python benchmark.py rules --rules 5000 --messages 2000
+    python benchmark.py logging --write-delay-ms 5
+    python benchmark.py pipeline --count 20000 --match-ratio 0.3 --duplicate-ratio 0.2
+    python benchmark.py pipeline --rate 200 --duration 30 --send-latency-ms 80
+"""
+
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, samples_sec):
+    print(f"{name}: n={len(samples_sec)} "
+          f"p50={percentile(samples_sec, 50) * 1e6:.1f}us "
+          f"p99={percentile(samples_sec, 99) * 1e6:.1f}us "
+          f"max={max(samples_sec) * 1e6:.1f}us")
+
+
+def bench_near_dup(args):
+    from near_dup import NearDuplicateIndex, simhash, FINGERPRINT_BITS
+
+    rng = random.Random(args.seed)
+    index = NearDuplicateIndex(args.threshold, ttl_seconds=10 ** 9)
+    print(f"지문 {args.count}개 저장 중 (임계값 {args.threshold}, 최대 해밍 거리 {index.max_distance})...")
+    stored = [rng.getrandbits(FINGERPRINT_BITS) for _ in range(args.count)]
+    started = time.perf_counter()
+    for fp in stored:
+        index.add(fp)
+    print(f"저장 완료: {time.perf_counter() - started:.2f}s")
+
+    near_hits, near_samples, miss_samples = 0, [], []
+    for _ in range(args.queries):
+        fp = rng.choice(stored)
+        for bit in rng.sample(range(FINGERPRINT_BITS), index.max_distance):
+            fp ^= 1 << bit
+        started = time.perf_counter()
+        found = index.find(fp)
+        near_samples.append(time.perf_counter() - started)
+        near_hits += found is not None
+
+        fp = rng.getrandbits(FINGERPRINT_BITS)
+        started = time.perf_counter()
+        index.find(fp)
+        miss_samples.append(time.perf_counter() - started)
+
+    report("유사 지문 조회", near_samples)
+    report("무작위 지문 조회", miss_samples)
+    print(f"유사 지문 적중률: {near_hits / args.queries:.1%}")
+
+    text = "🔥오픈채팅 홍보🔥 https://open.kakao.com/o/gAbCdEf 입장 코드 1234 가격 30,000원 선착순 모집중 " * 3
+    samples = []
+    for _ in range(200):
+        started = time.perf_counter()
+        simhash(text)
+        samples.append(time.perf_counter() - started)
+    report(f"SimHash 계산 ({len(text)}자)", samples)
+
+
+def _random_word(rng, alphabet, min_len=2, max_len=8):
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(min_len, max_len)))
+
+
+def bench_rules(args):
+    from rules import Rule, RuleSet, INCLUDE, EXCLUDE
+
+    rng = random.Random(args.seed)
+    hangul = [chr(c) for c in range(0xAC00, 0xAC00 + 400)]
+    latin = 'abcdefghijklmnopqrstuvwxyz'
+    terms = list({_random_word(rng, rng.choice((hangul, latin))) for _ in range(args.rules)})
+    half = len(terms) // 2
+    rules = [Rule('open_kakao', INCLUDE, terms=['open.kakao.com'])]
+    rules += [Rule(f"inc{i}", INCLUDE, terms=[t]) for i, t in enumerate(terms[:half])]
+    rules += [Rule(f"exc{i}", EXCLUDE, terms=[t]) for i, t in enumerate(terms[half:])]
+    # 서로 겹치는 포함/제외 정규식 규칙 (하나로 합친 정규식이면 먼저 매칭된 규칙에 가려짐)
+    rules += [Rule('kakao_room', INCLUDE, regex=[r'open\.kakao\.com/o/\w+']),
+              Rule('kakao_letters', INCLUDE, regex=[r'kakao\.com/o/[a-z]+']),
+              Rule('kakao_spam', EXCLUDE, regex=[r'kakao\.com/o/spam'])]
+
+    corpus = []
+    for _ in range(args.messages):
+        words = [_random_word(rng, rng.choice((hangul, latin))) for _ in range(rng.randint(10, 60))]
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(terms))
+        if rng.random() < 0.5:
+            words.append('https://open.kakao.com/o/' + ('spam' if rng.random() < 0.2 else '')
+                         + _random_word(rng, latin, 6, 8))
+        corpus.append(' '.join(words))
+    print(f"규칙 {len(rules)}개, 메시지 {len(corpus)}개 (평균 {sum(map(len, corpus)) // len(corpus)}자)")
+
+    started = time.perf_counter()
+    rule_set = RuleSet(rules)
+    print(f"규칙 컴파일: {time.perf_counter() - started:.3f}s")
+
+    engine_samples, engine_results = [], []
+    for text in corpus:
+        started = time.perf_counter()
+        result = rule_set.match(text)
+        engine_samples.append(time.perf_counter() - started)
+        engine_results.append((sorted(result.include), sorted(result.exclude)))
+    report("규칙 엔진 (단일 스캔)", engine_samples)
+
+    naive = [(r, re.compile(r.regex[0] if r.regex else re.escape(r.terms[0]), re.IGNORECASE)) for r in rules]
+    naive_samples, mismatches = [], 0
+    for text, expected in zip(corpus[:args.naive_messages], engine_results):
+        started = time.perf_counter()
+        include = sorted(r.name for r, p in naive if r.action == INCLUDE and p.search(text))
+        exclude = sorted(r.name for r, p in naive if r.action == EXCLUDE and p.search(text))
+        naive_samples.append(time.perf_counter() - started)
+        mismatches += (include, exclude) != expected
+    report("개별 정규식 순차 검사", naive_samples)
+    print(f"결과 불일치: {mismatches}건")
+
+
+class _SlowStream:
+    """write마다 delay초 동안 스레드를 막는 출력 (느린 디스크/journald 흉내)"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, data):
+        time.sleep(self.delay)
+        self.lines += 1
+
+    def flush(self):
+        pass
+
+
+async def _log_under_load(logger, lag_monitor, rate, duration):
+    lag_task = asyncio.create_task(lag_monitor.run())
+    text = "메시지 내용: https://open.kakao.com/o/gAbCdEf 입장 코드 1234 가격 30,000원 선착순 모집중"
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        logger.info("키워드 감지 (규칙: open_kakao): 채팅 / 보낸 사람")
+        logger.info(text)
+        await asyncio.sleep(1 / rate)
+    lag_task.cancel()
+
+
+def bench_logging(args):
+    from log_setup import setup_logging, TEXT_FORMAT
+    from loop_lag import LoopLagMonitor
+
+    root = logging.getLogger()
+    logger = logging.getLogger('bench')
+    print(f"출력 1줄당 {args.write_delay_ms}ms 지연, 초당 {args.rate}회 x 2줄, {args.duration}s")
+    for mode in ('sync', 'queue'):
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        stream = _SlowStream(args.write_delay_ms / 1000)
+        if mode == 'sync':
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+        else:
+            setup_logging(logging.INFO, stream=stream)
+        lag = LoopLagMonitor(interval=0.01, window=100000)
+        asyncio.run(_log_under_load(logger, lag, args.rate, args.duration))
+        print(f"{'동기 StreamHandler' if mode == 'sync' else 'QueueHandler + 리스너 스레드'}: "
+              f"루프 지연 {lag.format_stats()} (출력 {stream.lines}줄)")
+    for h in list(root.handlers):
+        root.removeHandler(h)
+
+
+def bench_pipeline(args):
+    import replay
+
+    data_dir = replay.prepare_environment(args.data_dir, args.rules, args.log_level, args.bots)
+    if args.input:
+        specs = replay.load_events(args.input)
+        speed = args.speed
+    else:
+        count = int(args.rate * args.duration) if args.rate and args.duration else args.count
+        specs = replay.synthetic_events(count, args.rate, args.match_ratio, args.duplicate_ratio, args.photo_ratio,
+                                        args.document_ratio, args.album_ratio, args.edit_ratio, args.chats,
+                                        seed=args.seed)
+        speed = 1.0 if args.rate else 0.0
+    monitor = replay.load_monitor()
+    pace = f"{speed:g}배속" if args.input else f"{args.rate:g}/s"
+    print(f"이벤트 {len(specs)}건 주입 ({pace if speed else '최대 속도'}, DB/로그: {data_dir})")
+    result = asyncio.run(replay.run(monitor, specs, speed=speed, send_latency=args.send_latency_ms / 1000,
+                                    bot_limits=args.bot_limits))
+    print(replay.format_result(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="모니터링 핫 패스 성능 측정")
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('near_dup', help="유사 중복 인덱스 조회 지연 시간")
+    p.add_argument('--count', type=int, default=100000, help="저장할 지문 수")
+    p.add_argument('--queries', type=int, default=10000, help="조회 횟수")
+    p.add_argument('--threshold', type=float, default=0.9, help="유사도 임계값")
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=bench_near_dup)
+
+    p = sub.add_parser('rules', help="규칙 엔진 매칭 시간")
+    p.add_argument('--rules', type=int, default=5000, help="생성할 규칙 수")
+    p.add_argument('--messages', type=int, default=2000, help="메시지 코퍼스 크기")
+    p.add_argument('--naive-messages', type=int, default=200, help="비교용 순차 검사에 사용할 메시지 수")
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=bench_rules)
+
+    p = sub.add_parser('logging', help="느린 로그 출력이 이벤트 루프 지연에 미치는 영향")
+    p.add_argument('--write-delay-ms', type=float, default=5.0, help="출력 1줄당 지연 (ms)")
+    p.add_argument('--rate', type=int, default=100, help="초당 로그 호출 횟수 (호출당 2줄)")
+    p.add_argument('--duration', type=float, default=3.0, help="측정 시간 (초)")
+    p.set_defaults(func=bench_logging)
+
+    p = sub.add_parser('pipeline', help="가짜 클라이언트로 전체 처리 경로의 처리량/지연 측정")
+    p.add_argument('--count', type=int, default=5000, help="합성 이벤트 수 (--rate와 --duration이 있으면 무시)")
+    p.add_argument('--rate', type=float, default=0.0, help="초당 주입 이벤트 수 (0이면 최대 속도)")
+    p.add_argument('--duration', type=float, default=0.0, help="--rate로 주입할 시간 (초)")
+    p.add_argument('--match-ratio', type=float, default=0.3, help="규칙에 매칭되는 메시지 비율")
+    p.add_argument('--duplicate-ratio', type=float, default=0.2, help="이전 본문을 반복하는 메시지 비율")
+    p.add_argument('--photo-ratio', type=float, default=0.1, help="사진 메시지 비율")
+    p.add_argument('--document-ratio', type=float, default=0.05, help="문서(2MB) 메시지 비율")
+    p.add_argument('--album-ratio', type=float, default=0.0, help="앨범(사진 2~4장) 비율")
+    p.add_argument('--edit-ratio', type=float, default=0.0, help="최근 메시지 수정 이벤트 비율 (1/4은 새 링크 추가)")
+    p.add_argument('--chats', type=int, default=50, help="출처 채팅 수")
+    p.add_argument('--send-latency-ms', type=float, default=0.0, help="가짜 봇 전송 1회당 지연 (ms)")
+    p.add_argument('--bot-limits', action='store_true', help="봇 전송 속도 제한(초당 30건 등)을 그대로 적용")
+    p.add_argument('--bots', type=int, default=1, help="봇 풀 크기 (가짜 봇 토큰 수)")
+    p.add_argument('--input', help="합성 대신 재생할 이벤트 JSONL 파일")
+    p.add_argument('--speed', type=float, default=0.0, help="--input의 재생 배속 (0이면 최대 속도)")
+    p.add_argument('--rules', help="사용할 규칙 파일 (기본: open.kakao.com 기본 규칙)")
+    p.add_argument('--data-dir', help="DB/로그를 둘 디렉터리 (기본: 새 임시 디렉터리)")
+    p.add_argument('--log-level', default='WARNING', help="monitor 로그 수준 (INFO면 로그 비용도 포함)")
+    p.add_argument('--seed', type=int, default=1)
+    p.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    if not getattr(args, 'func', None):
+        parser.print_help(); sys.exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
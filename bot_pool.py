@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+여러 봇 토큰으로 전송을 나누는 봇 풀
+- 봇마다 자기 세션, 전송 스케줄러(전역/채팅별 토큰 버킷), 대상별 엔티티를 가짐
+- 대상마다 그 대상에 접근할 수 있는 봇 중 FloodWait로 막히지 않고 대기열이 가장 짧은 봇을 먼저 사용
+- 전송이 실패하면 다음 봇으로 넘어가고(failover), 강퇴/권한 오류는 그 봇에서 대상을 제외,
+  토큰 폐기 같은 인증 오류는 그 봇을 풀에서 제외
+- 봇별 전송/실패/failover 통계 제공
+"""
+
+import logging
+from collections import Counter
+from telethon import errors
+
+logger = logging.getLogger(__name__)
+
+# 봇이 대상에 더 이상 보낼 수 없는 오류 (강퇴, 권한 없음, 비공개 전환 등)
+UNREACHABLE_ERRORS = (errors.ForbiddenError, errors.ChannelPrivateError, errors.ChannelInvalidError,
+                      errors.PeerIdInvalidError, errors.ChatIdInvalidError, errors.InputUserDeactivatedError)
+# 봇 자체를 쓸 수 없는 오류 (토큰 폐기/만료, 세션 중복)
+DISABLED_ERRORS = (errors.UnauthorizedError, errors.AccessTokenInvalidError, errors.AccessTokenExpiredError,
+                   errors.AuthKeyDuplicatedError)
+
+
+class BotSender:
+    """봇 하나의 클라이언트, 전송 스케줄러, 대상 키별 엔티티"""
+    __slots__ = ('name', 'client', 'scheduler', 'token', 'media_scope', 'entities', 'active', 'disabled')
+
+    def __init__(self, name, client, scheduler, token, media_scope=None):
+        self.name = name
+        self.client = client
+        self.scheduler = scheduler
+        self.token = token
+        self.media_scope = media_scope  # 미디어 캐시 구분 키 (봇이 올린 파일은 그 봇만 사용할 수 있음)
+        self.entities = {}
+        self.active = 0  # 진행 중인 전송 수
+        self.disabled = False
+
+
+class BotPool:
+    def __init__(self, senders):
+        self.senders = list(senders)
+        self.stats = {kind: Counter() for kind in ('sent', 'failed', 'failover', 'unreachable')}
+
+    def __len__(self):
+        return len(self.senders)
+
+    def __iter__(self):
+        return iter(self.senders)
+
+    @property
+    def primary(self):
+        return self.senders[0]
+
+    async def start(self):
+        """모든 봇을 로그인시킵니다. 일부 봇이 실패하면 제외하고, 모두 실패하면 마지막 오류를 그대로 올립니다."""
+        last_error = None
+        for sender in self.senders:
+            try:
+                await sender.client.start(bot_token=sender.token)
+                sender.disabled = False
+            except Exception as e:
+                if len(self.senders) == 1: raise
+                sender.disabled = True; last_error = e
+                logger.error(f"봇 {sender.name} 로그인 실패, 풀에서 제외합니다: {e}")
+        if all(s.disabled for s in self.senders):
+            raise last_error
+
+    async def resolve(self, key, resolve):
+        """모든 봇에서 대상을 해석합니다. resolve(client, key, purpose)는 엔티티나 None을 반환합니다."""
+        for sender in self.senders:
+            if sender.disabled: continue
+            entity = await resolve(sender.client, key, purpose=f"봇 {sender.name}용 대상({key})")
+            if entity is not None: sender.entities[key] = entity
+            else: sender.entities.pop(key, None)
+
+    def reachable(self, key):
+        return any(not s.disabled and key in s.entities for s in self.senders)
+
+    def candidates(self, key, prefer=None):
+        """
+        대상에 보낼 수 있는 봇을 FloodWait로 막히지 않은 봇, 대기열이 짧은 봇, 지금까지 덜 보낸 봇 순서로 반환합니다.
+        prefer(이미 미디어를 올린 봇 등)는 막히지 않았으면 맨 앞에 둡니다.
+        """
+        ranked = []
+        for sender in self.senders:
+            entity = sender.entities.get(key)
+            if sender.disabled or entity is None: continue
+            blocked, pending = sender.scheduler.backlog(entity)
+            ranked.append((blocked > 0, sender is not prefer, pending + sender.active, self.stats['sent'][sender.name],
+                           sender))
+        ranked.sort(key=lambda r: r[:4])
+        return [r[4] for r in ranked]
+
+    def record(self, sender, key, error=None):
+        """전송 결과를 기록하고, 대상에 접근할 수 없거나 봇을 쓸 수 없는 오류면 그 봇을 제외합니다."""
+        if error is None:
+            self.stats['sent'][sender.name] += 1; return
+        self.stats['failed'][sender.name] += 1
+        if isinstance(error, DISABLED_ERRORS):
+            sender.disabled = True
+            logger.error(f"봇 {sender.name}을 사용할 수 없어 풀에서 제외합니다: {error}")
+        elif isinstance(error, UNREACHABLE_ERRORS) and sender.entities.pop(key, None) is not None:
+            self.stats['unreachable'][sender.name] += 1
+            logger.warning(f"봇 {sender.name}이 대상 '{key}'에 보낼 수 없어 이 대상에서 제외합니다: {error}")
+
+    def failover(self, sender, key):
+        self.stats['failover'][sender.name] += 1
+        logger.warning(f"봇 {sender.name}의 '{key}' 전송 실패, 다른 봇으로 다시 시도합니다.")
+
+    def scheduler_stats(self):
+        """모든 봇의 전송 스케줄러 통계 합계"""
+        total = Counter()
+        for sender in self.senders: total.update(sender.scheduler.stats)
+        return total
+
+    def format_stats(self):
+        parts = []
+        for s in self.senders:
+            state = "제외됨" if s.disabled else f"대상 {len(s.entities)}개"
+            parts.append(f"{s.name}({state}): 전송 {self.stats['sent'][s.name]}, 실패 {self.stats['failed'][s.name]}, "
+                         f"failover {self.stats['failover'][s.name]}, {s.scheduler.format_stats()}")
+        return "; ".join(parts)
+
+    async def disconnect(self):
+        for sender in self.senders:
+            if sender.client.is_connected(): await sender.client.disconnect()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+실시간 업데이트 기록 (오프라인 재생/프로파일링용)
+- 수신한 메시지의 원문, 채팅/보낸 사람 ID, 미디어 종류, grouped_id, 수신 시각을 한 줄에 하나의 JSON으로 기록
+  (수정 이벤트는 edit: true)
+- 링크 추출과 규칙 매칭이 보는 숨은 링크(MessageEntityTextUrl)와 링크 미리보기 URL도 함께 기록하여
+  재생에서 실제와 같은 링크/중복 판단을 받음
+- 핸들러에서는 튜플을 목록에 넣기만 하고, 직렬화와 파일 쓰기는 flush()에서 한 번에 처리 (group commit)
+- 파일이 max_bytes를 넘으면 RotatingFileHandler처럼 .1, .2, ...로 교체
+- 기록한 파일은 replay.py로 다시 재생할 수 있음
+"""
+
+import os
+import json
+import time
+import logging
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+
+def media_kind(media):
+    if media is None: return None
+    if isinstance(media, types.MessageMediaPhoto): return 'photo'
+    if isinstance(media, types.MessageMediaDocument): return 'document'
+    if isinstance(media, types.MessageMediaWebPage): return 'webpage'
+    return 'other'
+
+
+class UpdateCapture:
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backup_count=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.captured = 0
+        self._pending = []
+        self._file = None
+
+    def open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        logger.info(f"업데이트 기록 중: {self.path}")
+
+    def add(self, message, edited=False):
+        """수신 시각과 함께 메시지의 재생에 필요한 필드만 보관합니다. (edited: 수정 이벤트)"""
+        media = message.media
+        photo = getattr(media, 'photo', None)
+        document = getattr(media, 'document', None)
+        media_id = getattr(photo or document, 'id', None)
+        size = getattr(document, 'size', None)  # 사진 크기는 재생 시 기본값 사용
+        text_urls = [(e.offset, e.length, e.url) for e in (message.entities or ())
+                     if isinstance(e, types.MessageEntityTextUrl)]
+        webpage = getattr(media, 'webpage', None)
+        preview_url = webpage.url if isinstance(webpage, types.WebPage) else None
+        self._pending.append((time.time(), message.chat_id, message.id, message.sender_id, message.message,
+                              media_kind(media), media_id, size, message.grouped_id, edited, text_urls, preview_url))
+
+    def flush(self):
+        if not self._pending or self._file is None:
+            return 0
+        pending, self._pending = self._pending, []
+        lines = []
+        for (ts, chat_id, msg_id, sender_id, text, media, media_id, size, grouped_id, edited,
+             text_urls, preview_url) in pending:
+            entry = {'ts': round(ts, 3), 'chat_id': chat_id, 'msg_id': msg_id, 'sender_id': sender_id, 'text': text}
+            if media: entry.update(media=media, media_id=media_id, size=size)
+            if text_urls: entry['text_urls'] = text_urls
+            if preview_url: entry['preview_url'] = preview_url
+            if grouped_id: entry['grouped_id'] = grouped_id
+            if edited: entry['edit'] = True
+            lines.append(json.dumps(entry, ensure_ascii=False))
+        try:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            logger.error(f"업데이트 기록 실패: {e}")
+            return 0
+        self.captured += len(pending)
+        return len(pending)
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src): os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+재시작 시 놓친 메시지 보충 (gap catch-up)
+- 채팅별로 마지막으로 처리한 메시지 ID를 SQLite(WAL)에 기록 (group commit)
+- 시작 시 기록된 ID 이후의 메시지를 iter_messages(min_id=...)로 가져와
+  실시간 메시지와 같은 처리 함수에 오래된 순서로 넘김
+- 여러 대화를 제한된 동시성으로 병렬 처리하고 FloodWait는 기다린 뒤 이어서 진행
+- 기록이 없는 채팅(처음 보는 채팅, 최초 실행)은 보충하지 않고 현재 위치부터 기록
+"""
+
+import time
+import sqlite3
+import asyncio
+import logging
+from telethon import errors
+
+logger = logging.getLogger(__name__)
+
+
+class CursorStore:
+    """chat_id -> 마지막으로 처리한 메시지 ID. advance()는 메모리에 즉시 반영하고 flush()에서 커밋합니다."""
+
+    def __init__(self, db_path, table='chat_cursors'):
+        self.db_path = db_path
+        self.table = table
+        self._cursors = {}
+        self._dirty = set()
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.db_path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                           "(chat_id INTEGER PRIMARY KEY, msg_id INTEGER NOT NULL, ts INTEGER NOT NULL)")
+        self._conn.commit()
+        self._cursors = dict(self._conn.execute(f"SELECT chat_id, msg_id FROM {self.table}"))
+        logger.info(f"채팅 처리 위치 로드: {len(self._cursors)}개 채팅")
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def get(self, chat_id):
+        return self._cursors.get(chat_id)
+
+    def snapshot(self):
+        return dict(self._cursors)
+
+    def advance(self, chat_id, msg_id):
+        """msg_id가 기록된 위치보다 뒤면 위치를 옮기고 True, 이미 처리한 위치면 False를 반환합니다."""
+        current = self._cursors.get(chat_id)
+        if current is not None and msg_id <= current:
+            return False
+        self._cursors[chat_id] = msg_id
+        self._dirty.add(chat_id)
+        return True
+
+    def flush(self):
+        if not self._dirty or self._conn is None:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        now = int(time.time())
+        rows = [(chat_id, self._cursors[chat_id], now) for chat_id in dirty]
+        try:
+            self._conn.executemany(f"INSERT OR REPLACE INTO {self.table} (chat_id, msg_id, ts) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"채팅 처리 위치 커밋 실패: {e}")
+            self._dirty |= dirty
+            return 0
+        return len(rows)
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
+
+
+class CatchUpResult:
+    __slots__ = ('dialogs', 'caught_up', 'messages', 'truncated', 'failed', 'seconds')
+
+    def __init__(self):
+        self.dialogs = 0  # 확인한 대화 수
+        self.caught_up = 0  # 놓친 메시지가 있던 대화 수
+        self.messages = 0  # 보충한 메시지 수
+        self.truncated = 0  # max_messages에 걸려 일부만 보충한 대화 수
+        self.failed = 0
+        self.seconds = 0.0
+
+
+async def _fetch_gap(client, entity, min_id, max_id, limit, max_flood_retries):
+    """(min_id, max_id] 구간의 메시지를 최신 limit개까지 가져와 오래된 순서로 반환합니다."""
+    for attempt in range(max_flood_retries + 1):
+        try:
+            messages = [m async for m in client.iter_messages(entity, min_id=min_id, max_id=max_id + 1, limit=limit)]
+            messages.reverse()
+            return messages
+        except errors.FloodWaitError as e:
+            if attempt >= max_flood_retries:
+                raise
+            logger.warning(f"보충 중 FloodWait {e.seconds}초: 대기 후 다시 시도합니다. ({attempt + 1}/{max_flood_retries})")
+            await asyncio.sleep(e.seconds)
+
+
+async def catch_up(client, cursors, since, process, concurrency=4, max_messages=1000, max_flood_retries=3,
+                   dialogs=None):
+    """
+    since(시작 시점의 chat_id -> 메시지 ID)보다 뒤에 올라온 메시지를 대화별로 가져와 process(message)에 넘깁니다.
+    대화 목록을 가져온 시점의 마지막 메시지까지만 보충하며, 그 뒤의 메시지는 실시간 핸들러가 처리합니다.
+    이미 불러온 대화 목록(dialogs)이 있으면 다시 요청하지 않고 사용합니다.
+    """
+    result = CatchUpResult()
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def backfill(dialog, min_id, max_id):
+        async with semaphore:
+            try:
+                messages = await _fetch_gap(client, dialog.entity, min_id, max_id, max_messages, max_flood_retries)
+            except Exception as e:
+                result.failed += 1
+                logger.error(f"'{dialog.name}' 놓친 메시지 조회 실패: {e}")
+                return
+        if len(messages) >= max_messages:
+            result.truncated += 1
+            logger.warning(f"'{dialog.name}'에서 놓친 메시지가 {max_messages}건을 넘어 최근 {max_messages}건만 보충합니다.")
+        result.caught_up += 1
+        for message in messages:
+            result.messages += 1
+            await process(message)
+
+    if dialogs is None:
+        dialogs = await client.get_dialogs()
+    tasks = []
+    for dialog in dialogs:
+        result.dialogs += 1
+        if dialog.message is None:
+            continue
+        top = dialog.message.id
+        last = since.get(dialog.id)
+        if last is None:
+            cursors.advance(dialog.id, top)
+        elif top > last:
+            tasks.append(asyncio.create_task(backfill(dialog, last, top)))
+    await asyncio.gather(*tasks)
+    result.seconds = time.monotonic() - started
+    return result
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+대화(채팅) 단위 허용/차단 목록과 대화별 통계
+- ALLOW_CHATS/DENY_CHATS의 숫자 ID와 @username을 시작 시 한 번 정수 peer id frozenset으로 해석
+- 핸들러는 텍스트를 보기 전에 event.chat_id로 집합 조회 한 번만 하여 판단
+  (허용 목록이 있으면 허용 목록에서 차단 목록을 뺀 집합에 있어야 통과, 없으면 차단 목록에 없어야 통과)
+- CHAT_SAMPLE의 대화별 비율만큼만 메시지를 처리 (msg_id의 곱셈 해시로 판단하므로 같은 메시지는
+  실시간/수정/보충/재생 어디서든 같은 판단을 받음)
+- 대화별 수신/규칙 매칭/차단 수를 세어 메시지는 많고 매칭률은 낮은 대화를 찾을 수 있게 함
+"""
+
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SCALE = 1 << 32  # 샘플링 비율을 32비트 해시와 비교할 정수 임계값으로 바꾸는 배율
+
+
+def parse_chat_list(value):
+    """쉼표로 구분한 채팅 목록을 숫자 ID(int)와 username(str)의 목록으로 만듭니다."""
+    items = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if item: items.append(int(item) if item.lstrip('-').isdigit() else item)
+    return items
+
+
+async def resolve_chat_ids(client, items, purpose):
+    """숫자 ID는 그대로, username은 peer id로 해석합니다. 해석하지 못한 항목은 로그를 남기고 건너뜁니다."""
+    ids = set()
+    for item in items:
+        if isinstance(item, int):
+            ids.add(item); continue
+        try: ids.add(await client.get_peer_id(item))
+        except Exception as e: logger.error(f"{purpose} 채팅 '{item}' 해석 오류: {e}")
+    return frozenset(ids)
+
+
+def build_chat_filter(allow_ids, deny_ids, allow_mode):
+    """
+    (허용 모드, peer id 집합)을 반환합니다. 허용 모드면 집합에 있는 채팅만, 아니면 집합에 없는 채팅만 통과하므로
+    통과 여부는 (chat_id in ids) is allow_mode 한 번으로 판단할 수 있습니다.
+    """
+    if allow_mode: return True, frozenset(allow_ids - deny_ids)
+    return False, frozenset(deny_ids)
+
+
+def parse_chat_samples(value):
+    """쉼표로 구분한 '채팅:비율' 목록을 (숫자 ID 또는 username, 비율) 목록으로 만듭니다. 형식이 틀리면 ValueError"""
+    items = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item: continue
+        chat, _, rate = item.rpartition(':')
+        chat, rate = chat.strip(), float(rate)
+        if not chat or not 0.0 <= rate <= 1.0: raise ValueError(f"샘플링 항목 '{item}'은 '채팅:0~1 비율' 형식이어야 합니다.")
+        items.append((int(chat) if chat.lstrip('-').isdigit() else chat, rate))
+    return items
+
+
+async def resolve_chat_samples(client, items):
+    """(채팅, 비율) 목록을 {peer id: 해시 임계값}으로 해석합니다. 해석하지 못한 항목은 로그를 남기고 건너뜁니다."""
+    thresholds = {}
+    for item, rate in items:
+        for chat_id in await resolve_chat_ids(client, [item], "샘플링"):
+            thresholds[chat_id] = sample_threshold(rate)
+    return thresholds
+
+
+def sample_threshold(rate):
+    return int(rate * SAMPLE_SCALE)
+
+
+def in_sample(msg_id, threshold):
+    """msg_id의 곱셈 해시(Knuth)가 임계값보다 작으면 처리합니다. 연속된 ID도 고르게 퍼지므로 비율이 정확합니다."""
+    return (msg_id * 2654435761) & 0xFFFFFFFF < threshold
+
+
+class ChatStats:
+    """대화별 수신/규칙 매칭/차단/샘플링으로 건너뛴 메시지 수"""
+
+    def __init__(self):
+        self.received = Counter()
+        self.matched = Counter()
+        self.filtered = Counter()
+        self.sampled_out = Counter()
+
+    def top(self, n=20):
+        """수신이 많은 순서로 (chat_id, 수신 수, 매칭률) 목록"""
+        return [(chat_id, count, self.matched[chat_id] / count) for chat_id, count in self.received.most_common(n)]
+
+    def format_top(self, name, n=5):
+        """name(chat_id)로 표시 이름을 구해 수신 상위 n개 대화를 요약합니다. (로그용)"""
+        parts = [f"{name(chat_id)} {count}건 (매칭률 {rate:.1%})" for chat_id, count, rate in self.top(n)]
+        summary = ", ".join(parts) or "없음"
+        if self.filtered:
+            summary += f" / 차단 {sum(self.filtered.values())}건 ({len(self.filtered)}개 대화)"
+        if self.sampled_out:
+            summary += f" / 샘플링 제외 {sum(self.sampled_out.values())}건 ({len(self.sampled_out)}개 대화)"
+        return summary
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+"""
+중복 전달 방지용 해시 저장소
+- SQLite WAL 모드를 사용하여 전달 기록을 1건씩 O(1)로 추가
+- 여러 건의 기록을 모아 한 번에 커밋 (group commit)
+- 만료된 기록은 DELETE 한 번으로 정리하며 파일 전체를 다시 쓰지 않음
+- 기존 forwarded_hashes.json 파일은 최초 1회 읽어서 이전(migration)
+- 여러 계정의 워커 프로세스가 같은 DB를 쓸 때는 ClaimStore로 전달할 메시지를 프로세스 간에 선점
+- 메모리 인덱스는 16바이트 digest와 정수 epoch 시각을 bytearray/array 링에 삽입 순서대로 보관하여
+  (항목당 약 45B) 만료 항목을 앞에서부터 O(1)로 제거하고 최대 개수를 넘으면 가장 오래된 항목부터 제거
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+from array import array
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16  # md5 digest
+
+
+class DedupIndex:
+    """
+    16바이트 digest와 epoch 초를 기록 순서대로 보관하는 array 기반 메모리 인덱스.
+    digest는 하나의 bytearray 링에, 시각은 array('q')에 두고, 조회는 항목 순번을 담은 open addressing 테이블
+    (array('q'), 선형 탐사)로 합니다. 같은 digest를 다시 기록하면 이전 슬롯을 비우고 맨 뒤에 새로 기록하므로
+    앞쪽이 항상 가장 오래된 항목입니다. 항목당 digest 16B, 시각 8B, 테이블 약 20B만 씁니다.
+    """
+    __slots__ = ('ttl_seconds', 'max_entries', 'evicted', '_capacity', '_head', '_tail', '_live',
+                 '_digests', '_timestamps', '_table', '_mask')
+
+    def __init__(self, ttl_seconds, max_entries=None, initial_capacity=1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._capacity = min(initial_capacity, max_entries) if max_entries else initial_capacity
+        self._head = 0  # 링에 남아 있는 가장 오래된 항목의 순번
+        self._tail = 0  # 다음에 기록할 항목의 순번
+        self._live = 0
+        self._digests = bytearray(DIGEST_SIZE * self._capacity)
+        self._timestamps = array('q', bytes(8 * self._capacity))  # 0이면 다시 기록되어 비워진 슬롯
+        # 최대 개수를 알면 테이블을 처음부터 그 크기로 만들어, 링을 늘릴 때 다시 해시하지 않습니다.
+        self._rehash(2 * (max_entries or self._capacity))
+
+    def __contains__(self, digest):
+        pos = self._find(digest)
+        return pos >= 0 and self._timestamps[(self._table[pos] - 1) % self._capacity] > time.time() - self.ttl_seconds
+
+    def __len__(self):
+        return self._live
+
+    def _home(self, digest):
+        return int.from_bytes(digest[:8], 'little') & self._mask
+
+    def _find(self, digest):
+        """digest가 있는 테이블 위치를 반환하고, 없으면 -1을 반환합니다."""
+        table, mask, digests, capacity = self._table, self._mask, self._digests, self._capacity
+        pos = self._home(digest)
+        while True:
+            entry = table[pos]
+            if not entry:
+                return -1
+            offset = (entry - 1) % capacity * DIGEST_SIZE
+            if digests[offset:offset + DIGEST_SIZE] == digest:
+                return pos
+            pos = (pos + 1) & mask
+
+    def _link(self, digest, seq):
+        table, mask = self._table, self._mask
+        pos = self._home(digest)
+        while table[pos]:
+            pos = (pos + 1) & mask
+        table[pos] = seq + 1
+
+    def _unlink(self, pos):
+        """선형 탐사 테이블에서 pos의 항목을 지우고 뒤따르는 항목을 당겨 빈칸을 메웁니다."""
+        table, mask, digests, capacity = self._table, self._mask, self._digests, self._capacity
+        hole = pos
+        while True:
+            pos = (pos + 1) & mask
+            entry = table[pos]
+            if not entry:
+                break
+            offset = (entry - 1) % capacity * DIGEST_SIZE
+            home = int.from_bytes(digests[offset:offset + 8], 'little') & mask
+            # 항목의 원래 위치(home)가 (hole, pos] 구간 밖이면 빈칸으로 옮길 수 있습니다.
+            if (hole < home <= pos) if hole < pos else (home > hole or home <= pos):
+                continue
+            table[hole] = entry
+            hole = pos
+        table[hole] = 0
+
+    def _rehash(self, size):
+        table_size = 1 << max(3, (size - 1).bit_length())
+        self._table = array('q', bytes(8 * table_size))
+        self._mask = table_size - 1
+        for seq in range(self._head, self._tail):
+            slot = seq % self._capacity
+            if self._timestamps[slot]:
+                self._link(self._digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE], seq)
+
+    def _grow(self, capacity):
+        """링 용량을 늘립니다. 테이블은 순번을 담고 있으므로 슬롯 위치만 옮기면 됩니다."""
+        old_capacity, head, tail = self._capacity, self._head, self._tail
+        digests, timestamps = bytearray(DIGEST_SIZE * capacity), array('q', bytes(8 * capacity))
+        seq = head
+        while seq < tail:
+            src, dst = seq % old_capacity, seq % capacity
+            n = min(tail - seq, old_capacity - src, capacity - dst)
+            digests[dst * DIGEST_SIZE:(dst + n) * DIGEST_SIZE] = self._digests[src * DIGEST_SIZE:(src + n) * DIGEST_SIZE]
+            timestamps[dst:dst + n] = self._timestamps[src:src + n]
+            seq += n
+        self._capacity, self._digests, self._timestamps = capacity, digests, timestamps
+        if 2 * capacity > len(self._table):
+            self._rehash(2 * capacity)
+
+    def add(self, digest, ts):
+        if self._tail - self._head == self._capacity:
+            if self.max_entries and self._capacity >= self.max_entries:
+                if self._remove_oldest():
+                    self.evicted += 1
+            else:
+                self._grow(min(self._capacity * 2, self.max_entries or self._capacity * 2))
+        pos = self._find(digest)
+        seq = self._tail
+        slot = seq % self._capacity
+        self._digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE] = digest
+        self._timestamps[slot] = ts
+        if pos >= 0:
+            self._timestamps[(self._table[pos] - 1) % self._capacity] = 0
+            self._table[pos] = seq + 1
+        else:
+            self._link(digest, seq)
+            self._live += 1
+        self._tail = seq + 1
+
+    def _remove_oldest(self):
+        """가장 오래된 슬롯을 비우고, 살아 있는 항목이었으면 True를 반환합니다."""
+        slot = self._head % self._capacity
+        self._head += 1
+        if not self._timestamps[slot]:
+            return False
+        self._timestamps[slot] = 0
+        self._unlink(self._find(bytes(self._digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE])))
+        self._live -= 1
+        return True
+
+    def sweep(self, now=None):
+        """앞쪽부터 만료된 항목을 제거하고 제거한 개수를 반환합니다."""
+        cutoff = (now if now is not None else time.time()) - self.ttl_seconds
+        timestamps = self._timestamps
+        removed = 0
+        while self._head < self._tail and timestamps[self._head % self._capacity] <= cutoff:
+            removed += self._remove_oldest()
+        return removed
+
+    def memory_usage(self):
+        """인덱스가 차지하는 메모리(bytes)를 계산합니다."""
+        return sys.getsizeof(self._digests) + sys.getsizeof(self._timestamps) + sys.getsizeof(self._table)
+
+
+class HashStore:
+    """
+    메모리 조회용 DedupIndex와 SQLite 영속 저장소를 함께 관리합니다.
+    add()는 메모리에 즉시 반영하고 디스크 기록은 batch_size 단위 또는 flush() 호출 시 커밋합니다.
+    DB에는 digest를 hex 문자열로 저장하며, table을 다르게 지정하면 같은 DB 파일에 독립된 저장소를 둘 수 있습니다.
+    """
+
+    def __init__(self, db_path, ttl_seconds=24 * 3600, batch_size=50, max_entries=None, table='forwarded_hashes'):
+        self.db_path = db_path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.index = DedupIndex(ttl_seconds, max_entries)
+        self._pending = []
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.db_path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (hash TEXT PRIMARY KEY, ts INTEGER NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_ts ON {self.table} (ts)")
+        self._conn.commit()
+        expired = self.purge_expired()
+        cutoff = int(time.time()) - self.ttl_seconds
+        rows = self._conn.execute(f"SELECT hash, ts FROM {self.table} WHERE ts > ? ORDER BY ts", (cutoff,))
+        for h, ts in rows:
+            self.index.add(bytes.fromhex(h), ts)
+        logger.info(f"해시 DB 로드 ({self.table}): {len(self.index)}개 기록 불러옴 (만료된 {expired}개 정리)")
+
+    def migrate_json(self, json_path):
+        """기존 JSON 해시 DB를 한 번만 읽어 SQLite로 옮기고 원본은 .migrated로 이름을 바꿉니다."""
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            cutoff = int(time.time()) - self.ttl_seconds
+            rows = []
+            for h, ts_str in data.items():
+                ts = int(datetime.fromisoformat(ts_str).timestamp())
+                if ts > cutoff:
+                    rows.append((h, ts))
+            rows.sort(key=lambda row: row[1])
+            self._conn.executemany(f"INSERT OR REPLACE INTO {self.table} (hash, ts) VALUES (?, ?)", rows)
+            self._conn.commit()
+            for h, ts in rows:
+                self.index.add(bytes.fromhex(h), ts)
+            os.replace(json_path, json_path + '.migrated')
+            logger.info(f"JSON 해시 DB 이전 완료: {len(rows)}개 기록 (만료된 {len(data) - len(rows)}개 제외)")
+            return len(rows)
+        except Exception as e:
+            logger.error(f"JSON 해시 DB 이전 실패: {e}")
+            return 0
+
+    def __contains__(self, digest):
+        return digest in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, digest, ts=None):
+        ts = int(ts if ts is not None else time.time())
+        self.index.add(digest, ts)
+        self._pending.append((digest.hex(), ts))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """대기 중인 기록을 하나의 트랜잭션으로 커밋합니다."""
+        if not self._pending or self._conn is None:
+            return 0
+        pending, self._pending = self._pending, []
+        try:
+            self._conn.executemany(f"INSERT OR REPLACE INTO {self.table} (hash, ts) VALUES (?, ?)", pending)
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"해시 DB 커밋 실패: {e}")
+            self._pending = pending + self._pending
+            return 0
+        return len(pending)
+
+    def purge_expired(self):
+        """TTL이 지난 기록을 메모리와 DB에서 삭제합니다."""
+        cutoff = int(time.time()) - self.ttl_seconds
+        expired = self.index.sweep()
+        if self._conn is None:
+            return expired
+        try:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE ts <= ?", (cutoff,))
+            self._conn.commit()
+            return max(cur.rowcount, expired)
+        except sqlite3.Error as e:
+            logger.error(f"만료 해시 정리 실패: {e}")
+            return expired
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
+
+
+class ClaimStore:
+    """
+    여러 프로세스(계정별 워커)가 같은 DB 파일로 전달할 메시지를 선점하는 저장소.
+    claim()은 확인과 기록을 BEGIN IMMEDIATE 트랜잭션 하나로 처리하므로, 같은 메시지를 여러 계정이 동시에 받아도
+    한 프로세스만 선점에 성공합니다. 다른 프로세스의 선점이 만료되었거나 자신의 선점이면 다시 선점할 수 있습니다.
+    """
+
+    def __init__(self, db_path, owner, table='claims'):
+        self.db_path = db_path
+        self.owner = owner
+        self.table = table
+        self.stats = Counter()
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                           "(hash TEXT PRIMARY KEY, owner TEXT NOT NULL, expires INTEGER NOT NULL)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_expires ON {self.table} (expires)")
+        expired = self.purge_expired()
+        logger.info(f"공유 선점 저장소 열림 ({self.owner}, 만료된 {expired}개 정리)")
+
+    def claim(self, groups, exclusive=None):
+        """
+        groups는 (digest 목록, TTL 초)의 목록입니다. 그룹마다 새로 선점한 키가 하나라도 있거나 키가 없으면 True인 목록을
+        반환합니다. exclusive(digest, TTL)를 주면 먼저 그 키를 선점하고, 다른 프로세스가 이미 선점했으면 아무것도
+        기록하지 않고 None을 반환합니다. DB 오류가 나면 전달을 놓치지 않도록 모두 선점한 것으로 봅니다.
+        """
+        if self._conn is None:
+            return [True] * len(groups)
+        now = int(time.time())
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if exclusive is not None and not self._claim_keys([exclusive[0]], exclusive[1], now):
+                conn.execute("ROLLBACK")
+                self.stats['conflict'] += 1
+                return None
+            results = [not keys or self._claim_keys(keys, ttl, now) for keys, ttl in groups]
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.stats['error'] += 1
+            logger.error(f"공유 선점 실패: {e}")
+            return [True] * len(groups)
+        for claimed in results:
+            self.stats['claimed' if claimed else 'conflict'] += 1
+        return results
+
+    def _claim_keys(self, keys, ttl, now):
+        claimed = False
+        for key in keys:
+            h = key.hex()
+            row = self._conn.execute(f"SELECT owner, expires FROM {self.table} WHERE hash = ?", (h,)).fetchone()
+            if row is not None and row[1] > now and row[0] != self.owner:
+                continue
+            self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (hash, owner, expires) VALUES (?, ?, ?)",
+                               (h, self.owner, now + ttl))
+            claimed = True
+        return claimed
+
+    def purge_expired(self):
+        if self._conn is None:
+            return 0
+        try:
+            return self._conn.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (int(time.time()),)).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"만료 선점 정리 실패: {e}")
+            return 0
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""
+수정된 메시지 재평가용 판단 캐시
+- 최근 메시지의 (chat_id, msg_id)별로 마지막으로 본 본문 digest와 지금까지 판단에 쓴 링크 키를 LRU로 보관
+- 본문이 바뀌지 않은 수정(반응, 조회 수 등으로 오는 수정 이벤트)은 규칙 매칭 없이 건너뜀
+- 이전 판단에 없던 링크가 생긴 수정만 전달 단계로 넘기므로, 같은 메시지를 반복 수정해도 같은 링크로 다시 일하지 않음
+- 캐시에서 밀려난 메시지는 링크가 모두 새것으로 취급되지만, 이미 전달한 링크는 중복 검사(링크 DB)에서 걸러짐
+"""
+
+from collections import OrderedDict
+
+
+class EditDecisionCache:
+    """(chat_id, msg_id) -> (본문 digest 또는 None, 링크 키 frozenset) LRU"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def record(self, key, links, digest=None):
+        """
+        링크 키를 이전에 기록한 링크와 합쳐 저장합니다. digest가 None이면 기존 digest를 유지합니다.
+        (새 메시지는 digest 없이 링크만 기록하여 핫 패스에서 해시를 계산하지 않음)
+        """
+        entries = self._entries
+        previous = entries.get(key)
+        if previous is not None:
+            entries.move_to_end(key)
+            links = previous[1].union(links) if links else previous[1]
+            if digest is None: digest = previous[0]
+        entries[key] = (digest, frozenset(links))
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def format_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{len(self._entries)}개, 적중률 {rate:.1f}% ({self.hits}/{total})"
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+채팅/사용자 표시 이름 캐시
+- 시작 시 get_dialogs()로 모든 대화의 엔티티를 미리 불러와 peer id 기준으로 보관
+- 표시 이름은 TTL이 있는 LRU에 메모이즈하여 메시지마다 네트워크 요청 없이 조회
+- 채팅 제목 변경(ChatAction), 사용자 이름 변경(UpdateUserName) 이벤트로 갱신
+- 조회 적중률 통계 제공
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from telethon import utils
+
+logger = logging.getLogger(__name__)
+
+
+def display_name(entity):
+    """엔티티의 표시 이름 (채팅 제목, 사용자 이름, @username, id 순)"""
+    try:
+        if getattr(entity, 'title', None): return entity.title
+        if getattr(entity, 'first_name', None): return f"{entity.first_name} {entity.last_name or ''}".strip()
+        if getattr(entity, 'username', None): return f"@{entity.username}"
+        return str(entity.id)
+    except Exception: return "알 수 없음"
+
+
+class EntityCache:
+    """peer id -> 표시 이름 LRU (TTL). 만료되거나 없는 이름은 넘겨받은 엔티티로 다시 계산합니다."""
+
+    def __init__(self, ttl_seconds=3600, max_entries=20000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        self._names = OrderedDict()  # peer id -> (이름, 만료 시각)
+
+    def __len__(self):
+        return len(self._names)
+
+    def set_name(self, peer_id, name):
+        names = self._names
+        if peer_id in names:
+            names.move_to_end(peer_id)
+        names[peer_id] = (name, time.monotonic() + self.ttl_seconds)
+        if len(names) > self.max_entries:
+            names.popitem(last=False)
+
+    def add(self, entity):
+        self.set_name(utils.get_peer_id(entity), display_name(entity))
+
+    def name(self, peer_id, entity=None, default="알 수 없음"):
+        """
+        캐시된 이름을 반환합니다. 없거나 만료되었으면 entity(메시지에 함께 온 엔티티)로 계산해 저장하고,
+        entity도 없으면 default를 반환합니다. 네트워크 요청은 하지 않습니다.
+        """
+        cached = self._names.get(peer_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self._names.move_to_end(peer_id)
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        if entity is None:
+            return cached[0] if cached is not None else default
+        name = display_name(entity)
+        self.set_name(peer_id, name)
+        return name
+
+    def rename(self, peer_id, name):
+        """이름 변경 이벤트로 받은 새 이름을 반영합니다."""
+        self.set_name(peer_id, name)
+        self.refreshed += 1
+
+    async def warm(self, client):
+        """모든 대화를 불러와 이름을 캐시하고 대화 목록을 반환합니다. (Telethon 세션 엔티티 캐시도 함께 채워짐)"""
+        started = time.monotonic()
+        dialogs = await client.get_dialogs()
+        for dialog in dialogs:
+            self.set_name(dialog.id, dialog.name)
+        logger.info(f"대화 {len(dialogs)}개의 엔티티를 미리 불러왔습니다. ({time.monotonic() - started:.1f}s)")
+        return dialogs
+
+    def format_stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"{len(self)}개, 적중률 {rate:.1%} ({self.hits}/{total}), 이벤트 갱신 {self.refreshed}회"
@@ -18,6 +18,16 @@ import subprocess
 import signal
 from pathlib import Path
 
+def lock_file_patterns():
+    """
+    monitor.py가 세션마다 만드는 프로세스 잠금 파일 (sessions/<세션 이름>.lock)
+    """
+    patterns = [os.path.join('sessions', '*.lock')]
+    session_name = os.getenv('SESSION_NAME')
+    if session_name and os.path.isabs(session_name):
+        patterns.append(f"{session_name}.lock")
+    return patterns
+
 def force_kill_processes():
     """
     모든 관련 프로세스를 강제로 종료
@@ -72,15 +82,13 @@ def unlock_and_remove_sessions():
     """
     print("\n=== 세션 파일 정리 ===")
     
-    # 모든 가능한 세션 파일 패턴
+    # 모든 가능한 세션 파일 패턴 (세션의 -wal/-shm/-journal 파일은 *.session*에 포함)
+    # forwarded_hashes.db(중복 검사 기록)와 outbox.db(미전달 메시지)는 잠금과 무관하므로 지우지 않습니다.
     session_patterns = [
         "*.session*",
         "telegram_session*",
         "bot_session*",
-        "monitor.lock",
-        "*.db*",
-        "*-wal",
-        "*-shm"
+        *lock_file_patterns()
     ]
     
     removed_files = []
@@ -168,7 +176,7 @@ def verify_cleanup():
         print("✓ monitor.py 프로세스 없음")
     
     # 세션 파일 확인
-    session_files = glob.glob("*.session*") + glob.glob("*monitor.lock*")
+    session_files = glob.glob("*.session*") + [f for pattern in lock_file_patterns() for f in glob.glob(pattern)]
     if session_files:
         print("⚠️  남은 세션 파일:")
         for f in session_files:
@@ -233,4 +241,4 @@ if __name__ == "__main__":
         print("수동으로 다음을 실행해보세요:")
         print("sudo pkill -f monitor.py")
         print("sudo systemctl stop telegram-monitor-bot.service")
-        print("rm -f *.session* monitor.lock") 
\ No newline at end of file
+        print("rm -f *.session* sessions/*.lock") 
\ No newline at end of file
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+open.kakao.com 링크 추출 및 정규화 모듈
+- 메시지 본문, 숨은 링크(MessageEntityTextUrl), 링크 미리보기(웹페이지)에서 링크 추출
+- 스킴, 호스트 대소문자, www., 쿼리/프래그먼트, 끝 슬래시, 뒤에 붙은 한글/기호를 제거한
+  정규화된 형태(open.kakao.com/o/<코드>)로 변환
+- 오픈채팅 코드는 대소문자를 구분하므로 경로는 그대로 유지
+"""
+
+import re
+import hashlib
+from telethon.tl.types import MessageEntityTextUrl, MessageMediaWebPage, WebPage
+
+KAKAO_HOST = 'open.kakao.com'
+# 스킴/www.는 선택, 경로는 URL에 쓰일 수 있는 문자까지만 (뒤에 붙은 한글/괄호는 제외)
+LINK_PATTERN = re.compile(r'(?:https?://)?(?:www\.)?open\.kakao\.com((?:/[A-Za-z0-9_\-.~%]*)*)', re.IGNORECASE)
+# /o/<코드> (오픈채팅방), /me/<이름> (오픈프로필)
+_PATH_PATTERN = re.compile(r'^/+(o|me)/+([A-Za-z0-9_\-]+)', re.IGNORECASE)
+
+
+def canonicalize_link(path):
+    """open.kakao.com 뒤의 경로를 정규화된 링크 문자열로 변환합니다."""
+    match = _PATH_PATTERN.match(path or '')
+    if match:
+        return f"{KAKAO_HOST}/{match.group(1).lower()}/{match.group(2)}"
+    path = (path or '').rstrip('/.')
+    return f"{KAKAO_HOST}{path}" if path else None
+
+
+def extract_links_from_text(text):
+    links = []
+    for match in LINK_PATTERN.finditer(text or ''):
+        link = canonicalize_link(match.group(1))
+        if link:
+            links.append(link)
+    return links
+
+
+def hidden_link_urls(message):
+    """본문에 보이지 않는 링크(숨은 링크, 링크 미리보기)의 URL 목록을 반환합니다."""
+    urls = [e.url for e in (message.entities or ()) if isinstance(e, MessageEntityTextUrl)]
+    if isinstance(message.media, MessageMediaWebPage) and isinstance(message.media.webpage, WebPage):
+        urls.append(message.media.webpage.url)
+    return urls
+
+
+def message_scan_text(message):
+    """규칙 매칭에 사용할 텍스트: 본문 뒤에 숨은 링크 URL을 덧붙입니다."""
+    text = message.raw_text or ""
+    hidden_urls = hidden_link_urls(message)
+    return "\n".join([text, *hidden_urls]) if hidden_urls else text
+
+
+def extract_links(message, text=None):
+    """메시지에서 중복 없는 정규화 링크 목록을 등장 순서대로 반환합니다."""
+    links = extract_links_from_text(message.raw_text if text is None else text)
+    for url in hidden_link_urls(message):
+        links.extend(extract_links_from_text(url))
+    return list(dict.fromkeys(links))
+
+
+def link_key(link):
+    return hashlib.md5(link.encode('utf-8')).digest()
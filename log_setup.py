@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+이벤트 루프를 막지 않는 로깅 설정
+- 로거에는 QueueHandler만 붙이고, 실제 파일/콘솔 쓰기는 QueueListener 스레드에서 처리
+  (디스크나 stdout이 느려져도 asyncio 루프는 큐에 넣기만 하고 바로 돌아감)
+- 로그 파일은 크기 기준으로 교체 (RotatingFileHandler)
+- 선택적으로 한 줄에 하나의 JSON 객체로 기록
+"""
+
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """ts, level, logger, message (예외가 있으면 exc_info) 필드를 가진 JSON 한 줄"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """큐가 가득 차면 기다리지 않고 로그를 버리고 버린 개수를 셉니다."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=logging.INFO, log_file=None, json_format=False, max_bytes=10 * 1024 * 1024,
+                  backup_count=5, queue_size=10000, stream=None):
+    """
+    루트 로거에 QueueHandler를 설치하고 파일/콘솔 핸들러를 가진 QueueListener를 시작합니다.
+    큐가 가득 차면(queue_size) 루프를 막지 않도록 해당 로그를 버립니다.
+    버린 로그 수(dropped)를 확인할 수 있도록 설치한 QueueHandler를 반환합니다. 리스너는 종료 시 자동으로 멈춥니다.
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                             encoding='utf-8'))
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio 이벤트 루프 지연 측정
+- interval초마다 sleep을 예약하고 실제로 깨어난 시각과의 차이를 지연으로 기록
+- 로그 쓰기나 동기 I/O가 루프를 막으면 지연이 커짐
+"""
+
+import time
+import asyncio
+from collections import deque
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.25, window=2400):
+        self.interval = interval
+        self.samples = deque(maxlen=window)  # 최근 window개 지연 (초)
+        self.max = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            if lag > self.max: self.max = lag
+
+    def percentile(self, pct):
+        if not self.samples: return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def format_stats(self):
+        return (f"p50 {self.percentile(50) * 1000:.1f}ms, p99 {self.percentile(99) * 1000:.1f}ms, "
+                f"최대 {self.max * 1000:.1f}ms")
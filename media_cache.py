@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+봇이 이미 업로드한 미디어의 재사용 캐시
+- 원본 사진/문서의 (id, access_hash)를 키로 봇 쪽 미디어(InputPhoto/InputDocument)를 보관
+- 받은 뒤 업로드하는 미디어(사진, 크기를 모르는 문서)는 내용 해시로도 찾아
+  다른 사람이 같은 이미지를 새로 올린 경우에도 재사용
+- 캐시에 있으면 다운로드/업로드 없이 파일 참조만으로 전송
+- SQLite(WAL)에 기록하여 재시작 후에도 유지 (group commit), TTL과 최대 개수를 넘으면 오래된 항목부터 제거
+- 봇이 올린 파일은 그 봇만 쓸 수 있으므로 항목은 항상 봇 ID로 구분 (구분 없이 기록된 이전 항목은 열 때 옮김)
+"""
+
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+PHOTO = 'photo'
+DOCUMENT = 'document'
+
+
+def source_key(media):
+    """원본 메시지 미디어의 캐시 키 (지원하지 않는 미디어면 None)"""
+    if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+        return f"{PHOTO}:{media.photo.id}:{media.photo.access_hash}"
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+        return f"{DOCUMENT}:{media.document.id}:{media.document.access_hash}"
+    return None
+
+
+def scoped_key(key, scope):
+    """봇별 캐시 키 (scope가 없으면 키 그대로)"""
+    return f"{scope}:{key}" if scope and key else key
+
+
+class _Entry:
+    __slots__ = ('content_hash', 'kind', 'media_id', 'access_hash', 'file_reference', 'size', 'ts')
+
+    def __init__(self, content_hash, kind, media_id, access_hash, file_reference, size, ts):
+        self.content_hash = content_hash
+        self.kind = kind
+        self.media_id = media_id
+        self.access_hash = access_hash
+        self.file_reference = file_reference
+        self.size = size
+        self.ts = ts
+
+    def input_media(self):
+        if self.kind == PHOTO:
+            return types.InputMediaPhoto(types.InputPhoto(self.media_id, self.access_hash, self.file_reference))
+        return types.InputMediaDocument(types.InputDocument(self.media_id, self.access_hash, self.file_reference))
+
+
+class MediaCache:
+    def __init__(self, db_path, ttl_seconds=7 * 24 * 3600, max_entries=20000, batch_size=50, table='media_cache'):
+        self.db_path = db_path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.content_hits = 0
+        self.misses = 0  # 캐시에 없어 실제로 업로드한 횟수 (transfer_media에서 기록)
+        self.saved_bytes = 0
+        self._entries = OrderedDict()  # source key -> _Entry (오래 사용하지 않은 순서)
+        self._by_content = {}  # 내용 해시 -> source key
+        self._pending = []
+        self._conn = None
+
+    def open(self, legacy_scope=None):
+        """
+        legacy_scope를 주면 봇 구분 없이 기록된 이전 항목(원본 키가 photo:/document:로 시작)을
+        그 봇의 항목으로 옮깁니다. (이전에는 기본 봇의 항목에 구분 키를 붙이지 않았음)
+        """
+        self._conn = sqlite3.connect(self.db_path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (source_key TEXT PRIMARY KEY, content_hash TEXT, "
+                           "kind TEXT NOT NULL, media_id INTEGER NOT NULL, access_hash INTEGER NOT NULL, "
+                           "file_reference BLOB, size INTEGER, ts INTEGER NOT NULL)")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_ts ON {self.table} (ts)")
+        cutoff = int(time.time()) - self.ttl_seconds
+        self._conn.execute(f"DELETE FROM {self.table} WHERE ts <= ?", (cutoff,))
+        if legacy_scope:
+            prefix = f"{legacy_scope}:"
+            migrated = self._conn.execute(
+                f"UPDATE OR REPLACE {self.table} SET source_key = ? || source_key, "
+                "content_hash = CASE WHEN content_hash IS NULL THEN NULL ELSE ? || content_hash END "
+                f"WHERE source_key LIKE '{PHOTO}:%' OR source_key LIKE '{DOCUMENT}:%'", (prefix, prefix)).rowcount
+            if migrated: logger.info(f"미디어 캐시: 봇 구분 없는 이전 항목 {migrated}개를 봇 {legacy_scope}의 항목으로 옮김")
+        self._conn.commit()
+        rows = self._conn.execute(f"SELECT source_key, content_hash, kind, media_id, access_hash, file_reference, "
+                                  f"size, ts FROM {self.table} ORDER BY ts DESC LIMIT ?", (self.max_entries,))
+        for row in reversed(rows.fetchall()):
+            self._remember(row[0], _Entry(*row[1:]))
+        logger.info(f"미디어 캐시 로드: {len(self._entries)}개")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, entry):
+        entries = self._entries
+        old = entries.pop(key, None)
+        if old is not None and old.content_hash:
+            self._by_content.pop(old.content_hash, None)
+        entries[key] = entry
+        if entry.content_hash:
+            self._by_content[entry.content_hash] = key
+        while len(entries) > self.max_entries:
+            evicted_key, evicted = entries.popitem(last=False)
+            if evicted.content_hash and self._by_content.get(evicted.content_hash) == evicted_key:
+                del self._by_content[evicted.content_hash]
+
+    def _lookup(self, key):
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            return None
+        if entry.ts <= time.time() - self.ttl_seconds:
+            self.discard(key)
+            return None
+        self._entries.move_to_end(key)
+        self.saved_bytes += entry.size or 0
+        return entry.input_media()
+
+    def get(self, key):
+        """원본 미디어 키로 봇 쪽 InputMedia를 찾습니다."""
+        media = self._lookup(key)
+        if media is not None: self.hits += 1
+        return media
+
+    def get_by_content(self, content_hash):
+        """내용 해시로 봇 쪽 InputMedia를 찾습니다. (원본 키 조회가 실패한 뒤의 대안)"""
+        media = self._lookup(self._by_content.get(content_hash))
+        if media is not None: self.content_hits += 1
+        return media
+
+    def put(self, key, content_hash, sent_media, size=None):
+        """봇이 보낸 메시지의 미디어를 원본 키(와 내용 해시)로 기록합니다."""
+        if key is None:
+            return
+        if isinstance(sent_media, types.MessageMediaPhoto) and isinstance(sent_media.photo, types.Photo):
+            kind, obj = PHOTO, sent_media.photo
+        elif isinstance(sent_media, types.MessageMediaDocument) and isinstance(sent_media.document, types.Document):
+            kind, obj = DOCUMENT, sent_media.document
+        else:
+            return
+        entry = _Entry(content_hash, kind, obj.id, obj.access_hash, obj.file_reference, size, int(time.time()))
+        self._remember(key, entry)
+        self._pending.append((key, content_hash, kind, obj.id, obj.access_hash, obj.file_reference, size, entry.ts))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def discard(self, *keys):
+        """파일 참조가 만료되는 등 더 이상 쓸 수 없는 항목을 제거합니다."""
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                continue
+            if entry.content_hash and self._by_content.get(entry.content_hash) == key:
+                del self._by_content[entry.content_hash]
+            self._pending.append((key, None))
+
+    def flush(self):
+        if not self._pending or self._conn is None:
+            return 0
+        pending, self._pending = self._pending, []
+        try:
+            with self._conn:
+                for row in pending:
+                    if len(row) == 2:
+                        self._conn.execute(f"DELETE FROM {self.table} WHERE source_key = ?", (row[0],))
+                    else:
+                        self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (source_key, content_hash, kind, "
+                                           "media_id, access_hash, file_reference, size, ts) "
+                                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+                cutoff = int(time.time()) - self.ttl_seconds
+                self._conn.execute(f"DELETE FROM {self.table} WHERE ts <= ?", (cutoff,))
+        except sqlite3.Error as e:
+            logger.error(f"미디어 캐시 커밋 실패: {e}")
+            self._pending = pending + self._pending
+            return 0
+        return len(pending)
+
+    def format_stats(self):
+        total = self.hits + self.content_hits + self.misses
+        return (f"{len(self)}개, 재사용 {self.hits + self.content_hits}/{total}건 "
+                f"(내용 해시 {self.content_hits}건), 절약 {self.saved_bytes // 1024}KB")
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+임시 파일 없이 사용자 클라이언트의 미디어를 봇 클라이언트로 전달하는 모듈
+- client.iter_download로 받은 청크를 메모리 파이프(크기 제한 큐)를 통해 바로 봇 업로드로 넘김
+- 업로드 파트는 여러 워커가 병렬로 전송
+- 파일 크기를 미리 알 수 없는 경우에만 SpooledTemporaryFile로 받아서 업로드
+  (spool_threshold 이하는 메모리, 초과분만 디스크 사용)
+- 미디어 캐시(MediaCache)가 있으면 봇이 이미 올린 같은 미디어는 다운로드/업로드 없이 재사용
+"""
+
+import asyncio
+import hashlib
+import logging
+import random
+import tempfile
+from telethon.tl import functions, types
+from media_cache import source_key, scoped_key
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # 다운로드 요청/업로드 파트 크기 (Telegram 최대값)
+BIG_FILE_SIZE = 10 * 1024 * 1024  # 이 크기를 넘으면 SaveBigFilePart 사용
+
+
+class UploadedMedia:
+    """
+    봇 쪽에 업로드가 끝난 미디어와 send_file에 넘길 속성.
+    cached이면 file은 캐시에서 찾은 InputMediaPhoto/InputMediaDocument입니다.
+    """
+    __slots__ = ('file', 'attributes', 'mime_type', 'size', 'source_key', 'content_hash', 'cached')
+
+    def __init__(self, file, attributes=None, mime_type=None, size=None, source_key=None, content_hash=None,
+                 cached=False):
+        self.file = file
+        self.attributes = attributes
+        self.mime_type = mime_type
+        self.size = size
+        self.source_key = source_key
+        self.content_hash = content_hash
+        self.cached = cached
+
+
+def media_file_name(message):
+    file = message.file
+    if isinstance(message.media, types.MessageMediaPhoto):
+        return 'photo.jpg'
+    return file.name or f"media{file.ext or ''}"
+
+
+async def _stream_upload(src_client, dst_client, message, size, name, buffer_parts, upload_workers):
+    """다운로드 청크를 PART_SIZE 단위로 잘라 크기 제한 큐를 통해 병렬 업로드합니다."""
+    file_id = random.randrange(-2 ** 63, 2 ** 63)
+    part_count = (size + PART_SIZE - 1) // PART_SIZE
+    is_big = size > BIG_FILE_SIZE
+    hash_md5 = hashlib.md5()
+    pipe = asyncio.Queue(maxsize=buffer_parts)
+
+    async def produce():
+        buffer = bytearray()
+        index = 0
+        async for chunk in src_client.iter_download(message.media, request_size=PART_SIZE, file_size=size):
+            buffer += chunk
+            while len(buffer) >= PART_SIZE:
+                part = bytes(buffer[:PART_SIZE]); del buffer[:PART_SIZE]
+                if not is_big: hash_md5.update(part)
+                await pipe.put((index, part)); index += 1
+        if buffer:
+            part = bytes(buffer)
+            if not is_big: hash_md5.update(part)
+            await pipe.put((index, part)); index += 1
+        if index != part_count:
+            raise ValueError(f"다운로드된 파트 수({index})가 예상({part_count})과 다릅니다.")
+
+    async def consume():
+        while True:
+            index, part = await pipe.get()
+            try:
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, index, part_count, part)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, index, part)
+                if not await dst_client(request):
+                    raise RuntimeError(f"파트 {index} 업로드 실패")
+            finally:
+                pipe.task_done()
+
+    consumers = [asyncio.create_task(consume()) for _ in range(upload_workers)]
+    producer = asyncio.create_task(produce())
+    drained = asyncio.create_task(_join_after(producer, pipe))
+    try:
+        # 업로드 워커가 실패하면 즉시 중단하고, 그렇지 않으면 모든 파트가 업로드될 때까지 기다립니다.
+        done, _ = await asyncio.wait([drained, *consumers], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in (producer, drained, *consumers):
+            task.cancel()
+
+    if is_big:
+        return types.InputFileBig(file_id, part_count, name)
+    return types.InputFile(file_id, part_count, name, hash_md5.hexdigest())
+
+
+async def _join_after(producer, pipe):
+    await producer
+    await pipe.join()
+
+
+async def _spool_upload(src_client, dst_client, message, name, spool_threshold, cache=None, cache_scope=None):
+    """
+    크기를 알 수 없는 미디어는 spool 파일로 받은 뒤 업로드합니다.
+    (업로드 결과, 크기, 내용 해시, 캐시 적중 여부)를 반환하며, 캐시에 같은 내용이 있으면 업로드하지 않습니다.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=spool_threshold) as spool:
+        await src_client.download_media(message, file=spool)
+        size = spool.tell()
+        spool.seek(0)
+        hash_md5 = hashlib.md5()
+        for chunk in iter(lambda: spool.read(PART_SIZE), b''):
+            hash_md5.update(chunk)
+        content_hash = scoped_key(hash_md5.hexdigest(), cache_scope)
+        cached = cache.get_by_content(content_hash) if cache is not None else None
+        if cached is not None:
+            return cached, size, content_hash, True
+        spool.seek(0)
+        if size > spool_threshold:
+            logger.info(f"미디어 크기({size} bytes)가 spool 임계값을 넘어 디스크를 사용했습니다.")
+        uploaded = await dst_client.upload_file(spool, file_size=size, file_name=name, part_size_kb=PART_SIZE // 1024)
+        return uploaded, size, content_hash, False
+
+
+async def transfer_media(src_client, dst_client, message, buffer_parts=8, upload_workers=4,
+                         spool_threshold=20 * 1024 * 1024, cache=None, cache_scope=None):
+    """
+    메시지의 미디어를 src_client에서 받아 dst_client로 업로드합니다.
+    cache(MediaCache)에 원본 키나 내용 해시로 기록된 미디어가 있으면 업로드하지 않고 재사용합니다.
+    올린 파일은 그 봇만 쓸 수 있으므로 봇이 여럿이면 cache_scope로 봇별 캐시 항목을 구분합니다.
+    전달할 수 있는 파일이 없으면 None을 반환합니다.
+    """
+    if message.file is None or not isinstance(message.media, (types.MessageMediaPhoto, types.MessageMediaDocument)):
+        return None
+    key = scoped_key(source_key(message.media), cache_scope)
+    name = media_file_name(message)
+    size = message.file.size
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return UploadedMedia(cached, size=size, source_key=key, cached=True)
+    if isinstance(message.media, types.MessageMediaPhoto):
+        # 사진은 항상 10MB 이하이므로 메모리에서 바로 처리합니다.
+        data = await src_client.download_media(message, file=bytes)
+        content_hash = scoped_key(hashlib.md5(data).hexdigest(), cache_scope)
+        cached = cache.get_by_content(content_hash) if cache is not None else None
+        if cached is not None:
+            return UploadedMedia(cached, size=len(data), source_key=key, content_hash=content_hash, cached=True)
+        if cache is not None: cache.misses += 1
+        uploaded = await dst_client.upload_file(data, file_name=name)
+        return UploadedMedia(uploaded, size=len(data), source_key=key, content_hash=content_hash)
+
+    document = message.media.document
+    content_hash = None
+    if size:
+        if cache is not None: cache.misses += 1
+        uploaded = await _stream_upload(src_client, dst_client, message, size, name, buffer_parts, upload_workers)
+    else:
+        uploaded, size, content_hash, hit = await _spool_upload(src_client, dst_client, message, name,
+                                                                spool_threshold, cache, cache_scope)
+        if hit:
+            return UploadedMedia(uploaded, size=size, source_key=key, content_hash=content_hash, cached=True)
+        if cache is not None: cache.misses += 1
+    return UploadedMedia(uploaded, attributes=document.attributes, mime_type=document.mime_type, size=size,
+                         source_key=key, content_hash=content_hash)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+처리 단계별 지연 시간 히스토그램과 로컬 메트릭 엔드포인트
+- 히스토그램은 고정 버킷에 개수만 더하므로 관측 1회가 bisect 한 번 (메시지당 부담 없음)
+- 큐 길이, 중복 검사 저장소 크기 같은 값은 등록한 함수로 조회 시점에만 계산 (gauge)
+- 127.0.0.1에서 Prometheus 텍스트 형식(/metrics)과 JSON(/metrics.json)으로 제공
+"""
+
+import json
+import asyncio
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# 초 단위 버킷 (1ms ~ 60s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = 'telegram_monitor'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 마지막 칸은 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """버킷 경계로 근사한 분위수 (관측이 없으면 0)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+def _finite(value):
+    """JSON에 넣을 수 없는 +Inf(가장 큰 버킷 초과)는 None으로 바꿉니다."""
+    return None if value == float('inf') else value
+
+
+def _bound_ms(value):
+    return f">{DEFAULT_BUCKETS[-1] * 1000:g}ms" if value == float('inf') else f"≤{value * 1000:g}ms"
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # 단계 이름 -> Histogram
+        self.counters = {}  # 이름 -> (Counter/dict 또는 이를 반환하는 함수, 라벨 이름), 조회 시점의 값을 그대로 내보냄
+        self.gauges = {}  # 이름 -> 값을 반환하는 함수
+
+    def observe(self, stage, seconds):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = Histogram()
+        hist.observe(seconds)
+
+    def register_counters(self, name, counter, label='kind'):
+        self.counters[name] = (counter, label)
+
+    def _counter_values(self):
+        return {name: (dict(counter() if callable(counter) else counter), label)
+                for name, (counter, label) in self.counters.items()}
+
+    def register_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def _gauge_values(self):
+        values = {}
+        for name, fn in self.gauges.items():
+            try: values[name] = float(fn())
+            except Exception: continue
+        return values
+
+    def render_prometheus(self):
+        lines = []
+        for name, (counter, label) in self._counter_values().items():
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(counter.items()):
+                lines.append(f'{metric}{{{label}="{key}"}} {value}')
+        metric = f"{PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, hist in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {hist.count}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {hist.sum:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {hist.count}')
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def render_json(self):
+        return json.dumps({
+            'counters': {name: counter for name, (counter, _) in self._counter_values().items()},
+            'stages': {stage: {'count': h.count, 'sum': round(h.sum, 6), 'p50': _finite(h.quantile(0.5)),
+                               'p99': _finite(h.quantile(0.99))} for stage, h in sorted(self.histograms.items())},
+            'gauges': self._gauge_values(),
+        }, ensure_ascii=False)
+
+    def format_stages(self):
+        """단계별 p50/p99 요약 (로그용)"""
+        return ", ".join(f"{stage} p50{_bound_ms(h.quantile(0.5))} p99{_bound_ms(h.quantile(0.99))}"
+                         for stage, h in sorted(self.histograms.items()) if h.count) or "없음"
+
+
+class MetricsServer:
+    """GET /metrics (Prometheus), GET /metrics.json 만 처리하는 최소 HTTP 서버"""
+
+    def __init__(self, metrics, host='127.0.0.1', port=9464):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"메트릭 엔드포인트: http://{self.host}:{self.port}/metrics (JSON: /metrics.json)")
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) >= 2 else ''
+            if path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.metrics.render_prometheus()
+            elif path == '/metrics.json':
+                status, content_type, body = '200 OK', 'application/json', self.metrics.render_json()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'not found\n'
+            data = body.encode('utf-8')
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
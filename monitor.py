@@ -3,10 +3,15 @@
 
 """
 텔레그램 메시지 모니터링 및 자동 전달 프로그램
-- 모든 채널/그룹의 메시지 실시간 모니터링
-- "open.kakao.com" 키워드가 포함된 메시지 감지
-- [최종] 임시 파일 다운로드/삭제 방식으로 모든 미디어를 원본과 동일하게 안정적으로 전달
-- 파일 기반 해시 DB를 사용하여 재시작 및 포워딩 시 중복 전달 방지
+- 모든 채널/그룹의 메시지 실시간 모니터링 (ALLOW_CHATS/DENY_CHATS로 대화 단위 허용/차단, CHAT_SAMPLE로 대화별 샘플링)
+- 규칙 파일(rules.json)의 포함/제외 키워드로 메시지 감지 (기본: "open.kakao.com")
+- 임시 파일 없이 미디어를 스트리밍하여 원본과 동일하게 전달
+- 앨범(미디어 그룹)은 조각을 모아 한 번에 판단하고 하나의 앨범으로 전달
+- 수정된 메시지는 이전에 없던 링크가 새로 생긴 경우에만 같은 단계로 다시 판단하여 전달
+- SQLite(WAL) 기반 해시 DB를 사용하여 재시작 및 포워딩 시 중복 전달 방지
+- 재시작 시 꺼져 있던 동안 놓친 메시지를 보충한 뒤 실시간 모니터링 시작
+- SIGHUP을 받거나 규칙 파일/.env가 바뀌면 재연결 없이 규칙, 라우트, 제외 키워드를 다시 불러옴
+- supervisor.py로 여러 계정을 계정별 워커 프로세스로 실행하면 해시 DB와 outbox를 함께 쓰며 한 번만 전달
 """
 
 import os
@@ -17,32 +22,81 @@ import asyncio
 import atexit
 import time
 import hashlib
-import json
-from datetime import datetime, timedelta
-from telethon import TelegramClient, events, errors
+import signal
+from collections import Counter
+from telethon import TelegramClient, events, errors, utils
 from telethon.tl.types import (
-    PeerChannel, PeerChat, PeerUser, MessageMediaWebPage
+    PeerChannel, PeerChat, PeerUser, MessageMediaWebPage, UpdateUserName,
+    InputMediaUploadedPhoto, InputMediaUploadedDocument
 )
-from dotenv import load_dotenv
+from dotenv import load_dotenv, dotenv_values
+from dedup_store import HashStore, ClaimStore
+from media_stream import transfer_media
+from near_dup import NearDuplicateIndex, simhash
+from kakao_links import extract_links, message_scan_text, link_key
+from rules import load_rule_set, load_routes
+from send_scheduler import SendScheduler
+from bot_pool import BotPool, BotSender
+from outbox import Outbox
+from catchup import CursorStore, catch_up
+from entity_cache import EntityCache, display_name
+from album import AlbumCollector, MAX_ALBUM_PARTS
+from media_cache import MediaCache
+from log_setup import setup_logging
+from loop_lag import LoopLagMonitor
+from metrics import Metrics, MetricsServer
+from capture import UpdateCapture
+from edit_tracker import EditDecisionCache
+from chat_filter import (parse_chat_list, resolve_chat_ids, build_chat_filter, parse_chat_samples,
+                         resolve_chat_samples, sample_threshold, in_sample, ChatStats)
 
 # .env 파일 로드
+# 이미 설정된 환경 변수가 우선하며, 필수 값이 모두 환경에 있으면 .env 파일 없이도 실행할 수 있습니다.
 ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
-if not os.path.exists(ENV_FILE):
+PROCESS_ENV_KEYS = frozenset(os.environ)  # .env보다 우선하는 값 (설정을 다시 불러올 때도 유지)
+if os.path.exists(ENV_FILE):
+    load_dotenv(ENV_FILE)
+elif not all(os.getenv(k) for k in ('API_ID', 'API_HASH', 'PHONE_NUMBER', 'BOT_TOKEN')):
     print(f"오류: .env 파일을 찾을 수 없습니다. setup_session.py를 먼저 실행하세요.")
     sys.exit(1)
 
-load_dotenv(ENV_FILE)
-
 # 환경 변수 로드
 API_ID = os.getenv('API_ID')
 API_HASH = os.getenv('API_HASH')
 PHONE_NUMBER = os.getenv('PHONE_NUMBER')
 SESSION_NAME = os.getenv('SESSION_NAME', 'telegram_session')
 TARGET_CHANNEL = os.getenv('TARGET_CHANNEL', 'me')
+STARTUP_TARGET_CHANNEL = TARGET_CHANNEL  # 대상별 중복 검사 키를 쓰지 않는 기본 대상 (설정을 다시 불러와도 유지)
+ALLOW_CHATS = parse_chat_list(os.getenv('ALLOW_CHATS'))  # 다시 불러올 수 있음
+DENY_CHATS = parse_chat_list(os.getenv('DENY_CHATS'))  # 다시 불러올 수 있음
+CHAT_SAMPLE = os.getenv('CHAT_SAMPLE', '')  # 다시 불러올 수 있음
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-EXCLUDE_KEYWORDS = os.getenv('EXCLUDE_KEYWORDS', '').split(',') if os.getenv('EXCLUDE_KEYWORDS') else []
+BOT_TOKENS = os.getenv('BOT_TOKENS', '')
+EXCLUDE_KEYWORDS = os.getenv('EXCLUDE_KEYWORDS', '').split(',') if os.getenv('EXCLUDE_KEYWORDS') else []  # 다시 불러올 수 있음
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 LOG_FILE = os.getenv('LOG_FILE', 'telegram_monitor.log')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))
+LOG_BACKUP_COUNT = os.getenv('LOG_BACKUP_COUNT', '5')
+METRICS_PORT = os.getenv('METRICS_PORT', '9464')
+DELIVERY_WORKERS = os.getenv('DELIVERY_WORKERS', '3')
+DELIVERY_QUEUE_SIZE = os.getenv('DELIVERY_QUEUE_SIZE', '100')
+QUEUE_FULL_POLICY = os.getenv('QUEUE_FULL_POLICY', 'drop_oldest').lower()
+DEDUP_MAX_ENTRIES = os.getenv('DEDUP_MAX_ENTRIES', '200000')
+NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+NEAR_DUP_THRESHOLD = os.getenv('NEAR_DUP_THRESHOLD', '0.9')
+LINK_TTL_HOURS = os.getenv('LINK_TTL_HOURS', '72')
+SEND_COALESCE = os.getenv('SEND_COALESCE', 'true').lower() in ('1', 'true', 'yes', 'on')
+CATCHUP_ENABLED = os.getenv('CATCHUP_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')
+CATCHUP_CONCURRENCY = os.getenv('CATCHUP_CONCURRENCY', '4')
+CATCHUP_MAX_MESSAGES = os.getenv('CATCHUP_MAX_MESSAGES', '1000')
+RULES_FILE = os.getenv('RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json'))
+CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')
+CAPTURE_MAX_BYTES = os.getenv('CAPTURE_MAX_BYTES', str(50 * 1024 * 1024))
+CAPTURE_BACKUP_COUNT = os.getenv('CAPTURE_BACKUP_COUNT', '3')
+DATA_DIR = os.getenv('DATA_DIR', os.path.dirname(os.path.abspath(__file__)))  # 해시 DB, outbox DB 위치
+WORKER_NAME = os.getenv('WORKER_NAME', '')  # supervisor.py가 계정별 워커에 지정하는 이름
+BOT_RATE_SHARES = os.getenv('BOT_RATE_SHARES', '')  # supervisor.py가 지정: 봇 ID별로 그 봇을 함께 쓰는 워커 수
 
 # 환경 변수 검증
 if not all([API_ID, API_HASH, PHONE_NUMBER, BOT_TOKEN]):
@@ -54,31 +108,162 @@ try:
 except ValueError:
     print("오류: API_ID는 숫자여야 합니다."); sys.exit(1)
 
+try:
+    DELIVERY_WORKERS = max(1, int(DELIVERY_WORKERS))
+    DELIVERY_QUEUE_SIZE = max(1, int(DELIVERY_QUEUE_SIZE))
+    DEDUP_MAX_ENTRIES = max(1, int(DEDUP_MAX_ENTRIES))
+    LINK_TTL_HOURS = max(1, int(LINK_TTL_HOURS))
+    CATCHUP_CONCURRENCY = max(1, int(CATCHUP_CONCURRENCY))
+    CATCHUP_MAX_MESSAGES = max(1, int(CATCHUP_MAX_MESSAGES))
+    LOG_MAX_BYTES = max(0, int(LOG_MAX_BYTES))
+    LOG_BACKUP_COUNT = max(0, int(LOG_BACKUP_COUNT))
+    METRICS_PORT = max(0, int(METRICS_PORT))
+    CAPTURE_MAX_BYTES = max(0, int(CAPTURE_MAX_BYTES))
+    CAPTURE_BACKUP_COUNT = max(0, int(CAPTURE_BACKUP_COUNT))
+except ValueError:
+    print("오류: DELIVERY_WORKERS, DELIVERY_QUEUE_SIZE, DEDUP_MAX_ENTRIES, LINK_TTL_HOURS, "
+          "CATCHUP_CONCURRENCY, CATCHUP_MAX_MESSAGES, LOG_MAX_BYTES, LOG_BACKUP_COUNT, METRICS_PORT, "
+          "CAPTURE_MAX_BYTES, CAPTURE_BACKUP_COUNT는 숫자여야 합니다.")
+    sys.exit(1)
+
+if LOG_FORMAT not in ('text', 'json'):
+    print("오류: LOG_FORMAT은 text 또는 json이어야 합니다."); sys.exit(1)
+
+try:
+    NEAR_DUP_THRESHOLD = float(NEAR_DUP_THRESHOLD)
+    if not 0.0 < NEAR_DUP_THRESHOLD <= 1.0: raise ValueError
+except ValueError:
+    print("오류: NEAR_DUP_THRESHOLD는 0보다 크고 1 이하인 숫자여야 합니다."); sys.exit(1)
+
+try:
+    BOT_RATE_SHARES = {bot: max(1, int(n)) for bot, n in (item.split(':') for item in BOT_RATE_SHARES.split(',') if item)}
+except ValueError:
+    print("오류: BOT_RATE_SHARES는 '봇ID:워커 수'를 쉼표로 구분한 목록이어야 합니다."); sys.exit(1)
+
+try:
+    CHAT_SAMPLE = parse_chat_samples(CHAT_SAMPLE)
+except ValueError:
+    print("오류: CHAT_SAMPLE은 '채팅ID 또는 @username:0~1 비율'을 쉼표로 구분한 목록이어야 합니다."); sys.exit(1)
+
+if not re.fullmatch(r'\w*', WORKER_NAME, re.ASCII):
+    print("오류: WORKER_NAME은 영문자, 숫자, 밑줄(_)만 사용할 수 있습니다."); sys.exit(1)
+
+if QUEUE_FULL_POLICY not in ('drop_new', 'drop_oldest', 'block'):
+    print("오류: QUEUE_FULL_POLICY는 drop_new, drop_oldest, block 중 하나여야 합니다."); sys.exit(1)
+
 # 로깅 설정
 log_level = getattr(logging, LOG_LEVEL.upper(), logging.INFO)
 if sys.platform == "win32":
     try: os.system("chcp 65001 > nul")
     except: pass
-logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler(LOG_FILE, encoding='utf-8'), logging.StreamHandler(sys.stdout)])
+# 파일/콘솔 쓰기는 별도 스레드에서 처리하여 디스크나 stdout이 느려도 이벤트 루프가 멈추지 않도록 합니다.
+log_queue_handler = setup_logging(log_level, LOG_FILE, json_format=LOG_FORMAT == 'json', max_bytes=LOG_MAX_BYTES,
+                                  backup_count=LOG_BACKUP_COUNT)
 logger = logging.getLogger(__name__)
+loop_lag = LoopLagMonitor()
 
 # --- 전역 변수 ---
-HASH_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'forwarded_hashes.json')
-forwarded_content_hashes = {}
-KEYWORD_PATTERN = re.compile(r'open\.kakao\.com', re.IGNORECASE)
-EXCLUDE_PATTERNS = [re.compile(re.escape(k.strip()), re.IGNORECASE) for k in EXCLUDE_KEYWORDS if k.strip()]
+os.makedirs(DATA_DIR, exist_ok=True)
+HASH_DB_FILE = os.path.join(DATA_DIR, 'forwarded_hashes.db')
+LEGACY_HASH_DB_FILE = os.path.join(DATA_DIR, 'forwarded_hashes.json')
+HASH_TTL_SECONDS = 24 * 3600
+HASH_FLUSH_INTERVAL = 1.0  # 해시 DB group commit 주기 (초)
+HASH_PURGE_INTERVAL = 3600  # 만료 해시 정리 주기 (초)
+hash_store = HashStore(HASH_DB_FILE, ttl_seconds=HASH_TTL_SECONDS, max_entries=DEDUP_MAX_ENTRIES)
+# 정규화된 open.kakao.com 링크별 전달 기록 (같은 DB 파일의 별도 테이블, 별도 TTL)
+link_store = HashStore(HASH_DB_FILE, ttl_seconds=LINK_TTL_HOURS * 3600, max_entries=DEDUP_MAX_ENTRIES,
+                       table='forwarded_links')
+# 채팅별 마지막으로 처리한 메시지 ID (재시작 시 놓친 메시지 보충용, 해시 DB의 별도 테이블, 메시지 ID는 계정마다 다르므로 워커별)
+chat_cursors = CursorStore(HASH_DB_FILE, table=f"chat_cursors_{WORKER_NAME}" if WORKER_NAME else 'chat_cursors')
+# 여러 계정의 워커가 같은 메시지를 받으면 한 워커만 전달하도록 해시 DB에서 선점 (워커로 실행할 때만)
+shared_claims = ClaimStore(HASH_DB_FILE, WORKER_NAME) if WORKER_NAME else None
+# 감지된 메시지를 전달 완료 시까지 보관하는 영속 outbox
+OUTBOX_DB_FILE = os.path.join(DATA_DIR, 'outbox.db')
+OUTBOX_POLL_INTERVAL = 5  # 재시도 대상 확인 주기 (초)
+OUTBOX_SHED_DELAY = 30  # 전달 큐가 가득 차 밀려난 항목을 다시 시도하기까지의 시간 (초)
+outbox = Outbox(OUTBOX_DB_FILE, owner=WORKER_NAME)
+outbox_inflight = set()  # 전달 큐/워커에서 처리 중인 (chat_id, msg_id, revision)
+# 채팅/사용자 표시 이름 캐시 (시작 시 모든 대화를 미리 불러오고 이름 변경 이벤트로 갱신)
+ENTITY_NAME_TTL = 6 * 3600
+entity_cache = EntityCache(ttl_seconds=ENTITY_NAME_TTL)
+# 봇이 이미 올린 미디어를 다시 업로드하지 않고 재사용하기 위한 캐시 (해시 DB의 별도 테이블)
+media_cache = MediaCache(HASH_DB_FILE)
+# 봇 구분 없이 기록된 이전 미디어 캐시 항목을 올린 봇. 워커가 BOT_TOKEN을 바꿔도 .env의 원래 기본 봇으로 옮깁니다.
+MEDIA_CACHE_LEGACY_BOT = ((dotenv_values(ENV_FILE).get('BOT_TOKEN') if os.path.exists(ENV_FILE) else None)
+                          or BOT_TOKEN).split(':', 1)[0]
+# 유사 중복 인덱스 (NEAR_DUP_ENABLED일 때만 사용, 메모리에만 보관, 지문은 Destination.fingerprint_mask로 대상별 구분)
+near_dup_index = NearDuplicateIndex(NEAR_DUP_THRESHOLD, ttl_seconds=HASH_TTL_SECONDS,
+                                    max_entries=DEDUP_MAX_ENTRIES) if NEAR_DUP_ENABLED else None
+# 최근 메시지별 본문 digest와 판단에 쓴 링크 (수정 이벤트에서 바뀌지 않은 수정과 새 링크 없는 수정을 건너뜀)
+EDIT_CACHE_SIZE = 10000
+edit_decisions = EditDecisionCache(EDIT_CACHE_SIZE)
+# 수신한 업데이트를 재생용 파일로 기록 (CAPTURE_FILE이 설정된 경우에만, replay.py로 재생)
+update_capture = UpdateCapture(CAPTURE_FILE, CAPTURE_MAX_BYTES, CAPTURE_BACKUP_COUNT) if CAPTURE_FILE else None
+try:
+    rule_set = load_rule_set(RULES_FILE, EXCLUDE_KEYWORDS)
+    routes = load_routes(RULES_FILE, rule_set, TARGET_CHANNEL)
+except (OSError, ValueError) as e:
+    print(f"오류: 규칙 파일({RULES_FILE})을 읽을 수 없습니다: {e}"); sys.exit(1)
 SESSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
-os.makedirs(SESSIONS_DIR, mode=0o755, exist_ok=True)
 USER_SESSION_PATH = os.path.join(SESSIONS_DIR, SESSION_NAME)
-BOT_SESSION_PATH = os.path.join(SESSIONS_DIR, 'bot_session')
+# 봇 세션은 사용자 세션과 같은 디렉터리에 둡니다. (SESSION_NAME이 절대 경로면 그 디렉터리)
+# 세션 파일은 한 프로세스만 열 수 있으므로 워커마다 따로 둡니다.
+BOT_SESSION_PATH = os.path.join(os.path.dirname(USER_SESSION_PATH),
+                                f"bot_session_{WORKER_NAME}" if WORKER_NAME else 'bot_session')
+os.makedirs(os.path.dirname(USER_SESSION_PATH), mode=0o755, exist_ok=True)
 client = TelegramClient(USER_SESSION_PATH, API_ID, API_HASH)
-bot_client = TelegramClient(BOT_SESSION_PATH, API_ID, API_HASH)
-target_entity = None
-bot_target_entity = None
+BOT_GLOBAL_RATE = 30  # 봇 전체 초당 전송 수
+BOT_CHAT_RATE = 1  # 채팅별 초당 전송 수
+BOT_GROUP_PER_MINUTE = 20  # 그룹/채널별 분당 전송 수
+# BOT_TOKEN과 BOT_TOKENS(쉼표로 구분)의 봇들로 전송을 나눕니다. 속도 제한은 봇별이므로 스케줄러도 봇마다 둡니다.
+BOT_TOKEN_LIST = list(dict.fromkeys([BOT_TOKEN] + [t.strip() for t in BOT_TOKENS.split(',') if t.strip()]))
+bot_senders = []
+for i, token in enumerate(BOT_TOKEN_LIST):
+    bot_id = token.split(':', 1)[0]
+    # 첫 번째 봇은 기존 세션 파일을 그대로 사용합니다. 미디어 캐시는 워커들이 공유하므로 항상 봇 ID로 구분합니다.
+    session = BOT_SESSION_PATH if i == 0 else f"{BOT_SESSION_PATH}_{bot_id}"
+    bot = TelegramClient(session, API_ID, API_HASH)
+    # FloodWait를 Telethon 내부에서 잠자며 기다리지 않고 전송 스케줄러가 채팅별로 처리하도록 합니다.
+    bot.flood_sleep_threshold = 0
+    # 여러 워커가 같은 봇을 쓰면 봇의 속도 제한을 워커 수로 나눠, 합쳐도 봇 하나의 제한을 넘지 않게 합니다.
+    share = BOT_RATE_SHARES.get(bot_id, 1)
+    if share > 1: logger.info(f"봇 {bot_id}를 워커 {share}개가 함께 사용하여 전송 속도 제한을 1/{share}로 나눕니다.")
+    # 봇이 여럿이면 FloodWait가 끝나기를 기다리지 않고 바로 다른 봇으로 넘깁니다.
+    scheduler = SendScheduler(BOT_GLOBAL_RATE / share, BOT_CHAT_RATE / share, BOT_GROUP_PER_MINUTE / share,
+                              coalesce=SEND_COALESCE, max_flood_retries=5 if len(BOT_TOKEN_LIST) == 1 else 0)
+    bot_senders.append(BotSender(bot_id, bot, scheduler, token, media_scope=bot_id))
+bot_pool = BotPool(bot_senders)
+destinations = {}  # 대상 키(설정 값) -> Destination, 시작 시 한 번 해석
+destination_peer_ids = frozenset()  # event.chat_id와 바로 비교할 수 있는 대상 채널들의 marked id
+# 핸들러가 가장 먼저 확인하는 대화 허용/차단 집합. username은 로그인 후 해석하므로 그 전에는 숫자 차단 목록만 적용합니다.
+chat_filter_allow, chat_filter_ids = build_chat_filter(frozenset(), frozenset(c for c in DENY_CHATS if isinstance(c, int)),
+                                                       allow_mode=False)
+chat_samples = {c: sample_threshold(rate) for c, rate in CHAT_SAMPLE if isinstance(c, int)}  # peer id -> 해시 임계값
+chat_stats = ChatStats()  # 대화별 수신/매칭/차단 수
+MEDIA_BUFFER_PARTS = 8  # 다운로드와 업로드 사이에 메모리에 보관하는 최대 파트 수 (512KB 단위)
+MEDIA_UPLOAD_WORKERS = 4  # 미디어 1건당 병렬 업로드 파트 수
+MEDIA_SPOOL_THRESHOLD = 20 * 1024 * 1024  # 크기를 모르는 미디어를 메모리에 보관하는 최대 크기
+ALBUM_WINDOW = 1.0  # 앨범의 마지막 조각 이후 다음 조각을 기다리는 시간 (초)
+QUEUE_PUT_TIMEOUT = 5  # block 정책에서 큐 자리가 날 때까지 기다리는 최대 시간 (초)
+delivery_queue = None
+album_collector = None  # 앨범 조각을 모으는 AlbumCollector (main에서 생성)
+clients_ready = None  # 로그인과 대상 해석이 끝나면 설정되는 asyncio.Event
+reload_requested = None  # SIGHUP을 받으면 설정되는 asyncio.Event (watch_config가 설정을 다시 불러옴)
+CONFIG_POLL_INTERVAL = 2  # 규칙 파일/.env 수정 시각 확인 주기 (초)
+live_ready = None  # 놓친 메시지 보충이 끝나 실시간 메시지를 처리해도 되면 설정되는 asyncio.Event
+inflight_hashes = set()  # 큐에 들어갔지만 아직 전달이 끝나지 않은 메시지/링크 해시
+queue_wait_stats = {'count': 0, 'total': 0.0, 'max': 0.0}
+STATS_LOG_INTERVAL = 600  # 단계별 처리 통계 로그 주기 (초)
+# 핸들러 단계별 통계: received(수신) / drop_*(단계별 제외) / matched(전달 대상) / forwarded / failed
+pipeline_stats = Counter()
+# 단계별 지연 시간 히스토그램과 카운터/게이지 (METRICS_PORT의 로컬 엔드포인트로 제공)
+metrics = Metrics()
+metrics.register_counters('pipeline', pipeline_stats)
 MAX_RETRIES = 5
 RETRY_DELAY = 30
-LOCK_FILE = 'monitor.lock'
+# 같은 계정(세션)을 두 프로세스가 동시에 쓰지 않도록 세션마다 잠급니다.
+LOCK_FILE = f"{USER_SESSION_PATH}.lock"
+EXIT_NO_RESTART = 3  # 인증 오류 등 다시 시작해도 해결되지 않는 종료 (supervisor.py가 재시작하지 않음)
 # ---
 
 class SingleInstanceLock:
@@ -103,154 +288,827 @@ class SingleInstanceLock:
             except Exception as e: logger.error(f"프로세스 잠금 해제 실패: {str(e)}")
     def __del__(self): self.release()
 
+class DeliveryJob:
+    """감지 단계에서 전달 워커로 넘기는 작업 레코드"""
+    __slots__ = ('chat_id', 'msg_id', 'revision', 'message', 'album', 'text', 'content_hash', 'link_keys', 'rules',
+                 'destinations', 'enqueued_at', 'received_at')
+    def __init__(self, chat_id, msg_id, message, text, link_keys=(), rules=(), destinations=(), album=(),
+                 received_at=None, revision=0):
+        self.chat_id = chat_id; self.msg_id = msg_id
+        self.revision = revision  # 0이면 원본 메시지, 새 링크가 생긴 수정이면 수정 감지 시각 (outbox 키)
+        self.message = message; self.text = text
+        self.album = album  # 앨범이면 메시지 ID 순으로 정렬된 모든 조각 (message는 첫 조각)
+        self.content_hash = create_message_hash(text) if text else None
+        self.link_keys = link_keys
+        self.rules = rules
+        self.destinations = destinations
+        self.enqueued_at = time.monotonic()
+        self.received_at = received_at or self.enqueued_at  # 종단 간 지연 측정 기준 시각
+
+class Destination:
+    """시작 시 한 번 해석해 캐시하는 전달 대상 채널"""
+    __slots__ = ('key', 'entity', 'peer_id', 'legacy', 'fingerprint_mask')
+    def __init__(self, key, entity):
+        self.key = key; self.entity = entity
+        self.peer_id = utils.get_peer_id(entity) if entity else None
+        # 시작할 때의 기본 대상은 기존 해시 DB와 호환되도록 키를 그대로 씁니다. 설정을 다시 불러와
+        # TARGET_CHANNEL이 바뀌어도 대상별 키가 달라지지 않도록 생성 시 한 번만 정합니다.
+        self.legacy = key == STARTUP_TARGET_CHANNEL
+        # 유사 중복 지문은 대상별 마스크와 XOR하여 한 인덱스에 둡니다. 같은 대상끼리는 해밍 거리가 그대로이고,
+        # 다른 대상의 지문과는 거리가 무작위(평균 32)가 되어 서로 걸러지지 않습니다.
+        self.fingerprint_mask = 0 if self.legacy else int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+    def scoped(self, digest):
+        """대상별 중복 검사 키"""
+        if self.legacy: return digest
+        return hashlib.md5(self.key.encode('utf-8') + digest).digest()
+
 def load_hashes_from_file():
-    global forwarded_content_hashes
     try:
-        if os.path.exists(HASH_DB_FILE):
-            with open(HASH_DB_FILE, 'r', encoding='utf-8') as f: data = json.load(f)
-            cutoff_time = datetime.now() - timedelta(hours=24)
-            cleaned_hashes = {h: datetime.fromisoformat(ts_str) for h, ts_str in data.items() if datetime.fromisoformat(ts_str) > cutoff_time}
-            forwarded_content_hashes = cleaned_hashes
-            if len(data) != len(cleaned_hashes): logger.info(f"해시 DB 로드: {len(cleaned_hashes)}개 기록 불러옴 (만료된 {len(data) - len(cleaned_hashes)}개 정리)"); save_hashes_to_file()
-            else: logger.info(f"해시 DB 로드: {len(cleaned_hashes)}개 기록 불러옴")
-        else: logger.info("해시 DB 파일이 없어 새로 시작합니다."); forwarded_content_hashes = {}
-    except Exception as e: logger.error(f"해시 DB 파일 로드 실패: {e}. 새 DB로 시작합니다."); forwarded_content_hashes = {}
-
-def save_hashes_to_file():
-    data_to_save = {h: dt.isoformat() for h, dt in forwarded_content_hashes.items()}
-    try:
-        with open(HASH_DB_FILE, 'w', encoding='utf-8') as f: json.dump(data_to_save, f, indent=4)
-    except IOError as e: logger.error(f"해시 DB 파일 저장 실패: {e}")
+        hash_store.open()
+        hash_store.migrate_json(LEGACY_HASH_DB_FILE)
+        link_store.open()
+        outbox.open()
+        chat_cursors.open()
+        media_cache.open(legacy_scope=MEDIA_CACHE_LEGACY_BOT)
+        if shared_claims is not None: shared_claims.open()
+    except Exception as e: logger.error(f"해시 DB 로드 실패: {e}")
+    if update_capture is not None:
+        try: update_capture.open()
+        except OSError as e: logger.error(f"업데이트 기록 파일을 열 수 없습니다 ({CAPTURE_FILE}): {e}")
+
+def close_stores():
+    hash_store.close(); link_store.close(); outbox.close(); chat_cursors.close(); media_cache.close()
+    if shared_claims is not None: shared_claims.close()
+    if update_capture is not None: update_capture.close()
+
+async def hash_store_maintenance():
+    """해시 DB의 대기 중인 기록을 주기적으로 커밋하고 만료된 기록을 정리합니다."""
+    last_purge = time.monotonic()
+    while True:
+        await asyncio.sleep(HASH_FLUSH_INTERVAL)
+        started = time.perf_counter()
+        hash_store.flush(); link_store.flush(); outbox.flush(); chat_cursors.flush(); media_cache.flush()
+        metrics.observe('persist', time.perf_counter() - started)
+        if update_capture is not None: update_capture.flush()
+        hash_store.index.sweep(); link_store.index.sweep()
+        if near_dup_index is not None: near_dup_index.sweep()
+        if time.monotonic() - last_purge >= HASH_PURGE_INTERVAL:
+            expired = hash_store.purge_expired() + link_store.purge_expired(); last_purge = time.monotonic()
+            if shared_claims is not None: shared_claims.purge_expired()
+            if expired: logger.info(f"만료된 해시 {expired}개 정리 (현재 {len(hash_store)}개)")
 
 def create_message_hash(text):
     normalized_text = re.sub(r'\s+', ' ', text or "")
-    return hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
+    return hashlib.md5(normalized_text.encode('utf-8')).digest()
 
-def is_duplicate_message(text):
+def is_duplicate_message(text, link_keys=(), dest=None):
+    scoped = dest.scoped if dest else (lambda digest: digest)
+    target = f" ({dest.key})" if dest else ""
+    if link_keys:
+        # 링크가 있는 메시지는 아직 전달하지 않은 링크가 하나라도 있어야 전달 (그다음 유사 중복 검사)
+        for k in link_keys:
+            k = scoped(k)
+            if k not in link_store and k not in inflight_hashes: break
+        else:
+            logger.info(f"링크 기반 중복 메시지 감지{target} (링크 {len(link_keys)}개 모두 전달됨). 전달 건너뜀.")
+            return True
+    elif text:
+        content_hash = scoped(create_message_hash(text))
+        if content_hash in hash_store or content_hash in inflight_hashes:
+            logger.info(f"내용 기반 중복 메시지 감지{target} (Hash: {content_hash.hex()[:8]}...). 전달 건너뜀.")
+            return True
     if not text: return False # 텍스트 없는 미디어는 중복 검사에서 제외
-    content_hash = create_message_hash(text)
-    if content_hash in forwarded_content_hashes:
-        logger.info(f"내용 기반 중복 메시지 감지 (Hash: {content_hash[:8]}...). 전달 건너뜀.")
-        return True
+    if near_dup_index is not None:
+        mask = dest.fingerprint_mask if dest else 0
+        match = near_dup_index.find(simhash(text) ^ mask)
+        if match is not None:
+            logger.info(f"유사 중복 메시지 감지{target} (SimHash: {match ^ mask:016x}). 전달 건너뜀.")
+            return True
     return False
 
-def mark_message_as_forwarded(text):
+def mark_message_as_forwarded(text, link_keys=(), dest=None):
+    scoped = dest.scoped if dest else (lambda digest: digest)
+    for k in link_keys: link_store.add(scoped(k))
     if not text: return
-    content_hash = create_message_hash(text)
-    forwarded_content_hashes[content_hash] = datetime.now()
-    save_hashes_to_file()
-    logger.debug(f"메시지 전달 기록 저장 (Hash={content_hash[:8]})")
+    content_hash = scoped(create_message_hash(text))
+    hash_store.add(content_hash)
+    if near_dup_index is not None: near_dup_index.add(simhash(text) ^ (dest.fingerprint_mask if dest else 0))
+    logger.debug(f"메시지 전달 기록 저장 (Hash={content_hash.hex()[:8]})")
+
+def claim_destinations(chat_id, msg_id, text, link_keys, dests):
+    """
+    다른 계정의 워커가 먼저 전달하기로 한 대상을 제외합니다. 채널/슈퍼그룹 메시지는 모든 계정에서 ID가 같으므로
+    메시지 자체를 먼저 선점하고, 대상마다 링크(하나라도 새로 선점하면 전달) 또는 내용 해시를 선점합니다.
+    """
+    exclusive = None
+    if utils.resolve_id(chat_id)[1] is PeerChannel:
+        exclusive = (hashlib.md5(f"{chat_id}:{msg_id}".encode()).digest(), HASH_TTL_SECONDS)
+    groups = []
+    for dest in dests:
+        if link_keys: groups.append(([dest.scoped(k) for k in link_keys], LINK_TTL_HOURS * 3600))
+        else: groups.append(([dest.scoped(create_message_hash(text))] if text else [], HASH_TTL_SECONDS))
+    claimed = shared_claims.claim(groups, exclusive)
+    return [d for d, ok in zip(dests, claimed) if ok] if claimed else []
 
 async def get_entity_name(entity):
-    try:
-        if hasattr(entity, 'title'): return entity.title
-        if hasattr(entity, 'first_name'): return f"{entity.first_name} {entity.last_name or ''}".strip()
-        if hasattr(entity, 'username'): return f"@{entity.username}"
-        return str(entity.id)
-    except Exception: return "알 수 없음"
+    return display_name(entity)
 
-async def resolve_target_entity(client_instance, purpose="대상"):
+async def resolve_target_entity(client_instance, target=TARGET_CHANNEL, purpose="대상"):
     try:
-        if TARGET_CHANNEL.lstrip('-').isdigit(): entity = await client_instance.get_entity(int(TARGET_CHANNEL))
-        elif TARGET_CHANNEL.lower() == 'me': entity = await client_instance.get_me()
-        else: entity = await client_instance.get_entity(TARGET_CHANNEL)
+        if target.lstrip('-').isdigit(): entity = await client_instance.get_entity(int(target))
+        elif target.lower() == 'me': entity = await client_instance.get_me()
+        else: entity = await client_instance.get_entity(target)
         name = await get_entity_name(entity)
         logger.info(f"{purpose} 채널 설정: {name}")
         return entity
-    except Exception as e: logger.error(f"{purpose} 채널 '{TARGET_CHANNEL}' 해석 오류: {e}"); return None
+    except Exception as e: logger.error(f"{purpose} 채널 '{target}' 해석 오류: {e}"); return None
+
+async def resolve_destinations(route_list, known=None):
+    """
+    라우트의 대상 채널과 출처 채팅을 해석해 {대상 키: Destination}을 반환합니다.
+    known에 있는 대상은 다시 해석하지 않습니다. (설정을 다시 불러올 때 새로 추가된 대상만 조회)
+    """
+    known = known or {}
+    resolved = {}
+    for key in dict.fromkeys(t for route in route_list for t in route.targets):
+        if key in known: resolved[key] = known[key]; continue
+        entity = await resolve_target_entity(client, key, purpose=f"사용자용 대상({key})")
+        await bot_pool.resolve(key, resolve_target_entity)
+        resolved[key] = Destination(key, entity)
+    for route in route_list:
+        if not route.chats: continue
+        chat_ids = set()
+        for chat in route.chats:
+            try: chat_ids.add(await client.get_peer_id(chat))
+            except Exception as e: logger.error(f"라우트 '{route.name}'의 출처 채팅 '{chat}' 해석 오류: {e}")
+        route.chat_ids = frozenset(chat_ids)
+    return resolved
+
+async def resolve_routes():
+    """
+    라우트의 대상 채널과 출처 채팅을 시작 시 한 번 해석해 캐시합니다.
+    봇이 접근할 수 있는 대상 목록을 반환합니다.
+    """
+    global destinations, destination_peer_ids
+    destinations = await resolve_destinations(routes)
+    destination_peer_ids = frozenset(d.peer_id for d in destinations.values() if d.peer_id is not None)
+    return [d for d in destinations.values() if bot_pool.reachable(d.key)]
+
+def read_config():
+    """
+    규칙 파일과 .env의 EXCLUDE_KEYWORDS, TARGET_CHANNEL, ALLOW_CHATS, DENY_CHATS, CHAT_SAMPLE을 다시 읽어
+    (규칙, 라우트, 제외 키워드, 기본 대상, 허용 목록, 차단 목록, 샘플링 비율)을 만듭니다.
+    정규식/트라이 컴파일이 이벤트 루프를 막지 않도록 스레드에서 실행합니다.
+    """
+    env = dotenv_values(ENV_FILE) if os.path.exists(ENV_FILE) else {}
+    def setting(key, default=''):
+        return os.getenv(key, default) if key in PROCESS_ENV_KEYS else env.get(key) or default
+    exclude = setting('EXCLUDE_KEYWORDS').split(',') if setting('EXCLUDE_KEYWORDS') else []
+    target = setting('TARGET_CHANNEL', 'me')
+    allow, deny = parse_chat_list(setting('ALLOW_CHATS')), parse_chat_list(setting('DENY_CHATS'))
+    samples = parse_chat_samples(setting('CHAT_SAMPLE'))
+    new_rule_set = load_rule_set(RULES_FILE, exclude)
+    return new_rule_set, load_routes(RULES_FILE, new_rule_set, target), exclude, target, allow, deny, samples
+
+async def reload_config(reason):
+    """
+    설정을 다시 불러와 재연결 없이 규칙과 라우트를 교체합니다. 새 구조를 모두 만든 뒤 한 번에 바꾸므로
+    처리 중인 메시지는 이전 설정이나 새 설정 중 하나로만 처리됩니다. 실패하면 기존 설정을 유지합니다.
+    """
+    global rule_set, routes, destinations, destination_peer_ids, EXCLUDE_KEYWORDS, TARGET_CHANNEL
+    global ALLOW_CHATS, DENY_CHATS, CHAT_SAMPLE, chat_filter_allow, chat_filter_ids, chat_samples
+    started = time.perf_counter()
+    try:
+        new_rule_set, new_routes, exclude, target, allow, deny, samples = await asyncio.to_thread(read_config)
+    except (OSError, ValueError) as e:
+        logger.error(f"설정 다시 불러오기 실패 ({reason}), 기존 설정을 유지합니다: {e}"); return False
+    compiled = time.perf_counter()
+    new_destinations = await resolve_destinations(new_routes, destinations)
+    new_filter = await resolve_chat_filter(allow, deny)
+    new_samples = await resolve_chat_samples(client, samples)
+    if not any(bot_pool.reachable(key) for key in new_destinations):
+        logger.error(f"설정 다시 불러오기 실패 ({reason}): 봇이 접근할 수 있는 대상이 없어 기존 설정을 유지합니다."); return False
+    # 아래 교체 사이에는 await가 없으므로 핸들러는 항상 한쪽 설정만 봅니다.
+    rule_set, routes, destinations = new_rule_set, new_routes, new_destinations
+    destination_peer_ids = frozenset(d.peer_id for d in new_destinations.values() if d.peer_id is not None)
+    EXCLUDE_KEYWORDS, TARGET_CHANNEL, ALLOW_CHATS, DENY_CHATS, CHAT_SAMPLE = exclude, target, allow, deny, samples
+    chat_filter_allow, chat_filter_ids = new_filter
+    chat_samples = new_samples
+    elapsed = time.perf_counter() - started
+    metrics.observe('reload', elapsed)
+    pipeline_stats['config_reloads'] += 1
+    logger.info(f"설정 다시 불러옴 ({reason}): 규칙 {len(rule_set.rules)}개, 라우트 {len(routes)}개, "
+                f"대상 {len(destinations)}개 (읽기/컴파일 {(compiled - started) * 1000:.1f}ms, "
+                f"대상 해석 {(time.perf_counter() - compiled) * 1000:.1f}ms, 전체 {elapsed * 1000:.1f}ms)")
+    return True
+
+async def resolve_chat_filter(allow, deny):
+    """허용/차단 목록을 peer id 집합으로 해석해 (허용 모드, 집합)을 반환합니다."""
+    allow_ids = await resolve_chat_ids(client, allow, "허용")
+    deny_ids = await resolve_chat_ids(client, deny, "차단")
+    if allow and not allow_ids: logger.warning("허용 목록의 채팅을 하나도 해석하지 못해 모든 메시지가 차단됩니다.")
+    return build_chat_filter(allow_ids, deny_ids, allow_mode=bool(allow))
+
+async def apply_chat_filter():
+    """시작 시 ALLOW_CHATS/DENY_CHATS/CHAT_SAMPLE을 해석해 핸들러의 허용/차단 집합과 샘플링 비율을 교체합니다."""
+    global chat_filter_allow, chat_filter_ids, chat_samples
+    chat_filter_allow, chat_filter_ids = await resolve_chat_filter(ALLOW_CHATS, DENY_CHATS)
+    chat_samples = await resolve_chat_samples(client, CHAT_SAMPLE)
+    if ALLOW_CHATS or DENY_CHATS:
+        logger.info(f"대화 {'허용' if chat_filter_allow else '차단'} 목록: {len(chat_filter_ids)}개 채팅")
+    if chat_samples: logger.info(f"대화별 샘플링: {len(chat_samples)}개 채팅")
+
+def chat_allowed(chat_id):
+    return (chat_id in chat_filter_ids) is chat_filter_allow
+
+def chat_sampled(chat_id, msg_id):
+    """샘플링 비율이 지정된 대화면 msg_id 해시로 처리 여부를 정합니다. (지정되지 않은 대화는 항상 처리)"""
+    threshold = chat_samples.get(chat_id)
+    return threshold is None or in_sample(msg_id, threshold)
+
+def config_mtimes():
+    return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in (RULES_FILE, ENV_FILE))
+
+async def watch_config():
+    """SIGHUP을 받거나 규칙 파일/.env의 수정 시각이 바뀌면 설정을 다시 불러옵니다."""
+    await clients_ready.wait()
+    last = config_mtimes()
+    while True:
+        try: await asyncio.wait_for(reload_requested.wait(), timeout=CONFIG_POLL_INTERVAL)
+        except asyncio.TimeoutError: pass
+        current = config_mtimes()
+        if reload_requested.is_set(): reason = "SIGHUP"
+        elif current != last: reason = "설정 파일 변경"
+        else: continue
+        reload_requested.clear(); last = current
+        await reload_config(reason)
+
+def select_destinations(rule_names, chat_id):
+    """매칭된 규칙과 출처 채팅에 해당하는 라우트의 대상들을 중복 없이 반환합니다."""
+    selected = {}
+    for route in routes:
+        if route.applies(rule_names, chat_id):
+            for key in route.targets:
+                dest = destinations.get(key)
+                if dest is not None and bot_pool.reachable(key): selected[key] = dest
+    return list(selected.values())
+
+def format_pipeline_stats():
+    stats = ", ".join(f"{k}={v}" for k, v in sorted(pipeline_stats.items())) or "없음"
+    if delivery_queue is not None:
+        avg_wait = queue_wait_stats['total'] / queue_wait_stats['count'] if queue_wait_stats['count'] else 0.0
+        stats += (f" | 큐 {delivery_queue.qsize()}/{DELIVERY_QUEUE_SIZE}, "
+                  f"대기 평균 {avg_wait:.3f}s 최대 {queue_wait_stats['max']:.3f}s")
+    index = hash_store.index
+    stats += f" | 해시 인덱스 {len(index)}개 (~{index.memory_usage() // 1024}KB, 제거 {index.evicted}개)"
+    stats += f", 링크 {len(link_store)}개"
+    if near_dup_index is not None: stats += f", 유사 중복 지문 {len(near_dup_index)}개"
+    if shared_claims is not None:
+        stats += f", 공유 선점 성공 {shared_claims.stats['claimed']}건 충돌 {shared_claims.stats['conflict']}건"
+    stats += f" | 봇: {bot_pool.format_stats()}"
+    stats += f" | 이름 캐시: {entity_cache.format_stats()}"
+    stats += f" | 수정 판단 캐시: {edit_decisions.format_stats()}"
+    stats += f" | 대화별 수신 상위: {chat_stats.format_top(entity_cache.name)}"
+    stats += f" | 미디어 캐시: {media_cache.format_stats()}"
+    stats += f" | 루프 지연: {loop_lag.format_stats()}"
+    stats += f" | 단계별 지연: {metrics.format_stages()}"
+    if log_queue_handler.dropped: stats += f", 버린 로그 {log_queue_handler.dropped}줄"
+    pending, dead = outbox.counts()
+    stats += f" | outbox 대기 {pending}건, dead-letter {dead}건"
+    return stats
+
+async def log_pipeline_stats():
+    """단계별로 몇 개의 메시지가 걸러졌는지 주기적으로 기록합니다."""
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        logger.info(f"처리 통계: {format_pipeline_stats()}")
 
 @client.on(events.NewMessage())
 async def handler(event):
-    """모든 새 메시지를 처리하는 이벤트 핸들러"""
-    temp_file_path = None
-    try:
-        message_text = event.message.text or ""
-        chat = await event.get_chat()
-
-        if target_entity and chat.id == target_entity.id: return
-        if not KEYWORD_PATTERN.search(message_text): return
-        if is_duplicate_message(message_text): return
-        if any(p.search(message_text) for p in EXCLUDE_PATTERNS):
-            logger.info("제외 키워드가 감지되어 메시지 전달을 건너뜁니다.")
+    """모든 새 메시지를 처리하는 이벤트 핸들러 (시작 시 놓친 메시지 보충이 끝날 때까지 대기)"""
+    # 텍스트를 보기 전에 대화 허용/차단 집합과 대화별 샘플링 비율부터 확인합니다.
+    if (event.chat_id in chat_filter_ids) is not chat_filter_allow:
+        chat_stats.filtered[event.chat_id] += 1; return
+    if chat_samples and not chat_sampled(event.chat_id, event.id):
+        chat_stats.sampled_out[event.chat_id] += 1; return
+    if update_capture is not None: update_capture.add(event.message)
+    if not live_ready.is_set():
+        await live_ready.wait()
+        # 시작 중에 받은 메시지는 username까지 해석된 목록으로 다시 확인합니다.
+        if not chat_allowed(event.chat_id): chat_stats.filtered[event.chat_id] += 1; return
+        if not chat_sampled(event.chat_id, event.id): chat_stats.sampled_out[event.chat_id] += 1; return
+    await process_message(event.message)
+
+@client.on(events.MessageEdited())
+async def edit_handler(event):
+    """수정된 메시지를 처리하는 이벤트 핸들러"""
+    if (event.chat_id in chat_filter_ids) is not chat_filter_allow: return
+    if chat_samples and not chat_sampled(event.chat_id, event.id): return
+    if update_capture is not None: update_capture.add(event.message, edited=True)
+    if not live_ready.is_set():
+        await live_ready.wait()
+        if not chat_allowed(event.chat_id) or not chat_sampled(event.chat_id, event.id): return
+    await process_edit(event.message)
+
+@client.on(events.ChatAction())
+async def chat_action_handler(event):
+    """채팅 제목이 바뀌면 이름 캐시를 갱신합니다."""
+    if event.new_title: entity_cache.rename(event.chat_id, event.new_title)
+
+@client.on(events.Raw(UpdateUserName))
+async def user_name_handler(update):
+    """사용자 이름이 바뀌면 이름 캐시를 갱신합니다."""
+    name = f"{update.first_name} {update.last_name or ''}".strip()
+    if not name and update.usernames: name = f"@{update.usernames[0].username}"
+    if name: entity_cache.rename(update.user_id, name)
+
+async def process_message(message):
+    """실시간 메시지와 보충한 메시지를 같은 필터/중복 검사/전달 단계로 처리합니다."""
+    received_at = time.monotonic()
+    chat_id = message.chat_id
+    if not chat_cursors.advance(chat_id, message.id):
+        pipeline_stats['drop_already_seen'] += 1; return
+    pipeline_stats['received'] += 1
+    chat_stats.received[chat_id] += 1
+    # 1단계: 네트워크 요청 없이 판단 가능한 검사 (대상 채널 자신, 포함/제외 규칙 한 번에 스캔)
+    if chat_id in destination_peer_ids:
+        pipeline_stats['drop_target_chat'] += 1; return
+    if message.grouped_id is not None:
+        # 앨범 조각은 모아서 앨범 단위로 한 번만 판단합니다.
+        album_collector.add(message); return
+    await dispatch_messages([message], received_at)
+
+async def process_edit(message):
+    """
+    수정된 메시지를 다시 판단합니다. 본문이 그대로이거나 규칙에 맞지 않거나 이전 판단에 없던 링크가 없으면
+    건너뛰고, 새 링크가 생긴 경우에만 새 메시지와 같은 라우팅/중복 검사/전달 단계로 넘깁니다.
+    """
+    received_at = time.monotonic()
+    chat_id = message.chat_id
+    pipeline_stats['edited'] += 1
+    if chat_id in destination_peer_ids:
+        pipeline_stats['edit_target_chat'] += 1; return
+    key = (chat_id, message.id)
+    scan_text = message_scan_text(message)
+    digest = hashlib.md5(scan_text.encode('utf-8')).digest()
+    previous = edit_decisions.get(key)
+    if previous is not None and previous[0] == digest:
+        pipeline_stats['edit_unchanged'] += 1; return
+    seen = previous[1] if previous is not None else frozenset()
+    rule_match = rule_set.match(scan_text)
+    if not rule_match.include or rule_match.exclude:
+        edit_decisions.record(key, (), digest)
+        pipeline_stats['edit_no_match'] += 1; return
+    links = frozenset(link_key(link) for link in extract_links(message))
+    edit_decisions.record(key, links, digest)
+    if links <= seen:
+        pipeline_stats['edit_no_new_link'] += 1; return
+    pipeline_stats['edit_new_link'] += 1
+    logger.info(f"수정된 메시지에서 새 링크 감지: {chat_id}/{message.id}")
+    # 원본이 아직 outbox에서 대기 중이어도 수정된 본문과 링크로 따로 재시도하도록 수정 감지 시각(ms)을 outbox 키에 넣습니다.
+    # (edit_date는 초 단위라 연달아 한 수정이 같은 키가 될 수 있음)
+    revision = int(time.time() * 1000)
+    if message.grouped_id is None:
+        await dispatch_messages([message], received_at, rule_match, revision); return
+    # 앨범 조각이 수정되면 앨범 전체를 다시 가져와 앨범 단위로 판단합니다.
+    try: _, album = await fetch_source_message(chat_id, message.id)
+    except Exception as e: logger.warning(f"수정된 앨범 {chat_id}/{message.id} 조회 실패: {e}"); album = ()
+    await dispatch_messages(list(album) or [message], received_at, revision=revision)
+
+async def process_album(messages):
+    pipeline_stats['albums'] += 1
+    await dispatch_messages(messages)
+
+async def dispatch_messages(messages, received_at=None, rule_match=None, revision=0):
+    """
+    단일 메시지 또는 앨범 조각 전체를 규칙 매칭, 라우팅, 중복 검사한 뒤 하나의 전달 작업으로 만듭니다.
+    rule_match가 주어지면(수정 이벤트에서 이미 매칭한 경우) 다시 매칭하지 않습니다. revision은 수정 작업의 outbox 키입니다.
+    """
+    message = messages[0]
+    chat_id = message.chat_id
+    if rule_match is None:
+        started = time.perf_counter()
+        rule_match = rule_set.match("\n".join(message_scan_text(m) for m in messages))
+        metrics.observe('match', time.perf_counter() - started)
+        if rule_match.include and not rule_match.exclude: chat_stats.matched[chat_id] += 1
+    if not rule_match.include:
+        pipeline_stats['drop_no_keyword'] += 1; return
+    if rule_match.exclude:
+        pipeline_stats['drop_excluded'] += 1
+        logger.info(f"제외 규칙({', '.join(rule_match.exclude)})이 감지되어 메시지 전달을 건너뜁니다.")
+        return
+
+    # 2단계: 규칙에 매칭된 메시지만 라우팅, 링크 추출 및 대상별 중복 검사
+    dests = select_destinations(rule_match.include, chat_id)
+    if not dests:
+        pipeline_stats['drop_no_route'] += 1; return
+    started = time.perf_counter()
+    message_text = "\n".join(m.text for m in messages if m.text)
+    links = [link for m in messages for link in extract_links(m)]
+    link_keys = [link_key(link) for link in dict.fromkeys(links)]
+    # 나중에 수정되어도 같은 링크로 다시 판단하지 않도록 링크를 기록합니다. (본문 digest는 수정 시에만 계산)
+    for m in messages: edit_decisions.record((chat_id, m.id), link_keys)
+    dests = [d for d in dests if not is_duplicate_message(message_text, link_keys, d)]
+    if dests and shared_claims is not None:
+        if not (dests := claim_destinations(chat_id, message.id, message_text, link_keys, dests)):
+            metrics.observe('dedup', time.perf_counter() - started)
+            pipeline_stats['drop_claimed'] += 1
+            logger.info("다른 계정의 워커가 이미 전달한 메시지입니다. 전달 건너뜀.")
             return
+    metrics.observe('dedup', time.perf_counter() - started)
+    if not dests:
+        pipeline_stats['drop_duplicate'] += 1; return
+
+    # 3단계: outbox에 기록하고 전달 작업을 큐에 넣은 뒤 즉시 반환 (다운로드/전송은 전달 워커가 처리)
+    pipeline_stats['matched'] += 1
+    album = messages if len(messages) > 1 else ()
+    job = DeliveryJob(chat_id, message.id, message, message_text, link_keys, rule_match.include, dests, album,
+                      received_at, revision)
+    outbox.add(job.chat_id, job.msg_id, message_text, link_keys, job.rules, [d.key for d in dests],
+               any(m.media for m in messages), revision)
+    await enqueue_delivery(job)
+
+def job_dedup_keys(job):
+    """작업이 전달될 모든 대상의 중복 검사 키"""
+    for dest in job.destinations:
+        if job.content_hash: yield dest.scoped(job.content_hash)
+        for k in job.link_keys: yield dest.scoped(k)
+
+def release_job(job):
+    inflight_hashes.difference_update(job_dedup_keys(job))
+    outbox_inflight.discard((job.chat_id, job.msg_id, job.revision))
+
+async def enqueue_delivery(job):
+    """
+    전달 큐에 작업을 넣습니다. 큐가 가득 찬 경우 QUEUE_FULL_POLICY에 따라 처리합니다.
+    - drop_new: 새 작업을 버림
+    - drop_oldest: 가장 오래된 작업을 버리고 새 작업을 넣음
+    - block: QUEUE_PUT_TIMEOUT까지 기다린 뒤에도 자리가 없으면 새 작업을 버림
+    """
+    inflight_hashes.update(job_dedup_keys(job))
+    outbox_inflight.add((job.chat_id, job.msg_id, job.revision))
+    try:
+        delivery_queue.put_nowait(job); return
+    except asyncio.QueueFull:
+        pass
+    if QUEUE_FULL_POLICY == 'drop_oldest':
+        dropped = delivery_queue.get_nowait(); delivery_queue.task_done(); release_job(dropped)
+        outbox.defer(dropped.chat_id, dropped.msg_id, OUTBOX_SHED_DELAY, "전달 큐 가득 참", dropped.revision)
+        delivery_queue.put_nowait(job)
+        pipeline_stats['shed_oldest'] += 1
+        logger.warning(f"전달 큐가 가득 차 가장 오래된 작업을 버렸습니다. (큐 크기: {DELIVERY_QUEUE_SIZE})")
+        return
+    if QUEUE_FULL_POLICY == 'block':
+        try:
+            await asyncio.wait_for(delivery_queue.put(job), timeout=QUEUE_PUT_TIMEOUT); return
+        except asyncio.TimeoutError:
+            pass
+    release_job(job)
+    outbox.defer(job.chat_id, job.msg_id, OUTBOX_SHED_DELAY, "전달 큐 가득 참", job.revision)
+    pipeline_stats['shed_new'] += 1
+    logger.warning(f"전달 큐가 가득 차 새 작업을 버렸습니다. (큐 크기: {DELIVERY_QUEUE_SIZE})")
+
+async def delivery_worker():
+    """전달 큐에서 작업을 꺼내 미디어 다운로드 및 봇 전송을 수행합니다."""
+    while True:
+        job = await delivery_queue.get()
+        wait = time.monotonic() - job.enqueued_at
+        queue_wait_stats['count'] += 1; queue_wait_stats['total'] += wait
+        queue_wait_stats['max'] = max(queue_wait_stats['max'], wait)
+        metrics.observe('queue_wait', wait)
+        try:
+            await deliver(job)
+        finally:
+            release_job(job)
+            delivery_queue.task_done()
+
+async def send_to_destination(job, bot, dest, file=None, attributes=None, mime_type=None, caption=None):
+    """
+    bot으로 한 대상에 메시지를 보내고 대상별 전달 기록을 남깁니다. 실패하면 None을 반환합니다.
+    file이 목록이면 caption도 조각별 목록이며 하나의 앨범으로 전송됩니다.
+    """
+    entity = bot.entities.get(dest.key)
+    if entity is None: return None
+    started = time.perf_counter()
+    bot.active += 1
+    try:
+        if file is not None:
+            sent = await bot.scheduler.send_file(bot.client, entity, file,
+                                                 caption=job.text if caption is None else caption,
+                                                 attributes=attributes, mime_type=mime_type)
+        else:
+            sent = await bot.scheduler.send_message(bot.client, entity, job.text, link_preview=True)
+    except Exception as e:
+        pipeline_stats['failed'] += 1
+        bot_pool.record(bot, dest.key, e)
+        logger.error(f"대상 '{dest.key}'로 메시지 전송 실패 (봇 {bot.name}): {e}")
+        return None
+    finally:
+        bot.active -= 1
+    bot_pool.record(bot, dest.key)
+    metrics.observe('send', time.perf_counter() - started)
+    logger.info(f"봇을 통해 메시지 전달 완료: {dest.key}")
+    mark_message_as_forwarded(job.text, job.link_keys, dest)
+    pipeline_stats['forwarded'] += 1
+    return sent
+
+async def send_text(job, dest):
+    """텍스트 메시지를 대상에 보낼 수 있는 봇 중 여유 있는 봇으로 보내고, 실패하면 다음 봇으로 넘어갑니다."""
+    candidates = bot_pool.candidates(dest.key)
+    for i, bot in enumerate(candidates):
+        sent = await send_to_destination(job, bot, dest)
+        if sent is not None: return sent
+        if i + 1 < len(candidates): bot_pool.failover(bot, dest.key)
+    return None
+
+async def prepare_media(job, bot, use_cache=True):
+    """
+    작업의 미디어(앨범이면 모든 조각)를 동시에 bot으로 올리고 (UploadedMedia 목록, 조각별 캡션)을 반환합니다.
+    미디어 캐시에 있는 미디어는 올리지 않고 재사용하며, 업로드에 실패한 조각은 제외합니다.
+    """
+    parts = job.album or ([job.message] if job.message else [])
+    parts = [m for m in parts if m.media and not isinstance(m.media, MessageMediaWebPage)]
+    if not parts: return [], []
+    # 사용자 클라이언트에서 받은 청크를 디스크를 거치지 않고 봇 업로드로 바로 넘깁니다.
+    results = await asyncio.gather(*(transfer_media(client, bot.client, m, buffer_parts=MEDIA_BUFFER_PARTS,
+                                                    upload_workers=MEDIA_UPLOAD_WORKERS,
+                                                    spool_threshold=MEDIA_SPOOL_THRESHOLD,
+                                                    cache=media_cache if use_cache else None,
+                                                    cache_scope=bot.media_scope) for m in parts),
+                                   return_exceptions=True)
+    uploads, captions = [], []
+    for message, uploaded in zip(parts, results):
+        if isinstance(uploaded, Exception):
+            logger.error(f"미디어 {message.id} 전송 준비 중 오류 발생: {uploaded}")
+            continue
+        if uploaded is None: continue
+        uploads.append(uploaded); captions.append(message.text or "")
+    if uploads:
+        reused = sum(1 for u in uploads if u.cached)
+        logger.info(f"미디어 {len(uploads)}/{len(parts)}개 준비 완료: {sum(u.size or 0 for u in uploads)} bytes "
+                    f"(캐시 재사용 {reused}개)")
+    else:
+        logger.error("전송할 수 있는 미디어가 없어 텍스트만 전송합니다.")
+    return uploads, captions
+
+def input_media(uploaded):
+    """앨범 전송용 InputMedia"""
+    if uploaded.cached: return uploaded.file
+    if uploaded.attributes is None: return InputMediaUploadedPhoto(uploaded.file)
+    return InputMediaUploadedDocument(uploaded.file, uploaded.mime_type, uploaded.attributes)
+
+async def send_uploads(job, bot, dest, uploads, captions):
+    """준비한 미디어를 한 대상에 보내고 봇 쪽 미디어를 캐시에 기록합니다. 보낸 미디어 목록(실패 시 None)을 반환합니다."""
+    if job.album:
+        sent = await send_to_destination(job, bot, dest, [input_media(u) for u in uploads], caption=captions)
+    else:
+        u = uploads[0]
+        sent = await send_to_destination(job, bot, dest, u.file, u.attributes, u.mime_type)
+    if sent is None: return None
+    sent = sent if isinstance(sent, list) else [sent]
+    for uploaded, message in zip(uploads, sent):
+        media_cache.put(uploaded.source_key, uploaded.content_hash, message.media, uploaded.size)
+    return [m.media for m in sent]
+
+async def send_media(job, dest, bot, uploads, captions):
+    """
+    준비한 미디어를 대상에 보냅니다. 캐시된 파일 참조가 만료되었으면 다시 받아 올리고, 봇이 실패하면
+    다음 봇으로 미디어를 다시 준비해 보냅니다. (보낸 미디어 목록 또는 None, 사용한 봇, uploads, captions)를 반환합니다.
+    """
+    candidates = bot_pool.candidates(dest.key, prefer=bot)
+    for i, candidate in enumerate(candidates):
+        if candidate is not bot:
+            # 올린 파일은 올린 봇만 쓸 수 있으므로 다른 봇으로 보낼 때는 그 봇으로 다시 준비합니다.
+            bot = candidate
+            uploads, captions = await prepare_media(job, bot)
+            if not uploads: break
+        sent = await send_uploads(job, bot, dest, uploads, captions)
+        if sent is None and any(u.cached for u in uploads):
+            # 캐시된 파일 참조가 만료되었을 수 있으므로 캐시를 버리고 다시 받아서 올립니다.
+            media_cache.discard(*(u.source_key for u in uploads if u.cached))
+            uploads, captions = await prepare_media(job, bot, use_cache=False)
+            sent = await send_uploads(job, bot, dest, uploads, captions) if uploads else None
+        if sent is not None or not uploads: return sent, bot, uploads, captions
+        if i + 1 < len(candidates): bot_pool.failover(bot, dest.key)
+    return None, bot, uploads, captions
+
+async def deliver(job):
+    """작업을 모든 대상에 전달하고, 성공한 대상은 outbox에서 완료 처리하며 실패가 있으면 재시도를 예약합니다."""
+    message = job.message
+    message_text = job.text
+    delivered = []
+    try:
+        # 이름은 캐시와 메시지에 함께 온 엔티티로만 조회합니다. (GetUsers/GetChannels 요청 없음)
+        started = time.perf_counter()
+        chat_name = entity_cache.name(job.chat_id, message.chat if message else None)
+        sender_name = (entity_cache.name(message.sender_id, message.sender)
+                       if message and message.sender_id else "알 수 없음")
+        metrics.observe('names', time.perf_counter() - started)
         
-        sender = await event.get_sender()
-        chat_name = await get_entity_name(chat)
-        sender_name = await get_entity_name(sender)
-        
-        logger.info(f"키워드 감지: {chat_name} / {sender_name}")
+        logger.info(f"키워드 감지 (규칙: {', '.join(job.rules)}): {chat_name} / {sender_name}")
         logger.info(f"메시지 내용: {message_text[:100]}...")
-        
-        if not bot_target_entity:
-            logger.error("봇용 대상 채널이 설정되지 않았습니다. 메시지를 전달할 수 없습니다.")
-            return
 
-        # --- [핵심 수정 사항: 임시 파일 다운로드/삭제 방식] ---
-        file_to_send = None
-        
-        if event.message.media and not isinstance(event.message.media, MessageMediaWebPage):
-            logger.info("실제 미디어 파일 감지. 임시 파일로 다운로드를 시도합니다.")
-            try:
-                # 1. 서버 디스크의 임시 위치로 파일을 다운로드합니다.
-                #    Telethon이 파일명을 포함하여 저장합니다.
-                temp_file_path = await client.download_media(event.message, file=os.path.join('/tmp', ''))
-                file_to_send = temp_file_path
-                logger.info(f"미디어 다운로드 성공: {temp_file_path}")
-            except Exception as e:
-                logger.error(f"미디어 다운로드 중 오류 발생: {e}. 텍스트만 전송합니다.")
-                file_to_send = None
-
-        # 2. 메시지를 전송합니다. file 인자에 파일 경로를 넘겨줍니다.
-        await bot_client.send_message(
-            bot_target_entity,
-            message=message_text,
-            file=file_to_send,
-            link_preview=True
-        )
-        # ---
-
-        logger.info(f"봇을 통해 메시지 전달 완료: {TARGET_CHANNEL}")
-        mark_message_as_forwarded(message_text)
+        # 미디어는 첫 대상에 보낼 수 있는 봇 중 가장 여유 있는 봇으로 올립니다.
+        bot = next(iter(bot_pool.candidates(job.destinations[0].key)), None)
+        started = time.perf_counter()
+        uploads, captions = await prepare_media(job, bot) if bot is not None else ([], [])
+        if uploads: metrics.observe('media', time.perf_counter() - started)
+        remaining = list(job.destinations)
+        file = None
+        if uploads:
+            # 준비한 미디어는 첫 대상에 한 번 보내고, 나머지 대상에는 보낸 메시지의 미디어를 재사용합니다.
+            # 미디어 전송에 실패한 대상은 텍스트로 대신 보내지 않고 outbox 재시도(미디어 포함)로 넘깁니다.
+            while remaining and file is None:
+                dest = remaining.pop(0)
+                sent, bot, uploads, captions = await send_media(job, dest, bot, uploads, captions)
+                if sent is not None:
+                    file = sent if job.album else sent[0]; delivered.append(dest)
+                elif not uploads:
+                    # 다른 봇으로 미디어를 다시 준비하지 못한 경우에만 텍스트로 보냅니다.
+                    remaining.insert(0, dest); break
+        caption = captions if job.album and file is not None else None
+        if remaining:
+            if file is not None:
+                # 보낸 메시지의 미디어는 보낸 봇만 재사용할 수 있습니다. 그 봇이 보낼 수 없는 대상은 outbox 재시도로 넘깁니다.
+                sends = [send_to_destination(job, bot, dest, file, caption=caption) for dest in remaining]
+            else:
+                sends = [send_text(job, dest) for dest in remaining]
+            results = await asyncio.gather(*sends)
+            delivered += [dest for dest, sent in zip(remaining, results) if sent is not None]
+        error = None if len(delivered) == len(job.destinations) else "일부 대상 전송 실패"
         
     except Exception as e:
+        pipeline_stats['failed'] += 1
         logger.error(f"메시지 처리 중 심각한 오류 발생: {str(e)}")
-    finally:
-        # 3. 전송 성공/실패 여부와 관계없이 임시 파일을 반드시 삭제합니다.
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"임시 파일 삭제 완료: {temp_file_path}")
-            except Exception as e:
-                logger.error(f"임시 파일 삭제 실패: {e}")
+        error = e
+    if delivered:
+        metrics.observe('end_to_end', time.monotonic() - job.received_at)
+        outbox.complete(job.chat_id, job.msg_id, [d.key for d in delivered], job.revision)
+    if error is not None: outbox.fail(job.chat_id, job.msg_id, error, job.revision)
+
+async def fetch_source_message(chat_id, msg_id):
+    """
+    원본 메시지를 다시 가져옵니다. 앨범 조각이면 앞뒤 조각도 함께 가져와 (메시지, 앨범)을 반환합니다.
+    수정 이벤트는 첫 조각이 아닌 조각으로 올 수 있으므로 msg_id 양쪽으로 앨범 최대 크기만큼 조회합니다.
+    """
+    message = await client.get_messages(chat_id, ids=msg_id)
+    if message is None or message.grouped_id is None: return message, ()
+    ids = list(range(max(1, msg_id - MAX_ALBUM_PARTS + 1), msg_id + MAX_ALBUM_PARTS))
+    candidates = await client.get_messages(chat_id, ids=ids)
+    album = sorted((m for m in candidates if m is not None and m.grouped_id == message.grouped_id), key=lambda m: m.id)
+    return message, album if len(album) > 1 else ()
+
+async def outbox_retry_loop():
+    """
+    outbox에서 재시도 시각이 지난 항목(재시작 전에 전달하지 못한 항목 포함)을 다시 전달 큐에 넣습니다.
+    미디어는 원본 메시지를 다시 가져와 전달합니다.
+    """
+    await clients_ready.wait()
+    while True:
+        free = DELIVERY_QUEUE_SIZE - delivery_queue.qsize()
+        entries = outbox.due(free, outbox_inflight) if free > 0 else []
+        for entry in entries:
+            # 이미 전달된(중복) 대상만 완료로 표시하고, 설정에서 빠졌거나 봇이 접근할 수 없는 대상은 백오프 후 다시 시도합니다.
+            unreachable = [k for k in entry.destinations if k not in destinations or not bot_pool.reachable(k)]
+            dests, duplicates = [], []
+            for key in entry.destinations:
+                if key in unreachable: continue
+                dest = destinations[key]
+                (duplicates if is_duplicate_message(entry.text, entry.link_keys, dest) else dests).append(key)
+            if duplicates: outbox.complete(entry.chat_id, entry.msg_id, duplicates, entry.revision)
+            if not dests:
+                if unreachable:
+                    logger.warning(f"outbox 항목 {entry.chat_id}/{entry.msg_id}: 봇이 접근할 수 없는 대상 "
+                                   f"({', '.join(unreachable)})이라 나중에 다시 시도합니다.")
+                    outbox.fail(entry.chat_id, entry.msg_id, f"봇이 접근할 수 없는 대상: {', '.join(unreachable)}",
+                                entry.revision)
+                continue
+            dests = [destinations[k] for k in dests]
+            message, album = None, ()
+            if entry.has_media:
+                try: message, album = await fetch_source_message(entry.chat_id, entry.msg_id)
+                except Exception as e: logger.warning(f"원본 메시지 {entry.chat_id}/{entry.msg_id} 조회 실패: {e}")
+            logger.info(f"outbox 재시도: {entry.chat_id}/{entry.msg_id} (시도 {entry.attempts + 1}회째, 대상 {len(dests)}개)")
+            pipeline_stats['outbox_retried'] += 1
+            await enqueue_delivery(DeliveryJob(entry.chat_id, entry.msg_id, message, entry.text, entry.link_keys,
+                                               entry.rules, dests, album, revision=entry.revision))
+        await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+async def process_backfilled(message):
+    """보충한 메시지에도 실시간 핸들러와 같은 대화별 샘플링을 적용합니다."""
+    if not chat_sampled(message.chat_id, message.id):
+        chat_stats.sampled_out[message.chat_id] += 1; return
+    await process_message(message)
+
+async def backfill_missed_messages(dialogs=None):
+    """꺼져 있던 동안 올라온 메시지를 실시간 메시지와 같은 단계로 처리합니다."""
+    since = {chat_id: msg_id for chat_id, msg_id in chat_cursors.snapshot().items() if chat_allowed(chat_id)}
+    if not since:
+        logger.info("처리 위치 기록이 없어 놓친 메시지 보충을 건너뜁니다. (최초 실행)")
+    try:
+        result = await catch_up(client, chat_cursors, since, process_backfilled, concurrency=CATCHUP_CONCURRENCY,
+                                max_messages=CATCHUP_MAX_MESSAGES, dialogs=dialogs)
+    except Exception as e:
+        logger.error(f"놓친 메시지 보충 실패: {e}"); return
+    pipeline_stats['backfilled'] += result.messages
+    logger.info(f"놓친 메시지 보충 완료: 대화 {result.dialogs}개 중 {result.caught_up}개에서 {result.messages}건 "
+                f"({result.seconds:.1f}s, 일부만 보충 {result.truncated}개, 실패 {result.failed}개)")
+
+async def start_metrics_server():
+    """METRICS_PORT가 0이 아니면 게이지를 등록하고 127.0.0.1에 메트릭 엔드포인트를 엽니다."""
+    if not METRICS_PORT: return None
+    metrics.register_counters('send_scheduler', bot_pool.scheduler_stats)
+    if shared_claims is not None: metrics.register_counters('shared_claims', shared_claims.stats, label='result')
+    for kind, counter in bot_pool.stats.items(): metrics.register_counters(f'bot_{kind}', counter, label='bot')
+    metrics.register_counters('chat_received', lambda: {c: n for c, n, _ in chat_stats.top()}, label='chat')
+    metrics.register_counters('chat_matched', lambda: {c: chat_stats.matched[c] for c, _, _ in chat_stats.top()},
+                              label='chat')
+    metrics.register_counters('chat_filtered', lambda: dict(chat_stats.filtered.most_common(20)), label='chat')
+    metrics.register_counters('chat_sampled_out', lambda: dict(chat_stats.sampled_out.most_common(20)), label='chat')
+    metrics.register_counters('entity_cache', lambda: {'hit': entity_cache.hits, 'miss': entity_cache.misses,
+                                                       'refresh': entity_cache.refreshed}, label='result')
+    metrics.register_gauge('entity_cache_size', lambda: len(entity_cache))
+    metrics.register_gauge('delivery_queue_depth', lambda: delivery_queue.qsize())
+    metrics.register_gauge('inflight_hashes', lambda: len(inflight_hashes))
+    metrics.register_gauge('dedup_hashes', lambda: len(hash_store))
+    metrics.register_gauge('dedup_links', lambda: len(link_store))
+    metrics.register_gauge('dedup_index_bytes', lambda: hash_store.index.memory_usage())
+    if near_dup_index is not None: metrics.register_gauge('near_dup_fingerprints', lambda: len(near_dup_index))
+    metrics.register_gauge('outbox_pending', lambda: outbox.counts()[0])
+    metrics.register_gauge('outbox_dead', lambda: outbox.counts()[1])
+    metrics.register_gauge('media_cache_entries', lambda: len(media_cache))
+    metrics.register_gauge('loop_lag_p99_seconds', lambda: loop_lag.percentile(99))
+    metrics.register_gauge('loop_lag_max_seconds', lambda: loop_lag.max)
+    metrics.register_gauge('log_dropped', lambda: log_queue_handler.dropped)
+    server = MetricsServer(metrics, port=METRICS_PORT)
+    try: await server.start()
+    except OSError as e: logger.error(f"메트릭 엔드포인트를 열 수 없습니다 (포트 {METRICS_PORT}): {e}"); return None
+    return server
+
+async def start_pipeline():
+    """저장소를 열고 전달 큐, 전달 워커, 주기 작업을 시작합니다. 시작한 작업 목록을 반환합니다."""
+    global delivery_queue, clients_ready, live_ready, album_collector, reload_requested
+    load_hashes_from_file()
+    delivery_queue = asyncio.Queue(maxsize=DELIVERY_QUEUE_SIZE)
+    clients_ready = asyncio.Event()
+    reload_requested = asyncio.Event()
+    live_ready = asyncio.Event()
+    album_collector = AlbumCollector(process_album, window=ALBUM_WINDOW)
+    tasks = [asyncio.create_task(hash_store_maintenance()), asyncio.create_task(log_pipeline_stats()),
+             asyncio.create_task(loop_lag.run()), asyncio.create_task(outbox_retry_loop()),
+             asyncio.create_task(watch_config())]
+    tasks += [asyncio.create_task(delivery_worker()) for _ in range(DELIVERY_WORKERS)]
+    logger.info(f"전달 워커 {DELIVERY_WORKERS}개 시작 (큐 크기: {DELIVERY_QUEUE_SIZE}, 정책: {QUEUE_FULL_POLICY})")
+    return tasks
+
+async def stop_pipeline(tasks):
+    """기다리는 앨범을 넘기고 start_pipeline()의 작업을 멈춘 뒤 처리 통계를 남깁니다."""
+    await album_collector.flush_all()
+    for task in tasks: task.cancel()
+    logger.info(f"처리 통계: {format_pipeline_stats()}")
 
 async def main():
-    global target_entity, bot_target_entity
+    started = time.monotonic()
     lock = SingleInstanceLock(LOCK_FILE)
-    if not lock.acquire(): return
-    load_hashes_from_file()
+    if not lock.acquire(): return EXIT_NO_RESTART
+    if WORKER_NAME: logger.info(f"워커 '{WORKER_NAME}' 시작 (세션: {SESSION_NAME}, 공유 DB: {DATA_DIR})")
+    tasks = await start_pipeline()
+    if hasattr(signal, 'SIGHUP'): asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_requested.set)
+    metrics_server = await start_metrics_server()
     retry_count = 0
     try:
         while retry_count < MAX_RETRIES:
             try:
                 await client.start()
                 logger.info(f"사용자 로그인 성공: {await get_entity_name(await client.get_me())}")
-                await bot_client.start(bot_token=BOT_TOKEN)
-                logger.info(f"봇 로그인 성공: {await get_entity_name(await bot_client.get_me())}")
-                
-                target_entity = await resolve_target_entity(client, purpose="사용자용 대상")
-                bot_target_entity = await resolve_target_entity(bot_client, purpose="봇용 대상")
+                await bot_pool.start()
+                for bot in bot_pool:
+                    if not bot.disabled: logger.info(f"봇 로그인 성공: {await get_entity_name(await bot.client.get_me())}")
                 
-                if not bot_target_entity:
+                # 모든 대화의 엔티티를 미리 불러와 이후 이름/대상 조회에서 네트워크 요청을 줄입니다.
+                try: dialogs = await entity_cache.warm(client)
+                except Exception as e: logger.error(f"대화 목록 불러오기 실패: {e}"); dialogs = None
+                reachable = await resolve_routes()
+                if not reachable:
                     logger.error("봇이 대상 채널에 접근할 수 없습니다. 프로그램을 종료합니다.")
-                    return
+                    return EXIT_NO_RESTART
+                if len(reachable) < len(destinations):
+                    logger.warning(f"봇이 접근할 수 없는 대상 {len(destinations) - len(reachable)}개는 전달에서 제외됩니다.")
+                logger.info(f"라우트 {len(routes)}개, 대상 {len(reachable)}개 설정 완료")
+                await apply_chat_filter()
+                clients_ready.set()
                 
-                logger.info("모니터링 시작... (Ctrl+C를 눌러 종료)")
+                # 보충이 끝날 때까지 실시간 메시지는 핸들러에서 대기합니다. (재연결 시에도 다시 보충)
+                live_ready.clear()
+                if CATCHUP_ENABLED: await backfill_missed_messages(dialogs)
+                live_ready.set()
+                logger.info(f"모니터링 시작... (시작 소요 {time.monotonic() - started:.1f}s, Ctrl+C를 눌러 종료)")
                 await client.run_until_disconnected()
                 return
                 
             except (errors.PhoneNumberInvalidError, errors.ApiIdInvalidError, 
                     errors.AuthKeyUnregisteredError, errors.SessionPasswordNeededError) as e:
-                logger.error(f"인증 오류: {e}. setup_session.py를 다시 실행하세요."); return
+                logger.error(f"인증 오류: {e}. setup_session.py를 다시 실행하세요."); return EXIT_NO_RESTART
             except (errors.ServerError, errors.FloodWaitError, ConnectionError) as e:
                 retry_count += 1; wait_time = RETRY_DELAY * retry_count
                 logger.error(f"연결 오류: {e} ({retry_count}/{MAX_RETRIES})"); logger.info(f"{wait_time}초 후 재연결합니다.")
@@ -261,8 +1119,11 @@ async def main():
         if retry_count >= MAX_RETRIES:
             logger.error(f"최대 재시도 횟수({MAX_RETRIES})를 초과했습니다.")
     finally:
+        await stop_pipeline(tasks)
         if client.is_connected(): await client.disconnect()
-        if bot_client.is_connected(): await bot_client.disconnect()
+        await bot_pool.disconnect()
+        if metrics_server is not None: await metrics_server.close()
+        close_stores()
         lock.release()
 
 if __name__ == "__main__":
@@ -271,7 +1132,7 @@ if __name__ == "__main__":
         if not os.path.exists(session_file):
             print(f"오류: 세션 파일({session_file})을 찾을 수 없습니다. setup_session.py를 실행하세요.")
             sys.exit(1)
-        asyncio.run(main())
+        if asyncio.run(main()) == EXIT_NO_RESTART: sys.exit(EXIT_NO_RESTART)
     except KeyboardInterrupt:
         print("\n프로그램이 중단되었습니다.")
     except Exception as e:
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+유사 중복(near-duplicate) 메시지 감지 모듈
+- 문자 n-gram shingle로 64비트 SimHash 지문 생성
+- 지문을 (max_distance + r)개의 블록으로 나누고, r개 블록 조합마다 하나씩 둔 테이블에 저장
+  (해밍 거리가 max_distance 이하인 두 지문은 최소 r개 블록이 정확히 일치하므로 어느 한 테이블의 키가 같음)
+- 키 폭을 약 16비트로 넓혀 버킷당 후보 수를 작게 유지 (기본 임계값 0.9: 8개 블록 중 2개 조합, 테이블 28개)
+- 조회당 후보 수는 테이블 수 x 지문 수 / 2^16 정도 (기본 임계값에서 지문 10만 개일 때 약 40개)이며,
+  지문 수 상한은 max_entries로 둠
+- 지문과 버킷 연결은 array에 링 버퍼로 보관하여 만료/제거가 O(1)이고 지문 1개당 메모리가 일정
+"""
+
+import re
+import math
+import time
+import hashlib
+from array import array
+from itertools import combinations
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+KEY_BITS = 16  # 테이블 키(버킷 번호)의 최대 폭
+MAX_TABLES = 64  # 키를 넓히려고 블록 조합을 늘릴 때 허용하는 최대 테이블 수
+_NORMALIZE_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def _shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text, shingle_size=SHINGLE_SIZE):
+    """공백/기호/이모지를 제거한 텍스트의 문자 shingle로 64비트 SimHash를 계산합니다."""
+    normalized = _NORMALIZE_PATTERN.sub('', (text or '').lower())
+    if len(normalized) <= shingle_size:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + shingle_size] for i in range(len(normalized) - shingle_size + 1)}
+    weights = [0] * FINGERPRINT_BITS
+    for shingle in shingles:
+        h = _shingle_hash(shingle)
+        for bit in range(FINGERPRINT_BITS):
+            if h >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def similarity_to_distance(similarity):
+    """0~1 사이의 유사도 임계값을 64비트 지문의 최대 해밍 거리로 변환합니다."""
+    return max(0, min(FINGERPRINT_BITS - 1, int(round((1.0 - similarity) * FINGERPRINT_BITS))))
+
+
+def _plan_tables(max_distance):
+    """
+    (블록 수, 키로 쓰는 블록 수)를 정합니다. 테이블 수가 MAX_TABLES를 넘지 않는 범위에서
+    키 폭이 KEY_BITS 이상이 되는 가장 적은 블록 조합을 고릅니다.
+    """
+    plan = None
+    for r in range(1, FINGERPRINT_BITS):
+        blocks = max_distance + r
+        if blocks > FINGERPRINT_BITS or (plan and math.comb(blocks, r) > MAX_TABLES):
+            break
+        plan = (blocks, r)
+        if r * (FINGERPRINT_BITS // blocks) >= KEY_BITS:
+            break
+    return plan
+
+
+class NearDuplicateIndex:
+    """
+    SimHash 지문을 블록 조합별 테이블에 저장하는 다중 테이블 인덱스.
+    지문은 기록 순서대로 링 버퍼에 보관하고 순번(seq)으로 가리킵니다. 테이블마다 버킷의 가장 최근 순번(heads)과
+    같은 버킷의 바로 이전 항목까지의 순번 차이(links)를 두어, 링에서 밀려난 항목(순번 < head)은 따로 지우지 않아도
+    조회에서 자연히 빠집니다. TTL이 지나거나 max_entries를 넘으면 앞에서부터 제거합니다.
+    """
+
+    def __init__(self, similarity=0.9, ttl_seconds=24 * 3600, max_entries=None, initial_capacity=1024):
+        self.max_distance = similarity_to_distance(similarity)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        block_count, key_blocks = _plan_tables(self.max_distance)
+        base, extra = divmod(FINGERPRINT_BITS, block_count)
+        blocks, shift = [], 0
+        for i in range(block_count):
+            width = base + (1 if i < extra else 0)
+            blocks.append((shift, (1 << width) - 1, width))
+            shift += width
+        self._tables = [[blocks[i] for i in combo] for combo in combinations(range(block_count), key_blocks)]
+        self._key_width = min(sum(width for _, _, width in table) for table in self._tables)
+        self._live = 0
+        capacity = min(initial_capacity, max_entries) if max_entries else initial_capacity
+        self._capacity = capacity
+        self._head = 0  # 링에 남아 있는 가장 오래된 항목의 순번
+        self._tail = 0  # 다음에 기록할 항목의 순번
+        self._fingerprints = array('Q', bytes(8 * capacity))
+        self._timestamps = array('q', bytes(8 * capacity))  # 0이면 제거된 항목
+        # 버킷 수는 최대 용량 기준으로 처음에 정합니다. (링만 늘리면 되므로 용량을 늘릴 때 항목을 다시 넣지 않음)
+        bits = min(self._key_width, KEY_BITS, max(1, ((max_entries or 1 << KEY_BITS) - 1).bit_length()))
+        self._bucket_mask = (1 << bits) - 1
+        self._heads = [array('q', bytes(8 << bits)) for _ in self._tables]  # 순번 + 1 (0이면 빈 버킷)
+        self._links = [array('I', bytes(4 * capacity)) for _ in self._tables]  # 같은 버킷의 이전 항목까지의 순번 차이
+
+    def __len__(self):
+        return self._live
+
+    def _buckets(self, fingerprint):
+        mask = self._bucket_mask
+        for table in self._tables:
+            key = 0
+            for shift, block_mask, width in table:
+                key = key << width | fingerprint >> shift & block_mask
+            yield key & mask
+
+    def _chain(self, table, bucket):
+        """버킷의 항목 슬롯을 최근 순서로 반환합니다."""
+        seq, head, capacity, links = self._heads[table][bucket] - 1, self._head, self._capacity, self._links[table]
+        while seq >= head:
+            slot = seq % capacity
+            yield slot
+            gap = links[slot]
+            if not gap:
+                break
+            seq -= gap
+
+    def find(self, fingerprint):
+        """max_distance 이내의 저장된 지문을 찾아 반환하고, 없으면 None을 반환합니다."""
+        cutoff = time.time() - self.ttl_seconds
+        fingerprints, timestamps, max_distance = self._fingerprints, self._timestamps, self.max_distance
+        for table, bucket in enumerate(self._buckets(fingerprint)):
+            for slot in self._chain(table, bucket):
+                candidate = fingerprints[slot]
+                if timestamps[slot] > cutoff and hamming_distance(candidate, fingerprint) <= max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint, ts=None):
+        ts = int(ts if ts is not None else time.time())
+        # 같은 지문을 다시 기록하면 이전 항목을 제거하고 맨 뒤에 새로 기록합니다.
+        for slot in self._chain(0, next(self._buckets(fingerprint))):
+            if self._fingerprints[slot] == fingerprint and self._timestamps[slot]:
+                self._timestamps[slot] = 0
+                self._live -= 1
+                break
+        if self._tail - self._head == self._capacity:
+            if self.max_entries and self._capacity >= self.max_entries:
+                self._remove_oldest()
+            else:
+                self._grow(min(self._capacity * 2, self.max_entries or self._capacity * 2))
+        self._insert(fingerprint, ts)
+
+    def _insert(self, fingerprint, ts):
+        seq = self._tail
+        slot = seq % self._capacity
+        self._fingerprints[slot] = fingerprint
+        self._timestamps[slot] = ts
+        for heads, links, bucket in zip(self._heads, self._links, self._buckets(fingerprint)):
+            previous = heads[bucket] - 1
+            links[slot] = seq - previous if previous >= self._head else 0
+            heads[bucket] = seq + 1
+        self._tail = seq + 1
+        self._live += 1
+
+    def _grow(self, capacity):
+        """링 용량을 늘립니다. 항목은 순번으로 연결되어 있으므로 슬롯 위치만 옮기면 됩니다."""
+        old_capacity, count = self._capacity, self._tail - self._head
+        def relocate(old, new):
+            seq, end = self._head, self._head + count
+            while seq < end:
+                src, dst = seq % old_capacity, seq % capacity
+                n = min(end - seq, old_capacity - src, capacity - dst)
+                new[dst:dst + n] = old[src:src + n]
+                seq += n
+            return new
+        self._fingerprints = relocate(self._fingerprints, array('Q', bytes(8 * capacity)))
+        self._timestamps = relocate(self._timestamps, array('q', bytes(8 * capacity)))
+        self._links = [relocate(links, array('I', bytes(4 * capacity))) for links in self._links]
+        self._capacity = capacity
+
+    def _remove_oldest(self):
+        slot = self._head % self._capacity
+        if self._timestamps[slot]:
+            self._timestamps[slot] = 0
+            self._live -= 1
+        self._head += 1
+
+    def sweep(self, now=None):
+        """앞쪽부터 만료된 지문을 제거하고 제거한 개수를 반환합니다."""
+        cutoff = (now if now is not None else time.time()) - self.ttl_seconds
+        timestamps, capacity = self._timestamps, self._capacity
+        removed = 0
+        while self._head < self._tail and timestamps[self._head % capacity] <= cutoff:
+            removed += bool(timestamps[self._head % capacity])
+            self._remove_oldest()
+        return removed
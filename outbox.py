@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+전달 대기 메시지를 보관하는 영속 outbox
+- 감지된 메시지를 (owner, chat_id, msg_id, revision) 단위로 SQLite(WAL)에 기록하여 크래시, 재시작, 봇 장애에도 유실되지 않음
+- 기록/완료/실패 처리는 모아서 하나의 트랜잭션으로 커밋 (group commit)
+- 대상별로 전달 완료를 표시하여 이미 보낸 대상에는 다시 보내지 않음
+- 실패 시 지수 백오프로 재시도하고, 최대 시도 횟수를 넘으면 dead-letter 테이블로 이동
+- 여러 계정의 워커가 같은 DB를 쓰면 항목마다 기록한 워커(owner)를 남기고, 재시도는 자기 항목만 가져옴
+  (원본 메시지는 그 메시지를 받은 계정만 다시 가져올 수 있음)
+- 새 링크가 생긴 수정은 수정 감지 시각(revision)으로 원본과 따로 기록하여, 원본이 아직 대기 중이어도
+  수정된 본문과 링크가 재시도에서 유실되지 않음 (원본 메시지는 revision 0)
+"""
+
+import json
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxEntry:
+    """DB에서 읽어 온 재시도 대상 항목"""
+    __slots__ = ('chat_id', 'msg_id', 'revision', 'text', 'link_keys', 'rules', 'destinations', 'has_media',
+                 'attempts')
+
+    def __init__(self, row):
+        (self.chat_id, self.msg_id, self.revision, self.text, link_keys, rules, destinations,
+         has_media, self.attempts) = row
+        self.link_keys = [bytes.fromhex(k) for k in json.loads(link_keys)]
+        self.rules = json.loads(rules)
+        self.destinations = json.loads(destinations)
+        self.has_media = bool(has_media)
+
+
+COLUMNS = ('chat_id', 'msg_id', 'text', 'link_keys', 'rules', 'destinations', 'has_media', 'attempts', 'created',
+           'next_attempt', 'last_error', 'owner', 'revision')
+KEY = "owner, chat_id, msg_id, revision"
+
+
+
+class Outbox:
+    def __init__(self, db_path, batch_size=50, max_attempts=8, base_delay=5.0, max_delay=3600.0, owner=''):
+        self.db_path = db_path
+        self.owner = owner
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._ops = []
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self.db_path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ("chat_id INTEGER NOT NULL, msg_id INTEGER NOT NULL, text TEXT, link_keys TEXT, rules TEXT, "
+                   "destinations TEXT, has_media INTEGER, attempts INTEGER NOT NULL DEFAULT 0, "
+                   "created REAL, next_attempt REAL, last_error TEXT, owner TEXT NOT NULL DEFAULT '', "
+                   "revision INTEGER NOT NULL DEFAULT 0")
+        for table in ('outbox', 'outbox_dead'):
+            # owner/revision 열이 없던 이전 DB는 열을 추가합니다. (기존 항목은 기본 워커 '' 소유의 원본 메시지)
+            info = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if info and 'owner' not in info:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+            if info and 'revision' not in info:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        # 개인 대화와 일반 그룹의 msg_id는 계정마다 따로 매겨지므로 키에 owner를, 수정은 원본과 따로 재시도하도록
+        # revision을 포함합니다. 이전 DB의 (chat_id, msg_id) 또는 (owner, chat_id, msg_id) 키 테이블은 새 키로 다시 만듭니다.
+        with self._conn:
+            # 여러 워커가 동시에 시작해도 한 번만 옮기도록 쓰기 잠금을 잡은 뒤 확인합니다.
+            self._conn.execute("BEGIN IMMEDIATE")
+            pk = {row[1]: row[5] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if pk and not pk.get('revision'):
+                names = ", ".join(COLUMNS)
+                self._conn.execute("DROP INDEX IF EXISTS idx_outbox_next_attempt")
+                self._conn.execute("ALTER TABLE outbox RENAME TO outbox_old")
+                self._conn.execute(f"CREATE TABLE outbox ({columns}, PRIMARY KEY ({KEY}))")
+                self._conn.execute(f"INSERT INTO outbox ({names}) SELECT {names} FROM outbox_old")
+                self._conn.execute("DROP TABLE outbox_old")
+                logger.info(f"Outbox 테이블 키를 ({KEY})로 변경했습니다.")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS outbox ({columns}, PRIMARY KEY ({KEY}))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt)")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS outbox_dead ({columns}, died_at REAL)")
+        self._conn.commit()
+        pending, dead = self.counts()
+        logger.info(f"Outbox 로드: 전달 대기 {pending}건, dead-letter {dead}건")
+
+    def backoff(self, attempts):
+        return min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+
+    def _queue(self, op):
+        self._ops.append(op)
+        if len(self._ops) >= self.batch_size:
+            self.flush()
+
+    def add(self, chat_id, msg_id, text, link_keys, rules, destinations, has_media, revision=0):
+        now = time.time()
+        row = (chat_id, msg_id, text, json.dumps([k.hex() for k in link_keys]), json.dumps(list(rules)),
+               json.dumps(list(destinations)), int(has_media), now, now, self.owner, revision)
+        self._queue(('add', row))
+
+    def complete(self, chat_id, msg_id, destinations, revision=0):
+        """전달이 끝난 대상을 항목에서 제거하고, 남은 대상이 없으면 항목을 삭제합니다."""
+        self._queue(('complete', chat_id, msg_id, revision, set(destinations), None))
+
+    def fail(self, chat_id, msg_id, error, revision=0):
+        """시도 횟수를 늘리고 백오프 후 재시도하도록 표시합니다. 최대 횟수를 넘으면 dead-letter로 옮깁니다."""
+        self._queue(('fail', chat_id, msg_id, revision, None, str(error)[:500]))
+
+    def defer(self, chat_id, msg_id, delay, reason, revision=0):
+        """시도 횟수를 늘리지 않고 delay초 뒤에 다시 시도하도록 표시합니다."""
+        self._queue(('defer', chat_id, msg_id, revision, delay, reason))
+
+    def _apply(self, op):
+        conn = self._conn
+        if op[0] == 'add':
+            conn.execute("INSERT OR IGNORE INTO outbox (chat_id, msg_id, text, link_keys, rules, destinations, "
+                         "has_media, created, next_attempt, owner, revision) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         op[1])
+            return
+        kind, chat_id, msg_id, revision, arg, error = op
+        key = (self.owner, chat_id, msg_id, revision)
+        where = "WHERE owner = ? AND chat_id = ? AND msg_id = ? AND revision = ?"
+        if kind == 'complete':
+            row = conn.execute(f"SELECT destinations FROM outbox {where}", key).fetchone()
+            if row is None:
+                return
+            remaining = [d for d in json.loads(row[0]) if d not in arg]
+            if remaining:
+                conn.execute(f"UPDATE outbox SET destinations = ? {where}", (json.dumps(remaining), *key))
+            else:
+                conn.execute(f"DELETE FROM outbox {where}", key)
+        elif kind == 'fail':
+            row = conn.execute(f"SELECT attempts FROM outbox {where}", key).fetchone()
+            if row is None:
+                return
+            attempts = row[0] + 1
+            if attempts >= self.max_attempts:
+                names = ", ".join(COLUMNS)
+                died_at = time.time()
+                conn.execute(f"INSERT INTO outbox_dead ({names}, died_at) SELECT {names}, ? FROM outbox {where}",
+                             (died_at, *key))
+                conn.execute(f"UPDATE outbox_dead SET attempts = ?, last_error = ? {where} AND died_at = ?",
+                             (attempts, error, *key, died_at))
+                conn.execute(f"DELETE FROM outbox {where}", key)
+                logger.error(f"Outbox 항목 {chat_id}/{msg_id}{f' (수정 {revision})' if revision else ''}가 {attempts}회 실패하여 dead-letter로 이동: {error}")
+            else:
+                conn.execute(f"UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? {where}",
+                             (attempts, time.time() + self.backoff(attempts), error, *key))
+        elif kind == 'defer':
+            conn.execute(f"UPDATE outbox SET next_attempt = ?, last_error = ? {where}",
+                         (time.time() + arg, error, *key))
+
+    def flush(self):
+        """대기 중인 기록/완료/실패 처리를 하나의 트랜잭션으로 커밋합니다."""
+        if not self._ops or self._conn is None:
+            return 0
+        ops, self._ops = self._ops, []
+        try:
+            with self._conn:
+                for op in ops:
+                    self._apply(op)
+        except sqlite3.Error as e:
+            logger.error(f"Outbox 커밋 실패: {e}")
+            self._ops = ops + self._ops
+            return 0
+        return len(ops)
+
+    def due(self, limit, exclude=()):
+        """
+        이 워커가 기록한 항목 중 재시도 시각이 지난 항목을 오래된 순서로 최대 limit개 반환합니다.
+        exclude의 (chat_id, msg_id, revision)은 제외합니다.
+        """
+        self.flush()
+        rows = self._conn.execute(
+            "SELECT chat_id, msg_id, revision, text, link_keys, rules, destinations, has_media, attempts FROM outbox "
+            "WHERE next_attempt <= ? AND owner = ? ORDER BY next_attempt LIMIT ?",
+            (time.time(), self.owner, limit + len(exclude)))
+        entries = [OutboxEntry(row) for row in rows if row[:3] not in exclude]
+        return entries[:limit]
+
+    def counts(self):
+        pending = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE owner = ?", (self.owner,)).fetchone()[0]
+        dead = self._conn.execute("SELECT COUNT(*) FROM outbox_dead WHERE owner = ?", (self.owner,)).fetchone()[0]
+        return pending, dead
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+
+"""
+텔레그램 계정 없이 monitor.py의 실제 처리 경로에 이벤트를 재생하는 도구
+- 사용자/봇 TelegramClient 대신 네트워크 없이 바로 응답하는 가짜 클라이언트를 넣고
+  합성하거나 기록한 NewMessage 이벤트를 실제 handler에 정해진 속도로 주입
+- 규칙 매칭, 중복 검사, outbox/해시 DB 기록(group commit), 미디어 전송 준비, 전송 스케줄러를 그대로 실행
+- 초당 처리량, 종단 간 지연 p50/p99, 메모리 증가량, 전달 1건당 디스크 쓰기를 측정
+- monitor.py의 CAPTURE_FILE로 기록한 실제 트래픽을 원래 속도나 최대 속도로 재생하며 cProfile 또는
+  샘플링 프로파일러로 측정 (python replay.py capture.jsonl --profile cprofile)
+
+monitor는 import 시점에 환경 변수를 읽으므로 prepare_environment()로 임시 디렉터리를 설정한 뒤
+load_monitor()로 불러옵니다. 이벤트 한 건은 다음 필드를 가진 dict이며 JSONL 파일로도 읽을 수 있습니다.
+    t: 첫 이벤트 기준 시각(초, 기록 파일은 ts: 수신 시각), chat_id, msg_id, sender_id, text,
+    media(None/'photo'/'document'/...), media_id, size(bytes), grouped_id
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import cProfile
+import pstats
+import tempfile
+import threading
+import importlib
+from collections import Counter
+from datetime import datetime, timezone
+from telethon import events, utils
+from telethon.tl import types
+
+BENCH_TARGET = -1001000000001  # 가짜 전달 대상 채널
+CHUNK_SIZE = 128 * 1024
+
+
+def prepare_environment(data_dir=None, rules_file=None, log_level='WARNING', bots=1):
+    """가짜 계정 정보와 임시 DB/로그/세션 경로를 환경 변수로 설정하고 사용한 디렉터리를 반환합니다. (bots: 봇 풀 크기)"""
+    data_dir = data_dir or tempfile.mkdtemp(prefix='monitor-replay-')
+    os.makedirs(data_dir, exist_ok=True)
+    os.environ.update({
+        'API_ID': '1', 'API_HASH': 'replay', 'PHONE_NUMBER': '+0', 'BOT_TOKEN': '1000:replay',
+        'BOT_TOKENS': ','.join(f"{1000 + i}:replay" for i in range(1, bots)),
+        'SESSION_NAME': os.path.join(data_dir, 'replay_session'),
+        'TARGET_CHANNEL': str(BENCH_TARGET),
+        'RULES_FILE': rules_file or os.path.join(data_dir, 'rules.json'),  # 없으면 기본 규칙(open.kakao.com)
+        'DATA_DIR': data_dir,
+        'LOG_FILE': os.path.join(data_dir, 'replay.log'),
+        'LOG_LEVEL': log_level,
+        'METRICS_PORT': '0',
+        'CATCHUP_ENABLED': 'false',
+        'CAPTURE_FILE': '',
+    })
+    return data_dir
+
+
+def load_monitor():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    return importlib.import_module('monitor')
+
+
+class FakeUserClient:
+    """사용자 클라이언트 대역: 엔티티 조회와 미디어 다운로드만 흉내 냅니다."""
+
+    parse_mode = None
+    _self_id = 0
+
+    def __init__(self):
+        self._mb_entity_cache = {}
+        self.downloaded_bytes = 0
+
+    async def get_me(self):
+        return types.User(id=1, is_self=True, first_name='replay')
+
+    async def get_entity(self, peer):
+        if isinstance(peer, int) and peer < 0:
+            real_id, _ = utils.resolve_id(peer)
+            return types.Channel(id=real_id, title=f'replay {real_id}', photo=types.ChatPhotoEmpty(), date=None,
+                                 broadcast=True, access_hash=real_id)
+        return types.User(id=abs(int(peer)), first_name=f'user {peer}', access_hash=1)
+
+    async def get_peer_id(self, peer):
+        if isinstance(peer, int): return peer
+        raise ValueError(f"재생 모드에서는 숫자 ID만 해석할 수 있습니다: {peer}")
+
+    async def get_dialogs(self):
+        return []
+
+    async def get_messages(self, *args, **kwargs):
+        return None
+
+    async def iter_download(self, media, request_size=CHUNK_SIZE, file_size=None):
+        remaining = file_size or 0
+        chunk = bytes(request_size)
+        while remaining > 0:
+            n = min(request_size, remaining)
+            remaining -= n
+            self.downloaded_bytes += n
+            yield chunk[:n]
+
+    async def download_media(self, message, file=bytes):
+        data = message.media.photo.id.to_bytes(8, 'little', signed=True) * (message.file.size // 8)
+        self.downloaded_bytes += len(data)
+        if file is bytes: return data
+        file.write(data)
+        return file
+
+
+class FakeBotClient:
+    """봇 클라이언트 대역: 업로드/전송 요청을 send_latency초 뒤 성공으로 처리합니다."""
+
+    parse_mode = None
+
+    def __init__(self, send_latency=0.0):
+        self.send_latency = send_latency
+        self.sent = 0
+        self.uploaded_parts = 0
+        self._next_id = 1
+
+    async def __call__(self, request):
+        self.uploaded_parts += 1
+        return True
+
+    async def get_me(self):
+        return types.User(id=2, bot=True, first_name='replay bot')
+
+    get_entity = FakeUserClient.get_entity
+
+    async def upload_file(self, file, file_size=None, file_name=None, part_size_kb=None):
+        self.uploaded_parts += 1
+        return types.InputFile(random.getrandbits(63), 1, file_name or 'file', '')
+
+    def _media(self, file, attributes=None):
+        self._next_id += 1
+        if isinstance(file, (types.MessageMediaPhoto, types.MessageMediaDocument)):
+            return file
+        if isinstance(file, (types.InputMediaUploadedPhoto, types.InputMediaPhoto)) or \
+                (isinstance(file, (types.InputFile, types.InputFileBig)) and attributes is None):
+            return types.MessageMediaPhoto(photo=types.Photo(self._next_id, 1, b'', None, [], 2))
+        return types.MessageMediaDocument(document=types.Document(self._next_id, 1, b'', None,
+                                                                  'application/octet-stream', 0, 2, []))
+
+    async def _sent(self, entity, text, media=None):
+        if self.send_latency: await asyncio.sleep(self.send_latency)
+        self.sent += 1
+        self._next_id += 1
+        return types.Message(id=self._next_id, peer_id=utils.get_peer(entity), message=text or '', media=media)
+
+    async def send_message(self, entity, message, **kwargs):
+        return await self._sent(entity, message)
+
+    async def send_file(self, entity, file, caption=None, attributes=None, **kwargs):
+        if isinstance(file, list):
+            captions = caption if isinstance(caption, list) else [caption] * len(file)
+            return [await self._sent(entity, c, self._media(f)) for f, c in zip(file, captions)]
+        return await self._sent(entity, caption, self._media(file, attributes))
+
+
+def synthetic_events(count, rate=0.0, match_ratio=0.3, duplicate_ratio=0.2, photo_ratio=0.1, document_ratio=0.05,
+                     album_ratio=0.0, edit_ratio=0.0, chats=50, document_size=2 * 1024 * 1024, seed=1):
+    """
+    count건의 이벤트를 만듭니다. rate가 0이면 모든 이벤트의 시각이 0(최대 속도)입니다.
+    match_ratio는 규칙(open.kakao.com 링크)에 걸리는 비율, duplicate_ratio는 이전에 나온 본문을 반복하는 비율입니다.
+    edit_ratio는 최근 메시지의 수정 이벤트 비율이며, 수정의 1/4은 새 링크를 덧붙이고 나머지는 본문을 바꾸지 않습니다.
+    """
+    rng = random.Random(seed)
+    msg_ids = {}
+    matched_texts, plain_texts = [], []
+    result = []
+    media_id = 1
+    i = 0
+    recent = []  # 수정할 수 있는 최근 단일 메시지
+    while len(result) < count:
+        t = i / rate if rate else 0.0
+        if recent and rng.random() < edit_ratio:
+            spec = dict(rng.choice(recent), t=t, edit=True)
+            if rng.random() < 0.25:
+                spec['text'] = f"{spec['text']} https://open.kakao.com/o/g{rng.getrandbits(40):x}"
+            result.append(spec)
+            i += 1
+            continue
+        chat_id = -1002000000000 - rng.randrange(chats)
+        sender_id = 3000 + rng.randrange(chats * 20)
+        matched = rng.random() < match_ratio
+        pool = matched_texts if matched else plain_texts
+        if pool and rng.random() < duplicate_ratio:
+            text = rng.choice(pool)
+        else:
+            body = ' '.join(f"w{rng.randrange(100000)}" for _ in range(rng.randint(5, 40)))
+            text = f"{body} https://open.kakao.com/o/g{rng.getrandbits(40):x}" if matched else body
+            pool.append(text)
+        roll = rng.random()
+        if roll < album_ratio:
+            parts, kind = rng.randint(2, 4), 'photo'
+        elif roll < album_ratio + photo_ratio:
+            parts, kind = 1, 'photo'
+        elif roll < album_ratio + photo_ratio + document_ratio:
+            parts, kind = 1, 'document'
+        else:
+            parts, kind = 1, None
+        grouped_id = rng.getrandbits(62) if parts > 1 else None
+        for part in range(min(parts, count - len(result))):
+            msg_ids[chat_id] = msg_ids.get(chat_id, 0) + 1
+            result.append({'t': t, 'chat_id': chat_id, 'msg_id': msg_ids[chat_id], 'sender_id': sender_id,
+                           'text': text if part == 0 else '', 'media': kind, 'media_id': media_id if kind else None,
+                           'size': document_size if kind == 'document' else None, 'grouped_id': grouped_id})
+            media_id += 1 if kind else 0
+        if parts == 1:
+            recent.append(result[-1])
+            if len(recent) > 200: recent.pop(0)
+        i += 1
+    return result
+
+
+def load_events(*paths):
+    """
+    JSONL 파일들의 이벤트를 시각 순서로 읽습니다. (교체된 기록 파일 capture.jsonl.1 등을 함께 넘길 수 있음)
+    수신 시각(ts)만 있는 기록 파일은 첫 이벤트 기준 시각(t)으로 바꿉니다.
+    """
+    specs = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            specs.extend(json.loads(line) for line in f if line.strip())
+    if specs and 't' not in specs[0]:
+        specs.sort(key=lambda spec: spec['ts'])
+        first = specs[0]['ts']
+        for spec in specs: spec['t'] = spec['ts'] - first
+    else:
+        specs.sort(key=lambda spec: spec.get('t', 0.0))
+    return specs
+
+
+def build_message(spec, client):
+    """이벤트 dict로 실제 Telethon Message 객체를 만듭니다. (채팅/보낸 사람 엔티티 포함)"""
+    chat_id, sender_id = spec['chat_id'], spec.get('sender_id')
+    peer = utils.get_peer(chat_id)
+    media = None
+    if spec.get('media') == 'photo':
+        size = spec.get('size') or 100 * 1024
+        media = types.MessageMediaPhoto(photo=types.Photo(spec['media_id'], spec['media_id'], b'', None,
+                                                          [types.PhotoSize('y', 1280, 960, size)], 2))
+    elif spec.get('media') == 'document':
+        media = types.MessageMediaDocument(document=types.Document(
+            spec['media_id'], spec['media_id'], b'', None, 'video/mp4', spec.get('size') or 1024 * 1024, 2,
+            [types.DocumentAttributeFilename(f"{spec['media_id']}.mp4")]))
+    elif spec.get('preview_url'):
+        url = spec['preview_url']
+        media = types.MessageMediaWebPage(webpage=types.WebPage(0, url, url, 0))
+    # 숨은 링크와 링크 미리보기는 링크 추출과 규칙 매칭에 쓰이므로 기록된 그대로 되살립니다.
+    entities = [types.MessageEntityTextUrl(offset, length, url) for offset, length, url in spec.get('text_urls', ())]
+    message = types.Message(id=spec['msg_id'], peer_id=peer, date=datetime.now(timezone.utc),
+                            message=spec.get('text') or '', from_id=types.PeerUser(sender_id) if sender_id else None,
+                            media=media, grouped_id=spec.get('grouped_id'), entities=entities or None)
+    real_id, _ = utils.resolve_id(chat_id)
+    entities = {chat_id: types.Channel(id=real_id, title=f'chat {real_id}', photo=types.ChatPhotoEmpty(), date=None,
+                                       megagroup=True, access_hash=real_id)}
+    if sender_id: entities[sender_id] = types.User(id=sender_id, first_name=f'user {sender_id}', access_hash=1)
+    message._finish_init(client, entities, None)
+    return message
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _io_counters():
+    """(write 호출 수, 쓴 바이트) - /proc/self/io가 없는 환경이면 None"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['syscw']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _percentile(samples, pct):
+    if not samples: return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class SamplingProfiler:
+    """
+    별도 스레드에서 interval초마다 대상 스레드의 호출 스택을 수집하는 샘플링 프로파일러.
+    결과는 flamegraph.pl, speedscope 등에서 읽을 수 있는 collapsed stack 형식으로 저장합니다.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack: self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit=20):
+        """샘플에서 스택 맨 위(직접 실행 중)였던 함수별 비율"""
+        leaves = Counter()
+        for stack, count in self.stacks.items(): leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(name, count / total) for name, count in leaves.most_common(limit)]
+
+
+async def run(monitor, specs, speed=1.0, send_latency=0.0, bot_limits=False, profiler=None):
+    """
+    specs를 각 이벤트의 시각 t에 맞춰(speed배속, 0이면 기다리지 않음) handler에 넣고
+    모든 전달이 끝날 때까지 기다린 뒤 측정 결과를 dict로 반환합니다.
+    bot_limits가 False면 봇 전송 속도 제한을 풀어 처리 경로 자체의 성능만 측정합니다.
+    profiler(enable/disable을 가진 cProfile.Profile, SamplingProfiler 등)는 주입부터 모든 전달이 끝날 때까지만 켭니다.
+    """
+    user = FakeUserClient()
+    monitor.client = user
+    bots = []
+    for sender in monitor.bot_pool:
+        sender.client = FakeBotClient(send_latency)
+        bots.append(sender.client)
+        if not bot_limits:
+            sender.scheduler = monitor.SendScheduler(1e9, 1e9, 1e9, coalesce=monitor.SEND_COALESCE,
+                                                     max_flood_retries=sender.scheduler.max_flood_retries)
+    latencies = []
+    deliver = monitor.deliver
+
+    async def timed_deliver(job):
+        await deliver(job)
+        latencies.append(time.monotonic() - job.received_at)
+    monitor.deliver = timed_deliver
+
+    tasks = await monitor.start_pipeline()
+    try:
+        if not await monitor.resolve_routes():
+            raise RuntimeError("재생용 전달 대상을 해석하지 못했습니다.")
+        await monitor.apply_chat_filter()
+        monitor.clients_ready.set(); monitor.live_ready.set()
+        messages = [build_message(spec, user) for spec in specs]
+        rss_before, io_before = _rss_bytes(), _io_counters()
+        handlers = set()
+        if profiler is not None: profiler.enable()
+        started = time.monotonic()
+        for spec, message in zip(specs, messages):
+            if speed:
+                delay = started + spec.get('t', 0.0) / speed - time.monotonic()
+                if delay > 0: await asyncio.sleep(delay)
+            if spec.get('edit'): task = asyncio.create_task(monitor.edit_handler(events.MessageEdited.Event(message)))
+            else: task = asyncio.create_task(monitor.handler(events.NewMessage.Event(message)))
+            handlers.add(task); task.add_done_callback(handlers.discard)
+            if not speed: await asyncio.sleep(0)
+        injected = time.monotonic() - started
+        while handlers:
+            await asyncio.gather(*handlers)
+        await monitor.album_collector.wait_idle()
+        await monitor.delivery_queue.join()
+        elapsed = time.monotonic() - started
+        if profiler is not None: profiler.disable()
+        rss_after = _rss_bytes()
+    finally:
+        await monitor.stop_pipeline(tasks)
+        monitor.close_stores()
+        monitor.deliver = deliver
+    io_after = _io_counters()
+    stats = monitor.pipeline_stats
+    forwarded = stats['forwarded']
+    result = {
+        'events': len(specs), 'injected_seconds': injected, 'seconds': elapsed,
+        'rate': len(specs) / elapsed if elapsed else 0.0,
+        'forwarded': forwarded, 'sent': sum(bot.sent for bot in bots), 'stats': dict(stats),
+        'e2e_p50': _percentile(latencies, 50), 'e2e_p99': _percentile(latencies, 99),
+        'e2e_max': max(latencies, default=0.0),
+        'rss_growth': rss_after - rss_before, 'downloaded_bytes': user.downloaded_bytes,
+        'stages': monitor.metrics.format_stages(), 'loop_lag': monitor.loop_lag.format_stats(),
+        'bots': monitor.bot_pool.format_stats(),
+    }
+    if io_before and io_after:
+        result['write_calls'] = io_after[0] - io_before[0]
+        result['write_bytes'] = io_after[1] - io_before[1]
+    return result
+
+
+def format_result(result):
+    lines = [
+        f"이벤트 {result['events']}건: {result['seconds']:.2f}s ({result['rate']:.0f} msg/s, "
+        f"주입 {result['injected_seconds']:.2f}s)",
+        f"전달 {result['forwarded']}건 (봇 전송 {result['sent']}회), 종단 간 지연 p50 {result['e2e_p50'] * 1000:.1f}ms "
+        f"p99 {result['e2e_p99'] * 1000:.1f}ms 최대 {result['e2e_max'] * 1000:.1f}ms",
+        f"메모리 증가 {result['rss_growth'] / 1024 / 1024:.1f}MB, 가짜 다운로드 {result['downloaded_bytes'] // 1024}KB",
+    ]
+    if 'write_calls' in result:
+        per = max(1, result['forwarded'])
+        lines.append(f"디스크 쓰기 {result['write_calls']}회 / {result['write_bytes'] // 1024}KB "
+                     f"(전달 1건당 {result['write_calls'] / per:.1f}회, {result['write_bytes'] / per / 1024:.1f}KB, "
+                     f"로그 포함)")
+    lines.append(f"단계: {', '.join(f'{k}={v}' for k, v in sorted(result['stats'].items()))}")
+    lines.append(f"단계별 지연: {result['stages']}")
+    lines.append(f"루프 지연: {result['loop_lag']}")
+    lines.append(f"봇: {result['bots']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="기록한 업데이트를 가짜 클라이언트로 monitor.py 처리 경로에 재생")
+    parser.add_argument('files', nargs='+', help="CAPTURE_FILE로 기록한 JSONL 파일 (교체된 .1, .2 파일도 함께 지정 가능)")
+    parser.add_argument('--speed', type=float, default=1.0, help="재생 배속 (기본: 1 = 원래 속도, 0이면 최대 속도)")
+    parser.add_argument('--profile', choices=('cprofile', 'sample'), help="재생하는 동안 사용할 프로파일러")
+    parser.add_argument('--profile-output', help="프로파일 저장 파일 (cprofile: pstats, sample: collapsed stack)")
+    parser.add_argument('--sample-interval-ms', type=float, default=5.0, help="샘플링 프로파일러 간격 (ms)")
+    parser.add_argument('--top', type=int, default=25, help="출력할 상위 함수 수")
+    parser.add_argument('--send-latency-ms', type=float, default=0.0, help="가짜 봇 전송 1회당 지연 (ms)")
+    parser.add_argument('--bot-limits', action='store_true', help="봇 전송 속도 제한(초당 30건 등)을 그대로 적용")
+    parser.add_argument('--bots', type=int, default=1, help="봇 풀 크기 (가짜 봇 토큰 수)")
+    parser.add_argument('--rules', help="사용할 규칙 파일 (기본: open.kakao.com 기본 규칙)")
+    parser.add_argument('--data-dir', help="DB/로그를 둘 디렉터리 (기본: 새 임시 디렉터리)")
+    parser.add_argument('--log-level', default='WARNING', help="monitor 로그 수준")
+    args = parser.parse_args()
+
+    specs = load_events(*args.files)
+    if not specs:
+        print("재생할 이벤트가 없습니다."); sys.exit(1)
+    data_dir = prepare_environment(args.data_dir, args.rules, args.log_level, args.bots)
+    monitor = load_monitor()
+    profiler = None
+    if args.profile == 'cprofile':
+        profiler = cProfile.Profile()
+    elif args.profile == 'sample':
+        profiler = SamplingProfiler(args.sample_interval_ms / 1000)
+    span = specs[-1]['t']
+    print(f"이벤트 {len(specs)}건 (기록 구간 {span:.1f}s) 재생 "
+          f"({f'{args.speed:g}배속' if args.speed else '최대 속도'}, DB/로그: {data_dir})")
+    result = asyncio.run(run(monitor, specs, speed=args.speed, send_latency=args.send_latency_ms / 1000,
+                             bot_limits=args.bot_limits, profiler=profiler))
+    print(format_result(result))
+
+    if isinstance(profiler, cProfile.Profile):
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+            print(f"cProfile 결과 저장: {args.profile_output} (python -m pstats 또는 snakeviz로 확인)")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(args.top)
+    elif isinstance(profiler, SamplingProfiler):
+        if args.profile_output:
+            profiler.dump(args.profile_output)
+            print(f"샘플링 결과 저장: {args.profile_output} (collapsed stack, flamegraph.pl/speedscope로 확인)")
+        print(f"샘플 {sum(profiler.stacks.values())}개, 직접 실행 중이던 함수 상위 {args.top}개:")
+        for name, share in profiler.top(args.top):
+            print(f"  {share:6.1%}  {name}")
+
+
+if __name__ == "__main__":
+    main()
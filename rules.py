@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+메시지 매칭 규칙 엔진
+- 설정 파일(JSON)에서 포함(include)/제외(exclude) 규칙을 로드
+- 모든 규칙의 리터럴 키워드를 하나의 트라이(trie) 형태 정규식으로 컴파일하여
+  규칙 수와 관계없이 메시지를 한 번만 스캔
+- 정규식 규칙은 규칙마다 하나의 정규식으로 컴파일하여 각각 검사
+  (하나로 합친 정규식은 같은 위치에서 한 규칙만 매칭되어, 겹치는 포함/제외 정규식을 놓침)
+- 어떤 규칙이 매칭되었는지 반환
+- 라우팅 규칙: 포함 규칙과 출처 채팅 목록을 하나 이상의 대상 채널로 연결
+
+설정 파일 형식:
+{
+    "rules": [
+        {"name": "open_kakao", "action": "include", "terms": ["open.kakao.com"]},
+        {"name": "gambling", "action": "exclude", "terms": ["토토", "카지노"]},
+        {"name": "coin", "action": "exclude", "regex": ["코인\\\\s*리딩"]}
+    ],
+    "routes": [
+        {"name": "all", "rules": ["open_kakao"], "targets": ["me", "@my_channel"]},
+        {"name": "vip", "rules": ["open_kakao"], "chats": [-1001234567890], "targets": [-1009876543210]}
+    ]
+}
+routes가 없으면 모든 포함 규칙을 TARGET_CHANNEL 하나로 전달합니다.
+"""
+
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+
+
+class RuleError(ValueError):
+    """규칙 설정 파일 형식 오류"""
+
+
+class Rule:
+    __slots__ = ('name', 'action', 'terms', 'regex')
+
+    def __init__(self, name, action, terms=(), regex=()):
+        if action not in (INCLUDE, EXCLUDE):
+            raise RuleError(f"규칙 '{name}'의 action은 include 또는 exclude여야 합니다: {action}")
+        if not terms and not regex:
+            raise RuleError(f"규칙 '{name}'에 terms 또는 regex가 없습니다.")
+        self.name = name
+        self.action = action
+        self.terms = [t for t in terms if t]
+        self.regex = list(regex)
+
+
+class MatchResult:
+    """한 메시지에 대해 매칭된 포함/제외 규칙 이름"""
+    __slots__ = ('include', 'exclude')
+
+    def __init__(self):
+        self.include = []
+        self.exclude = []
+
+    @property
+    def matched(self):
+        return bool(self.include) and not self.exclude
+
+    def add(self, rule):
+        names = self.include if rule.action == INCLUDE else self.exclude
+        if rule.name not in names:
+            names.append(rule.name)
+
+
+def _trie_pattern(node):
+    """{문자: 하위 노드, '': True(단어 끝)} 형태의 트라이를 정규식 문자열로 변환합니다."""
+    is_end = '' in node
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+    body = '(?:' + '|'.join(branches) + ')'
+    return body + '?' if is_end else body
+
+
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._trie = {}
+        self._term_rules = {}  # 소문자 키워드 -> [Rule]
+        for rule in self.rules:
+            for term in rule.terms:
+                key = term.lower()
+                self._term_rules.setdefault(key, []).append(rule)
+                node = self._trie
+                for ch in key:
+                    node = node.setdefault(ch, {})
+                node[''] = True
+        # 각 위치에서 시작하는 가장 긴 키워드를 찾기 위해 lookahead로 감싸 겹치는 매칭도 모두 찾습니다.
+        self._literal_pattern = (re.compile('(?=(' + _trie_pattern(self._trie) + '))', re.IGNORECASE)
+                                 if self._trie else None)
+        self._regex_rules = []  # [(Rule, 규칙의 정규식을 합친 패턴)]
+        for rule in self.rules:
+            if not rule.regex:
+                continue
+            try:
+                pattern = re.compile('|'.join(f"(?:{p})" for p in rule.regex), re.IGNORECASE)
+            except re.error as e:
+                raise RuleError(f"규칙 '{rule.name}'의 정규식 오류: {e}")
+            self._regex_rules.append((rule, pattern))
+
+    @classmethod
+    def from_config(cls, config):
+        try:
+            rules = [Rule(r['name'], r.get('action', INCLUDE), r.get('terms', ()), r.get('regex', ()))
+                     for r in config.get('rules', [])]
+        except (KeyError, TypeError, AttributeError) as e:
+            raise RuleError(f"규칙 형식 오류: {e}")
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, path, extra_rules=()):
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        rule_set = cls.from_config(config)
+        return cls(rule_set.rules + list(extra_rules)) if extra_rules else rule_set
+
+    @property
+    def include_names(self):
+        return [r.name for r in self.rules if r.action == INCLUDE]
+
+    def match(self, text):
+        result = MatchResult()
+        if not text:
+            return result
+        if self._literal_pattern is not None:
+            for m in self._literal_pattern.finditer(text):
+                found = m.group(1).lower()
+                # 가장 긴 키워드의 접두사인 더 짧은 키워드도 규칙으로 인정합니다.
+                node = self._trie
+                for i, ch in enumerate(found):
+                    node = node.get(ch)
+                    if node is None:
+                        break
+                    if '' in node:
+                        for rule in self._term_rules.get(found[:i + 1], ()):
+                            result.add(rule)
+        for rule, pattern in self._regex_rules:
+            if pattern.search(text):
+                result.add(rule)
+        return result
+
+
+class Route:
+    """
+    포함 규칙 이름 집합과 출처 채팅 목록(비어 있으면 모든 채팅)을 대상 목록으로 연결합니다.
+    chats와 targets는 설정 파일에 적힌 그대로(숫자 ID 또는 @username) 보관하며 시작 시 해석합니다.
+    """
+    __slots__ = ('name', 'rules', 'chats', 'targets', 'chat_ids')
+
+    def __init__(self, name, rules, targets, chats=()):
+        if not targets:
+            raise RuleError(f"라우트 '{name}'에 targets가 없습니다.")
+        self.name = name
+        self.rules = frozenset(rules)
+        self.chats = list(chats)
+        self.targets = [str(t) for t in targets]
+        self.chat_ids = None  # 시작 시 해석된 출처 채팅 marked id 집합 (None이면 모든 채팅)
+
+    def applies(self, rule_names, chat_id):
+        if self.chat_ids is not None and chat_id not in self.chat_ids:
+            return False
+        return not self.rules.isdisjoint(rule_names)
+
+
+def load_routes(path, rule_set, default_target):
+    """규칙 파일의 routes를 로드합니다. 없으면 모든 포함 규칙을 default_target으로 보내는 라우트를 만듭니다."""
+    config = {}
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    include_names = set(rule_set.include_names)
+    routes = []
+    try:
+        for r in config.get('routes', []):
+            unknown = set(r.get('rules', ())) - include_names
+            if unknown:
+                raise RuleError(f"라우트 '{r['name']}'가 존재하지 않는 포함 규칙을 참조합니다: {', '.join(sorted(unknown))}")
+            routes.append(Route(r['name'], r.get('rules') or include_names, r.get('targets', ()), r.get('chats', ())))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise RuleError(f"라우트 형식 오류: {e}")
+    if not routes:
+        routes.append(Route('default', include_names, [default_target]))
+    return routes
+
+
+def load_rule_set(path, exclude_keywords=(), default_terms=('open.kakao.com',)):
+    """
+    규칙 파일이 있으면 로드하고, 없으면 기본 포함 키워드로 규칙을 만듭니다.
+    EXCLUDE_KEYWORDS 환경 변수의 키워드는 항상 'exclude_keywords' 제외 규칙으로 추가됩니다.
+    """
+    extra = []
+    exclude_terms = [k.strip() for k in exclude_keywords if k.strip()]
+    if exclude_terms:
+        extra.append(Rule('exclude_keywords', EXCLUDE, terms=exclude_terms))
+    if path and os.path.exists(path):
+        rule_set = RuleSet.from_file(path, extra)
+        logger.info(f"규칙 파일 로드: {path} (규칙 {len(rule_set.rules)}개)")
+        return rule_set
+    return RuleSet([Rule('open_kakao', INCLUDE, terms=list(default_terms))] + extra)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+대화 기록 일괄 검색 스크립트
+- setup_session.py로 만든 사용자 세션으로 참여 중인 모든 대화의 기록을 최근 N일까지 검색
+- monitor.py와 같은 규칙 파일(RULES_FILE)과 제외 키워드(EXCLUDE_KEYWORDS)로 매칭
+- 여러 대화를 제한된 동시성으로 병렬 검색하고 FloodWait는 기다린 뒤 이어서 진행
+- 매칭된 메시지는 찾는 즉시 JSONL 파일에 한 줄씩 기록 (메모리에 모아두지 않음)
+- 대화별 진행 위치를 체크포인트 파일에 기록하여 중단 후 다시 실행하면 이어서 검색
+- 세션 파일은 읽기만 하므로 monitor.py가 실행 중이어도 사용할 수 있음
+
+사용 예:
+    python scan_history.py --days 30 --output scan_results.jsonl
+    python scan_history.py --days 7 --concurrency 8 --fresh
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from telethon import TelegramClient, errors
+from telethon.sessions import SQLiteSession, StringSession
+from dotenv import load_dotenv
+from rules import load_rule_set
+from kakao_links import extract_links, message_scan_text
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_FILE = os.path.join(BASE_DIR, '.env')
+SESSIONS_DIR = os.path.join(BASE_DIR, 'sessions')
+CHECKPOINT_INTERVAL = 200  # 대화별 체크포인트 저장 주기 (검색한 메시지 수)
+MAX_FLOOD_RETRIES = 5
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler(sys.stdout)])
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    chat_id -> {"offset_id": 다음에 이어서 검색할 위치, "done": 완료 여부, "scanned", "matched"}
+    결과 파일을 flush한 뒤에 임시 파일에 쓰고 이름을 바꿔 저장하므로, 중단되더라도 체크포인트가
+    결과 파일보다 앞서지 않습니다. (마지막 저장 이후의 결과는 다시 실행할 때 한 번 더 기록될 수 있음)
+    """
+
+    def __init__(self, path, output):
+        self.path = path
+        self.output = output
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def get(self, chat_id):
+        return self.state.setdefault(str(chat_id), {'offset_id': 0, 'done': False, 'scanned': 0, 'matched': 0})
+
+    def save(self):
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+def dialog_kind(dialog):
+    if dialog.is_channel and not dialog.is_group: return 'channel'
+    if dialog.is_group: return 'group'
+    return 'user'
+
+
+def to_record(dialog, message, rule_match):
+    return {
+        'chat_id': dialog.id,
+        'chat': dialog.name,
+        'chat_type': dialog_kind(dialog),
+        'msg_id': message.id,
+        'date': message.date.isoformat(),
+        'sender_id': message.sender_id,
+        'rules': rule_match.include,
+        'links': extract_links(message),
+        'text': message.raw_text or "",
+    }
+
+
+async def scan_dialog(client, dialog, rule_set, since, checkpoint, output, semaphore, limit):
+    state = checkpoint.get(dialog.id)
+    if state['done']:
+        return
+    async with semaphore:
+        started = time.monotonic()
+        flood_retries = 0
+        while True:
+            try:
+                async for message in client.iter_messages(dialog.entity, offset_id=state['offset_id'], limit=limit):
+                    if message.date < since:
+                        break
+                    state['offset_id'] = message.id
+                    state['scanned'] += 1
+                    rule_match = rule_set.match(message_scan_text(message))
+                    if rule_match.matched:
+                        state['matched'] += 1
+                        output.write(json.dumps(to_record(dialog, message, rule_match), ensure_ascii=False) + "\n")
+                    if state['scanned'] % CHECKPOINT_INTERVAL == 0:
+                        checkpoint.save()
+                break
+            except errors.FloodWaitError as e:
+                flood_retries += 1
+                if flood_retries > MAX_FLOOD_RETRIES:
+                    logger.error(f"'{dialog.name}' FloodWait가 반복되어 건너뜁니다. 다시 실행하면 이어서 검색합니다.")
+                    checkpoint.save(); return
+                logger.warning(f"'{dialog.name}' 검색 중 FloodWait {e.seconds}초: 대기 후 이어서 검색합니다.")
+                checkpoint.save()
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                logger.error(f"'{dialog.name}' 검색 실패: {e}")
+                checkpoint.save(); return
+        state['done'] = True
+        checkpoint.save()
+        if state['matched']:
+            logger.info(f"'{dialog.name}': {state['scanned']}건 중 {state['matched']}건 매칭 "
+                        f"({time.monotonic() - started:.1f}s)")
+
+
+def open_session(session_name):
+    """monitor.py가 사용하는 세션 파일을 잠그지 않도록 인증 정보만 메모리 세션으로 복사합니다."""
+    session_path = os.path.join(SESSIONS_DIR, session_name)
+    if not os.path.exists(f"{session_path}.session"):
+        print(f"오류: 세션 파일({session_path}.session)을 찾을 수 없습니다. setup_session.py를 실행하세요.")
+        sys.exit(1)
+    sqlite_session = SQLiteSession(session_path)
+    try:
+        return StringSession(StringSession.save(sqlite_session))
+    finally:
+        sqlite_session.close()
+
+
+async def scan(args):
+    load_dotenv(ENV_FILE)
+    api_id, api_hash = os.getenv('API_ID'), os.getenv('API_HASH')
+    if not api_id or not api_hash:
+        print("오류: API_ID, API_HASH 환경 변수가 필요합니다. setup_session.py를 먼저 실행하세요."); sys.exit(1)
+    exclude_keywords = os.getenv('EXCLUDE_KEYWORDS', '').split(',') if os.getenv('EXCLUDE_KEYWORDS') else []
+    rules_file = os.getenv('RULES_FILE', os.path.join(BASE_DIR, 'rules.json'))
+    rule_set = load_rule_set(rules_file, exclude_keywords)
+
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint.json'
+    if args.fresh and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    resume = os.path.exists(checkpoint_path)
+    since = datetime.now(timezone.utc) - timedelta(days=args.days)
+    limit = args.limit or None
+
+    client = TelegramClient(open_session(os.getenv('SESSION_NAME', 'telegram_session')), int(api_id), api_hash)
+    await client.connect()
+    if not await client.is_user_authorized():
+        print("오류: 세션이 인증되지 않았습니다. setup_session.py를 다시 실행하세요."); sys.exit(1)
+    started = time.monotonic()
+    with open(args.output, 'a' if resume else 'w', encoding='utf-8') as output:
+        checkpoint = Checkpoint(checkpoint_path, output)
+        if resume:
+            logger.info(f"체크포인트에서 이어서 검색합니다: {checkpoint_path}")
+        semaphore = asyncio.Semaphore(args.concurrency)
+        dialogs = [d async for d in client.iter_dialogs() if d.message is not None and d.message.date >= since]
+        logger.info(f"최근 {args.days}일 안에 메시지가 있는 대화 {len(dialogs)}개 검색 (동시 {args.concurrency}개)")
+        await asyncio.gather(*(scan_dialog(client, d, rule_set, since, checkpoint, output, semaphore, limit)
+                               for d in dialogs))
+        checkpoint.save()
+    await client.disconnect()
+
+    states = [checkpoint.get(d.id) for d in dialogs]
+    matched_chats = sum(1 for s in states if s['matched'])
+    logger.info(f"검색 완료 ({time.monotonic() - started:.1f}s): 메시지 {sum(s['scanned'] for s in states)}건, "
+                f"매칭 {sum(s['matched'] for s in states)}건 / 대화 {matched_chats}개, "
+                f"미완료 대화 {sum(1 for s in states if not s['done'])}개 -> {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="참여 중인 모든 대화의 기록에서 규칙에 매칭되는 메시지 검색")
+    parser.add_argument('--days', type=int, default=30, help="검색할 기간 (일)")
+    parser.add_argument('--concurrency', type=int, default=4, help="동시에 검색하는 대화 수")
+    parser.add_argument('--output', default='scan_results.jsonl', help="결과 JSONL 파일")
+    parser.add_argument('--checkpoint', help="체크포인트 파일 (기본값: <output>.checkpoint.json)")
+    parser.add_argument('--limit', type=int, default=0, help="대화당 최대 검색 메시지 수 (0이면 제한 없음)")
+    parser.add_argument('--fresh', action='store_true', help="체크포인트를 무시하고 처음부터 다시 검색")
+    args = parser.parse_args()
+    args.concurrency = max(1, args.concurrency)
+    try:
+        asyncio.run(scan(args))
+    except KeyboardInterrupt:
+        print("\n검색이 중단되었습니다. 다시 실행하면 체크포인트에서 이어서 검색합니다.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+봇 전송 스케줄러
+- 전역 토큰 버킷(초당 30건)과 채팅별 토큰 버킷(채팅당 초당 1건, 그룹/채널은 분당 20건)으로 전송 속도 제한
+- FloodWaitError가 발생하면 해당 채팅을 e.seconds 동안 막고 메시지를 버리지 않고 다시 대기열에 넣음
+- 제한 때문에 같은 채팅에 쌓인 텍스트 메시지는 한 번의 전송으로 합침 (coalesce)
+- 제한으로 기다린 시간, FloodWait로 미뤄진 메시지 수 등 통계 제공
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque, Counter
+from telethon import errors, utils
+from telethon.tl.types import Channel, Chat
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """rate(초당 토큰)로 채워지고 최대 capacity개까지 쌓이는 토큰 버킷"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """토큰 1개를 쓸 수 있을 때까지 남은 시간(초)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class _Item:
+    __slots__ = ('kind', 'client', 'entity', 'payload', 'kwargs', 'future')
+
+    def __init__(self, kind, client, entity, payload, kwargs):
+        self.kind = kind
+        self.client = client
+        self.entity = entity
+        self.payload = payload
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class _ChatLane:
+    """채팅 하나의 대기열, 토큰 버킷, FloodWait 차단 시각"""
+    __slots__ = ('pending', 'buckets', 'blocked_until', 'task')
+
+    def __init__(self, buckets):
+        self.pending = deque()
+        self.buckets = buckets
+        self.blocked_until = 0.0
+        self.task = None
+
+
+class SendScheduler:
+    def __init__(self, global_rate=30.0, chat_rate=1.0, group_per_minute=20, coalesce=True, max_flood_retries=5):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.group_per_minute = group_per_minute
+        self.coalesce = coalesce
+        self.max_flood_retries = max_flood_retries
+        self.stats = Counter()  # sent, coalesced, flood_waits, deferred, failed
+        self.throttled_seconds = 0.0
+        self._lanes = {}
+
+    def _lane(self, entity):
+        key = utils.get_peer_id(entity)
+        lane = self._lanes.get(key)
+        if lane is None:
+            buckets = [TokenBucket(self.chat_rate, 1)]
+            if isinstance(entity, (Channel, Chat)):
+                buckets.append(TokenBucket(self.group_per_minute / 60.0, max(1.0, self.group_per_minute)))
+            lane = self._lanes[key] = _ChatLane(buckets)
+        return lane
+
+    def backlog(self, entity):
+        """이 채팅에 남은 FloodWait 차단 시간(초)과 대기 중인 메시지 수"""
+        lane = self._lanes.get(utils.get_peer_id(entity))
+        if lane is None:
+            return 0.0, 0
+        return max(0.0, lane.blocked_until - time.monotonic()), len(lane.pending)
+
+    async def send_message(self, client, entity, message, **kwargs):
+        return await self._submit(_Item('text', client, entity, message, kwargs))
+
+    async def send_file(self, client, entity, file, **kwargs):
+        return await self._submit(_Item('file', client, entity, file, kwargs))
+
+    async def _submit(self, item):
+        lane = self._lane(item.entity)
+        lane.pending.append(item)
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._drain(lane))
+        return await item.future
+
+    async def _wait_turn(self, lane):
+        while True:
+            now = time.monotonic()
+            wait = lane.blocked_until - now
+            if wait <= 0:
+                wait = max(self.global_bucket.delay(now), *(b.delay(now) for b in lane.buckets))
+                if wait <= 0:
+                    self.global_bucket.consume()
+                    for b in lane.buckets:
+                        b.consume()
+                    return
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def _take_batch(self, lane):
+        """대기열 앞의 항목을 꺼내고, 텍스트라면 뒤따르는 텍스트를 길이 제한 안에서 합칩니다."""
+        first = lane.pending.popleft()
+        batch = [first]
+        if self.coalesce and first.kind == 'text':
+            length = len(first.payload)
+            while lane.pending:
+                nxt = lane.pending[0]
+                if nxt.kind != 'text' or nxt.client is not first.client or nxt.kwargs != first.kwargs:
+                    break
+                length += len(COALESCE_SEPARATOR) + len(nxt.payload)
+                if length > MAX_MESSAGE_LENGTH:
+                    break
+                batch.append(lane.pending.popleft())
+        return batch
+
+    async def _drain(self, lane):
+        attempts = 0
+        while lane.pending:
+            await self._wait_turn(lane)
+            batch = self._take_batch(lane)
+            first = batch[0]
+            try:
+                if first.kind == 'text':
+                    text = COALESCE_SEPARATOR.join(item.payload for item in batch)
+                    result = await first.client.send_message(first.entity, text, **first.kwargs)
+                else:
+                    result = await first.client.send_file(first.entity, first.payload, **first.kwargs)
+            except errors.FloodWaitError as e:
+                attempts += 1
+                self.stats['flood_waits'] += 1
+                lane.blocked_until = time.monotonic() + e.seconds
+                logger.warning(f"FloodWait {e.seconds}초: 메시지 {len(batch)}건을 다시 대기열에 넣습니다. ({attempts}/{self.max_flood_retries})")
+                if attempts > self.max_flood_retries:
+                    if not self.max_flood_retries:
+                        # 재시도하지 않는 설정(봇 풀)이면 차단된 채팅에 쌓인 메시지도 바로 돌려보내 다른 봇으로 넘기게 합니다.
+                        batch.extend(lane.pending); lane.pending.clear()
+                    self._fail(batch, e)
+                    attempts = 0
+                else:
+                    self.stats['deferred'] += len(batch)
+                    lane.pending.extendleft(reversed(batch))
+                continue
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+            attempts = 0
+            self.stats['sent'] += 1
+            if len(batch) > 1:
+                self.stats['coalesced'] += len(batch) - 1
+                logger.info(f"제한 대기 중 쌓인 메시지 {len(batch)}건을 하나로 합쳐 전송했습니다.")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    def _fail(self, batch, exc):
+        self.stats['failed'] += len(batch)
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(exc)
+
+    def format_stats(self):
+        stats = ", ".join(f"{k}={v}" for k, v in sorted(self.stats.items())) or "없음"
+        return f"{stats}, 제한 대기 {self.throttled_seconds:.1f}s"
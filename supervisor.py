@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+여러 사용자 계정을 계정별 워커 프로세스로 실행하는 감독 프로세스
+- 계정 목록 파일(accounts.json)의 계정마다 monitor.py를 워커 프로세스로 실행
+- 워커들은 DATA_DIR의 해시 DB와 outbox DB를 함께 써서, 여러 계정이 받은 같은 메시지를 한 번만 전달
+- 프로세스 잠금, 채팅 처리 위치, 봇 세션, 로그 파일, 메트릭 포트는 계정(워커)별로 분리
+- 같은 봇 토큰을 쓰는 워커 수를 봇마다 세어 알려주고, 워커는 그 봇의 전송 속도 제한을 워커 수로 나눠 씀
+- 워커가 비정상 종료하면 지수 백오프로 다시 시작 (인증 오류 등으로 스스로 멈춘 워커는 다시 시작하지 않음)
+- SIGHUP을 받으면 모든 워커에 전달하여 설정을 다시 불러오게 함
+- Ctrl+C(SIGINT)나 SIGTERM을 받으면 모든 워커에 SIGINT를 보내 저장소를 정리하고 종료할 때까지 기다림
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from dotenv import dotenv_values
+from log_setup import setup_logging
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MONITOR_SCRIPT = os.path.join(BASE_DIR, 'monitor.py')
+SESSIONS_DIR = os.path.join(BASE_DIR, 'sessions')
+ENV_FILE = os.path.join(BASE_DIR, '.env')
+EXIT_NO_RESTART = 3  # monitor.EXIT_NO_RESTART와 같은 값 (다시 시작해도 해결되지 않는 종료)
+RESTART_MIN_DELAY = 1  # 워커 재시작 대기 시간 (초, 연속으로 실패하면 두 배씩 늘어남)
+RESTART_MAX_DELAY = 60
+STABLE_SECONDS = 60  # 이 시간 이상 실행된 워커가 종료되면 재시작 대기 시간을 처음으로 되돌림
+STOP_TIMEOUT = 20  # 종료 신호를 보낸 뒤 워커가 끝나기를 기다리는 최대 시간 (초)
+
+logger = logging.getLogger('supervisor')
+# .env 값은 감독 프로세스의 환경에 넣지 않습니다. 워커가 .env를 직접 읽어야 SIGHUP으로 다시 불러올 수 있습니다.
+dotenv_settings = {}
+
+
+def setting(key, default=''):
+    """monitor.py와 같은 우선순위(이미 설정된 환경 변수, .env, 기본값)로 설정 값을 읽습니다."""
+    return os.getenv(key) or dotenv_settings.get(key) or default
+
+
+class AccountError(ValueError):
+    pass
+
+
+class Account:
+    """
+    워커 하나로 실행할 사용자 계정. name은 워커 이름(로그 파일, 채팅 처리 위치 테이블, 봇 세션 구분)이며
+    env는 이 워커에만 적용할 추가 환경 변수입니다. (예: 계정마다 다른 BOT_TOKENS)
+    """
+    __slots__ = ('name', 'session', 'phone', 'env')
+
+    def __init__(self, name, session, phone=None, env=None):
+        if not re.fullmatch(r'\w+', name, re.ASCII):
+            raise AccountError(f"계정 이름 '{name}'에는 영문자, 숫자, 밑줄(_)만 사용할 수 있습니다.")
+        self.name = name
+        self.session = session
+        self.phone = phone
+        self.env = {k: str(v) for k, v in (env or {}).items()}
+
+    @property
+    def session_file(self):
+        return os.path.join(SESSIONS_DIR, f"{self.session}.session")
+
+
+def load_accounts(path):
+    """계정 목록 파일을 읽습니다. 형식: {"accounts": [{"name": ..., "session": ..., "phone": ..., "env": {...}}]}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    accounts = []
+    try:
+        for a in config['accounts']:
+            accounts.append(Account(a.get('name') or a['session'], a['session'], a.get('phone'), a.get('env')))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise AccountError(f"계정 목록 형식 오류: {e}")
+    if not accounts:
+        raise AccountError("계정이 하나도 없습니다.")
+    for field in ('name', 'session'):
+        values = [getattr(a, field) for a in accounts]
+        if len(set(values)) != len(values):
+            raise AccountError(f"계정의 {field}이(가) 중복됩니다.")
+    return accounts
+
+
+def worker_path(path, name):
+    """telegram_monitor.log -> telegram_monitor.<name>.log"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+
+def worker_env(account, index):
+    """워커 프로세스의 환경 변수. 공유 DB(DATA_DIR)는 그대로 두고 계정별로 달라야 하는 값만 바꿉니다."""
+    env = dict(os.environ)
+    env.update(WORKER_NAME=account.name, SESSION_NAME=account.session,
+               LOG_FILE=worker_path(setting('LOG_FILE', 'telegram_monitor.log'), account.name))
+    if account.phone: env['PHONE_NUMBER'] = account.phone
+    if setting('CAPTURE_FILE'): env['CAPTURE_FILE'] = worker_path(setting('CAPTURE_FILE'), account.name)
+    metrics_port = int(setting('METRICS_PORT', '9464'))
+    env['METRICS_PORT'] = str(metrics_port + index if metrics_port else 0)
+    env.update(account.env)
+    return env
+
+
+def bot_ids(env):
+    """워커가 쓰는 봇 ID (monitor.py처럼 워커 환경 변수가 .env보다 우선하며 BOT_TOKEN과 BOT_TOKENS를 합침)"""
+    def value(key):
+        return env[key] if key in env else dotenv_settings.get(key) or ''
+    tokens = [value('BOT_TOKEN')] + value('BOT_TOKENS').split(',')
+    return {t.strip().split(':', 1)[0] for t in tokens if t.strip()}
+
+
+def assign_rate_shares(workers):
+    """봇마다 그 봇을 쓰는 워커 수를 BOT_RATE_SHARES로 모든 워커에 알립니다."""
+    counts = Counter(bot for w in workers for bot in bot_ids(w.env))
+    shares = ','.join(f"{bot}:{n}" for bot, n in sorted(counts.items()))
+    for worker in workers: worker.env['BOT_RATE_SHARES'] = shares
+    shared = [f"{bot}({n}개)" for bot, n in sorted(counts.items()) if n > 1]
+    if shared:
+        logger.info(f"여러 워커가 함께 쓰는 봇의 전송 속도 제한을 워커 수로 나눕니다: {', '.join(shared)}")
+
+
+class Worker:
+    __slots__ = ('account', 'env', 'process', 'restarts')
+
+    def __init__(self, account, env):
+        self.account = account
+        self.env = env
+        self.process = None
+        self.restarts = 0
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+
+async def run_worker(worker, stopping):
+    """워커를 실행하고, 종료 신호를 받기 전에 끝나면 지수 백오프로 다시 시작합니다."""
+    name = worker.account.name
+    delay = RESTART_MIN_DELAY
+    while not stopping.is_set():
+        started = time.monotonic()
+        # 터미널의 Ctrl+C가 워커에 직접 전달되지 않도록 새 세션으로 실행하고, 종료는 감독 프로세스가 알립니다.
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, MONITOR_SCRIPT, env=worker.env,
+                                                              start_new_session=os.name != 'nt')
+        logger.info(f"워커 '{name}' 시작 (PID {worker.process.pid}, 세션: {worker.account.session})")
+        code = await worker.process.wait()
+        if stopping.is_set():
+            break
+        if code == EXIT_NO_RESTART:
+            logger.error(f"워커 '{name}'가 설정/인증 문제로 종료되어 다시 시작하지 않습니다. 로그를 확인하세요.")
+            return
+        if time.monotonic() - started >= STABLE_SECONDS:
+            delay = RESTART_MIN_DELAY
+        worker.restarts += 1
+        logger.warning(f"워커 '{name}'가 종료되었습니다 (종료 코드 {code}). {delay}초 후 다시 시작합니다. "
+                       f"(재시작 {worker.restarts}회째)")
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        delay = min(delay * 2, RESTART_MAX_DELAY)
+    if worker.process is not None:
+        logger.info(f"워커 '{name}' 종료 (종료 코드 {worker.process.returncode})")
+
+
+async def stop_worker(worker):
+    if not worker.running:
+        return
+    if os.name != 'nt': worker.process.send_signal(signal.SIGINT)
+    else: worker.process.terminate()
+    try:
+        await asyncio.wait_for(worker.process.wait(), timeout=STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"워커 '{worker.account.name}'가 {STOP_TIMEOUT}초 안에 끝나지 않아 강제로 종료합니다.")
+        worker.process.kill()
+        await worker.process.wait()
+
+
+def reload_workers(workers):
+    running = [w for w in workers if w.running]
+    logger.info(f"SIGHUP 수신: 워커 {len(running)}개에 설정 다시 불러오기를 알립니다.")
+    for worker in running: worker.process.send_signal(signal.SIGHUP)
+
+
+async def supervise(workers):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError: pass  # Windows는 KeyboardInterrupt로 처리
+    if hasattr(signal, 'SIGHUP'): loop.add_signal_handler(signal.SIGHUP, reload_workers, workers)
+    tasks = [asyncio.create_task(run_worker(w, stopping)) for w in workers]
+    stop_wait = asyncio.create_task(stopping.wait())
+    try:
+        # 종료 신호를 받거나 모든 워커가 재시작하지 않는 상태로 끝날 때까지 기다립니다.
+        await asyncio.wait([stop_wait, asyncio.gather(*tasks)], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopping.set()
+        logger.info("모든 워커를 종료합니다...")
+        await asyncio.gather(*(stop_worker(w) for w in workers))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stop_wait.cancel()
+
+
+def main():
+    if os.path.exists(ENV_FILE):
+        dotenv_settings.update(dotenv_values(ENV_FILE))
+    parser = argparse.ArgumentParser(description="여러 계정을 계정별 워커 프로세스로 모니터링")
+    parser.add_argument('accounts', nargs='?', default=setting('ACCOUNTS_FILE', os.path.join(BASE_DIR, 'accounts.json')),
+                        help="계정 목록 파일 (기본값: ACCOUNTS_FILE 또는 accounts.json)")
+    args = parser.parse_args()
+
+    log_level = getattr(logging, setting('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    setup_logging(log_level, worker_path(setting('LOG_FILE', 'telegram_monitor.log'), 'supervisor'),
+                  json_format=setting('LOG_FORMAT', 'text').lower() == 'json')
+    try:
+        accounts = load_accounts(args.accounts)
+    except (OSError, ValueError) as e:
+        logger.error(f"계정 목록 파일({args.accounts})을 읽을 수 없습니다: {e}"); sys.exit(1)
+
+    workers = []
+    for index, account in enumerate(accounts):
+        if not os.path.exists(account.session_file):
+            logger.error(f"계정 '{account.name}'의 세션 파일({account.session_file})이 없어 건너뜁니다. "
+                         f"SESSION_NAME={account.session}으로 setup_session.py를 실행하세요.")
+            continue
+        try:
+            workers.append(Worker(account, worker_env(account, index)))
+        except ValueError:
+            logger.error("METRICS_PORT는 숫자여야 합니다."); sys.exit(1)
+    if not workers:
+        logger.error("실행할 계정이 없습니다."); sys.exit(1)
+    assign_rate_shares(workers)
+    logger.info(f"계정 {len(workers)}개의 워커를 시작합니다. (공유 DB: {setting('DATA_DIR', BASE_DIR)})")
+    asyncio.run(supervise(workers))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n프로그램이 중단되었습니다.")